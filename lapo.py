@@ -1,6 +1,15 @@
 #!/usr/bin/env python3
 import argparse
-from src.lapo import lapo
+import asyncio
+import json
+import re
+import sys
+from contextlib import nullcontext
+from dataclasses import asdict
+from src.batch import DEFAULT_CONCURRENCY, BatchResult, lapo_batch, read_lines
+from src.lapo import RETRIEVAL_MODES, lapo
+from src.metrics import Budget, StageMetrics
+from src.run_ledger import LEDGER_PATH
 
 
 def parse_args():
@@ -11,8 +20,99 @@ def parse_args():
         help="Path to the documentation. Relative to the root of the plugin-tools repository",
     )
     parser.add_argument("--docs-repo", required=True, help="GitHub repository link in the format owner/repo")
-    parser.add_argument("--source-change-pr", required=True, help="Full URL of the source change PR")
-    return parser.parse_args()
+    parser.add_argument(
+        "--source-change-pr",
+        action="append",
+        default=[],
+        help="Full URL of the source change PR. Can be repeated to process several PRs in one batch",
+    )
+    parser.add_argument(
+        "--pr-list",
+        default=None,
+        help="File with one source change PR URL per line, '-' reads them from stdin as they arrive. Runs in batch mode",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help="In batch mode, how many PRs are processed at the same time",
+    )
+    parser.add_argument(
+        "--retrieval-mode",
+        choices=RETRIEVAL_MODES,
+        default="direct",
+        help="'direct' runs the vector search from the pipeline, 'agent' lets the docs search agent drive it",
+    )
+    parser.add_argument(
+        "--skip-relevance-below",
+        type=float,
+        default=None,
+        help="In direct mode, skip the LLM relevance check when all retrieved chunks are within this distance",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        default=None,
+        help="Write the JSON metrics report of the run to this file, in batch mode the results of all PRs",
+    )
+    parser.add_argument("--max-seconds", type=float, default=None, help="Abort the run after this many seconds")
+    parser.add_argument(
+        "--max-total-tokens", type=int, default=None, help="Abort the run when the LLMs used more tokens than this"
+    )
+    parser.add_argument(
+        "--max-requests", type=int, default=None, help="Abort the run when it made more LLM requests than this"
+    )
+    parser.add_argument(
+        "--run-ledger",
+        default=LEDGER_PATH,
+        help="SQLite file recording finished runs, a rerun with the same PR head, docs commit and index is skipped",
+    )
+    parser.add_argument("--no-run-ledger", action="store_true", help="Do not read or record finished runs")
+    parser.add_argument(
+        "--force", action="store_true", help="Run even when the run ledger already has the outcome, then record it"
+    )
+    args = parser.parse_args()
+    if not args.source_change_pr and args.pr_list is None:
+        parser.error("one of --source-change-pr or --pr-list is required")
+    return args
+
+
+def print_stage(stage: StageMetrics) -> None:
+    print(f"Stage {stage.name}: {stage.status} in {stage.seconds:.2f}s")
+
+
+def print_pr_stage(pr_url: str, stage: StageMetrics) -> None:
+    print(f"{pr_url} stage {stage.name}: {stage.status} in {stage.seconds:.2f}s")
+
+
+def print_result(result: BatchResult) -> None:
+    print(f"{result.pr_url}: {result.status} in {result.seconds:.2f}s" + (f" ({result.error})" if result.error else ""))
+
+
+PR_URL_RE = re.compile(r"^https://github\.com/[^/\s]+/[^/\s]+/pull/\d+/?$")
+
+
+async def pr_list_urls(pr_list: str | None, urls: list[str]):
+    """The PR URLs given on the command line, then the ones of `pr_list`.
+
+    Invalid URLs of the list are reported and skipped, so a typo does not stop a batch reading stdin.
+    """
+    for url in urls:
+        yield url
+    if pr_list is None:
+        return
+    with nullcontext(sys.stdin) if pr_list == "-" else open(pr_list) as stream:
+        async for url in read_lines(stream):
+            try:
+                validate_pr_url(url)
+            except ValueError as e:
+                print(f"Skipping {url!r}: {e}", file=sys.stderr)
+                continue
+            yield url
+
+
+def validate_pr_url(url: str) -> None:
+    if not PR_URL_RE.match(url):
+        raise ValueError("Source change PR must be in the format https://github.com/owner/repo/pull/123")
 
 
 if __name__ == "__main__":
@@ -21,12 +121,48 @@ if __name__ == "__main__":
     print("LAPO - LLM Agent Patcher of Docs")
     print(f"Docs Path: {args.docs_path}")
     print(f"Docs Repo: {args.docs_repo}")
-    print(f"Source Change PR: {args.source_change_pr}")
+    print(f"Source Change PR: {', '.join(args.source_change_pr) or args.pr_list}")
 
     if args.docs_repo.startswith("http"):
         raise ValueError("Docs repo must be in the format owner/repo")
 
-    if not args.source_change_pr.startswith("https://github.com/"):
-        raise ValueError("Source change PR must be in the format https://github.com/owner/repo/pull/123")
+    for url in args.source_change_pr:
+        validate_pr_url(url)
+
+    ledger_path = None if args.no_run_ledger else args.run_ledger
+    budget = Budget(max_seconds=args.max_seconds, max_total_tokens=args.max_total_tokens, max_requests=args.max_requests)
 
-    lapo(docs_repo=args.docs_repo, docs_path=args.docs_path, source_change_pr=args.source_change_pr)
+    if args.pr_list is None and len(args.source_change_pr) == 1:
+        lapo(
+            docs_repo=args.docs_repo,
+            docs_path=args.docs_path,
+            source_change_pr=args.source_change_pr[0],
+            retrieval_mode=args.retrieval_mode,
+            auto_accept_distance=args.skip_relevance_below,
+            budget=budget,
+            metrics_path=args.metrics_file,
+            on_stage=print_stage,
+            ledger_path=ledger_path,
+            force=args.force,
+        )
+    else:
+        results = asyncio.run(
+            lapo_batch(
+                docs_repo=args.docs_repo,
+                docs_path=args.docs_path,
+                pr_urls=pr_list_urls(args.pr_list, args.source_change_pr),
+                concurrency=args.concurrency,
+                retrieval_mode=args.retrieval_mode,
+                auto_accept_distance=args.skip_relevance_below,
+                budget=budget,
+                on_stage=print_pr_stage,
+                on_result=print_result,
+                ledger_path=ledger_path,
+                force=args.force,
+            )
+        )
+        if args.metrics_file:
+            with open(args.metrics_file, "w") as f:
+                json.dump([asdict(result) for result in results], f, indent=2)
+        if any(result.status == "error" for result in results):
+            exit(1)
@@ -1,13 +1,24 @@
 from dataclasses import dataclass
+import json
 import time
 from typing import Dict, Iterable, List
 from pydantic import BaseModel, Field
 from pydantic_ai import Agent, RunContext
+from pydantic_ai.usage import Usage, UsageLimits
 from pydantic_ai.models.anthropic import AnthropicModel
 from pydantic_ai.models.gemini import GeminiModel
 from rich import print as rprint
-from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import Embeddings
+from src.functions.diff_parser import (
+    DEFAULT_QUERY_MAX_CHARS,
+    build_retrieval_query,
+    group_by_file,
+    parse_unified_diff,
+    split_lines,
+)
 from src.rag import rag
+from src.rag import retrieval
+from src.rag.vector_index import VectorIndex
 import logging
 
 
@@ -18,6 +29,16 @@ class RelatedDocumentationChunk(BaseModel):
         description="Name of the file in the documentation git repository where the documentation chunk is located."
     )
     chunk_content: str = Field(description="The content of the original documentation chunk.")
+    heading_path: str = Field(
+        default="",
+        description="The markdown headings under which the chunk is located, separated by ' > '.",
+    )
+    start_line: int | None = Field(
+        default=None, description="The line in the documentation file where the chunk starts (1-based)."
+    )
+    end_line: int | None = Field(
+        default=None, description="The line in the documentation file where the chunk ends (inclusive)."
+    )
     distance: float = Field(
         description="The distance between the provided git diff and the documentation chunk. 0 is the exact match and higher means further apart.",
     )
@@ -43,7 +64,8 @@ class PRFileChange(BaseModel):
 
 @dataclass
 class Deps:
-    vectordb: FAISS
+    vectordb: VectorIndex
+    embeddings: Embeddings
 
 
 agent = Agent(
@@ -68,16 +90,40 @@ agent = Agent(
 )  # , instrument=True)
 
 
+# Used by the direct retrieval mode: the pipeline splits the diff and runs the vector
+# search itself, the model only judges which of the retrieved chunks need an update.
+relevance_agent = Agent(
+    "openai:gpt-4o-2024-08-06",
+    system_prompt=[
+        "You are specialized in finding documentation sections that should be updated for a given code change, provided in the form of a git diff."
+        "You are given, for each changed source file, the documentation chunks that are most similar to its diff according to a vector search."
+        "Determine which of these documentation chunks should be updated when the provided code changes are applied, and describe the required changes."
+        "Only return chunks from the provided list, copying them verbatim."
+        "Notice  it is perfectly possible that the changes in the provided git diff hunk are not related to any documentation."
+    ],
+    result_type=List[Changes],
+    retries=5,
+)
+
+
 def question(diff_hunk: str) -> str:
     return f"Find the documentation chunks that should be updated when the provided code changes are applied:\n```diff\n{diff_hunk}\n```"
 
 
+def relevance_question(related: Dict[str, List[RelatedDocumentationChunk]]) -> str:
+    payload = {k: [chunk.model_dump() for chunk in v] for k, v in related.items()}
+    return (
+        "Determine which of the following documentation chunks should be updated when the code changes in their "
+        f"`diff` are applied. The chunks are grouped by the changed source file:\n```json\n{json.dumps(payload)}\n```"
+    )
+
+
 logger = logging.getLogger(__name__)
 
 
 @agent.tool(retries=5)
-def find_relevant_documentation(
-    context: RunContext[Deps], diffs: Iterable[PRFileChange]
+async def find_relevant_documentation(
+    context: RunContext[Deps], diffs: List[PRFileChange]
 ) -> Dict[str, List[RelatedDocumentationChunk]]:
     """Retrieve documentation text chunks that should be updated after applying the provided git diffs.
 
@@ -86,41 +132,167 @@ def find_relevant_documentation(
       diff: A list of git diff hunks that represent the changes made in the code.
     Returns:
         A dictionary with the file names as keys and a list of related documentation chunks as values.
-        The list is sorted by the distance between the provided git diff and the documentation chunk, which
-        means the most relevant chunks are at the beginning of the list.
+        The most relevant chunks are at the beginning of the list. Every documentation chunk is listed
+        only once, under the source file it is closest to.
     """
+    results = await retrieval.search_async(
+        context.deps.vectordb,
+        context.deps.embeddings,
+        [(diff.file_path, retrieval_query(diff)) for diff in diffs],
+        k=rag.RETRIEVAL_K,
+        max_distance=rag.RETRIEVAL_MAX_DISTANCE,
+        mmr_lambda=rag.RETRIEVAL_MMR_LAMBDA,
+        fetch_k=rag.RETRIEVAL_FETCH_K,
+    )
+    return to_related_chunks(diffs, retrieval.deduplicate(results, rag.RETRIEVAL_MAX_CHUNKS_PER_FILE))
+
+
+def search_related_documentation(deps: Deps, diffs: List[PRFileChange]) -> Dict[str, List[RelatedDocumentationChunk]]:
+    """Synchronous variant of `find_relevant_documentation`, for callers outside of the agent."""
+    results = retrieval.search(
+        deps.vectordb,
+        deps.embeddings,
+        [(diff.file_path, retrieval_query(diff)) for diff in diffs],
+        k=rag.RETRIEVAL_K,
+        max_distance=rag.RETRIEVAL_MAX_DISTANCE,
+        mmr_lambda=rag.RETRIEVAL_MMR_LAMBDA,
+        fetch_k=rag.RETRIEVAL_FETCH_K,
+    )
+    return to_related_chunks(diffs, retrieval.deduplicate(results, rag.RETRIEVAL_MAX_CHUNKS_PER_FILE))
+
+
+def retrieval_query(diff: PRFileChange) -> str:
+    """Build a bounded search query from the changed lines and symbols of a file diff."""
+    file_diffs = [f for f in group_by_file(parse_unified_diff(split_lines(diff.patch), diff.file_path)) if f.hunks]
+    if not file_diffs:
+        return diff.patch[:DEFAULT_QUERY_MAX_CHARS]
+    return "\n\n".join(build_retrieval_query(f) for f in file_diffs)[:DEFAULT_QUERY_MAX_CHARS]
+
+
+def to_related_chunks(
+    diffs: List[PRFileChange], results: Dict[str, List[retrieval.RetrievalHit]]
+) -> Dict[str, List[RelatedDocumentationChunk]]:
     ret: Dict[str, List[RelatedDocumentationChunk]] = {}
     for diff in diffs:
-        search_results = context.deps.vectordb.similarity_search_with_score(diff.patch, k=5)
-
-        if not search_results:
+        hits = results.get(diff.file_path)
+        if not hits:
             logger.info(f"No related documents found for diff {diff.file_path}")
             continue
 
-        chunks: List[RelatedDocumentationChunk] = []
-
-        for doc, score in search_results:
-            chunks.append(
-                RelatedDocumentationChunk(
-                    chunk_content=doc.page_content,
-                    file_name=doc.metadata["file_name"],
-                    distance=float(score),
-                    diff=diff.patch,
-                )
+        ret[diff.file_path] = [
+            RelatedDocumentationChunk(
+                chunk_content=hit.chunk.page_content,
+                file_name=hit.chunk.metadata["file_name"],
+                heading_path=hit.chunk.metadata.get("heading_path", ""),
+                start_line=hit.chunk.metadata.get("start_line"),
+                end_line=hit.chunk.metadata.get("end_line"),
+                distance=hit.distance,
+                diff=diff.patch,
             )
-        ret[diff.file_path] = chunks
-
-    for k, v in ret.items():
-        ret[k] = sorted(v, key=lambda x: x.distance)
+            for hit in hits
+        ]
 
     logger.info(f"Found {len(ret)} related documentation chunks")
     return ret
 
 
+def file_changes_from_diff(diff_hunk: str | Iterable[str]) -> List[PRFileChange]:
+    """Split a PR diff into one `PRFileChange` per changed text file, without asking the model.
+
+    The diff is a string or its lines, e.g. `PullRequestDiff.lines()` to parse it without loading it whole.
+    """
+    lines = split_lines(diff_hunk) if isinstance(diff_hunk, str) else diff_hunk
+    return [
+        PRFileChange(file_path=file_diff.path, patch=file_diff.to_patch())
+        for file_diff in group_by_file(parse_unified_diff(lines))
+        if file_diff.hunks and not file_diff.is_binary
+    ]
+
+
+def changes_from_related(related: Dict[str, List[RelatedDocumentationChunk]]) -> List[Changes]:
+    return [
+        Changes(
+            original_documentation_chunk=chunk,
+            changes_description=f"Check whether this documentation is affected by the changes to `{file_path}`.",
+        )
+        for file_path, chunks in related.items()
+        for chunk in chunks
+    ]
+
+
+def judge_relevance(
+    related: Dict[str, List[RelatedDocumentationChunk]],
+    auto_accept_distance: float | None = None,
+    usage: Usage | None = None,
+    usage_limits: UsageLimits | None = None,
+) -> List[Changes]:
+    """Ask `relevance_agent` which of the retrieved chunks need an update.
+
+    Every chunk is accepted without an LLM call when all of them are closer than `auto_accept_distance`.
+    `usage` and `usage_limits` are passed to the agent run.
+    """
+    accepted = _accept_without_judgment(related, auto_accept_distance)
+    if accepted is not None:
+        return accepted
+
+    logger.info("Running relevance agent")
+    result = relevance_agent.run_sync(relevance_question(related), usage=usage, usage_limits=usage_limits)
+    return result.data
+
+
+async def judge_relevance_async(
+    related: Dict[str, List[RelatedDocumentationChunk]],
+    auto_accept_distance: float | None = None,
+    usage: Usage | None = None,
+    usage_limits: UsageLimits | None = None,
+) -> List[Changes]:
+    """Asynchronous variant of `judge_relevance`."""
+    accepted = _accept_without_judgment(related, auto_accept_distance)
+    if accepted is not None:
+        return accepted
+
+    logger.info("Running relevance agent")
+    result = await relevance_agent.run(relevance_question(related), usage=usage, usage_limits=usage_limits)
+    return result.data
+
+
+def _accept_without_judgment(
+    related: Dict[str, List[RelatedDocumentationChunk]], auto_accept_distance: float | None
+) -> List[Changes] | None:
+    """The changes to return without an LLM call, or None if the relevance agent has to judge the chunks."""
+    if not related:
+        return []
+
+    if auto_accept_distance is not None and all(
+        chunk.distance <= auto_accept_distance for chunks in related.values() for chunk in chunks
+    ):
+        logger.info(f"All chunks are closer than {auto_accept_distance}, skipping the relevance judgment")
+        return changes_from_related(related)
+
+    return None
+
+
+def find_documentation_changes(
+    diff_hunk: str, deps: Deps, auto_accept_distance: float | None = None
+) -> List[Changes]:
+    """Direct retrieval mode: find the documentation to update without the search agent.
+
+    The diff is split per file and searched in-process. The retrieved chunks are sent to
+    `relevance_agent` for a relevance judgment, unless every chunk is closer than
+    `auto_accept_distance`, in which case they are all returned without an LLM call.
+    """
+    diffs = file_changes_from_diff(diff_hunk)
+    logger.info(f"Split diff into {len(diffs)} files")
+    if not diffs:
+        return []
+    return judge_relevance(search_related_documentation(deps, diffs), auto_accept_distance)
+
+
 def deps() -> Deps:
-    if rag.vectordb is None:
+    vectordb = rag.get_vectordb()
+    if vectordb is None:
         raise ValueError("Vectorstore not initialized. Please run generate_embeddings.py first.")
-    return Deps(vectordb=rag.vectordb)
+    return Deps(vectordb=vectordb, embeddings=rag.get_embeddings())
 
 
 def run_agent(diffs: List[PRFileChange]) -> None:
@@ -1,11 +1,14 @@
 from posix import wait
-from dataclasses import dataclass
-from typing import TypedDict
+from dataclasses import dataclass, field
+from typing import List, NotRequired, Optional, TypedDict
 from pydantic import BaseModel, Field
 from pydantic_ai import Agent, RunContext, ModelRetry
 from pydantic_ai.models.anthropic import AnthropicModel
 import os
 import textwrap
+from src.tools.document_store import DocumentStore
+from src.tools.search_replace.search_replace_apply import ApplyFailure, dry_run_search_replace
+from src.tools.search_replace.search_replace_parser import format_pairs
 from src.tools.search_replace.search_replace_validator import validate_patch as validate_patch_impl
 import logging
 
@@ -28,11 +31,34 @@ class DocumentContent(TypedDict):
     file_path: str
     content: str
     exists: bool
+    # set when only part of the document is returned, 1-based and inclusive
+    start_line: NotRequired[int]
+    end_line: NotRequired[int]
+    total_lines: NotRequired[int]
+
+
+class DocumentSection(TypedDict):
+    level: int
+    title: str
+    start_line: int
+    end_line: int
+
+
+class DocumentOutline(TypedDict):
+    file_path: str
+    exists: bool
+    total_lines: int
+    sections: List[DocumentSection]
 
 
 @dataclass
 class Deps:
     docs_repo_path: str
+    # per-run cache of the documents served to the agent
+    documents: DocumentStore = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.documents = DocumentStore(self.docs_repo_path)
 
 
 generate_patch_prompt = textwrap.dedent(
@@ -47,6 +73,9 @@ generate_patch_prompt = textwrap.dedent(
 
     you must only change the content of the document that is affected by the code change (diff)
     use the `get_document` tool to get the full content of a document.
+    for long documents, use the `get_document_outline` tool to list its sections with their line ranges, then
+    `get_document` with `start_line`/`end_line` or `section` to read only the part you need.
+    the chunks you are given include their `start_line` and `end_line` in the document when known.
     use the `validate_patch` tool to validate the generated patch. it should return OK if the patch is valid
 
     Describe each change with a *SEARCH/REPLACE block* per the examples below.
@@ -103,24 +132,98 @@ generate_patch_agent = Agent(
 
 
 @generate_patch_agent.tool(retries=5)
-async def get_document(ctx: RunContext[Deps], file_name: str) -> DocumentContent:
-    logger.info(f"get_document {file_name}")
-    file_path = os.path.join(ctx.deps.docs_repo_path, file_name)
-    if not os.path.exists(file_path):
+async def get_document(
+    ctx: RunContext[Deps],
+    file_name: str,
+    start_line: Optional[int] = None,
+    end_line: Optional[int] = None,
+    section: Optional[str] = None,
+) -> DocumentContent:
+    """Get the content of a documentation file.
+
+    Args:
+        ctx: The call context.
+        file_name: Path of the file in the documentation repository.
+        start_line: First line to return (1-based). Returns the whole document when no range or section is given.
+        end_line: Last line to return (inclusive).
+        section: Title or heading path (e.g. "Install > Linux") of a section to return instead of a line range.
+    """
+    logger.info(f"get_document {file_name} {start_line=} {end_line=} {section=}")
+    document = ctx.deps.documents.get(file_name)
+    if document is None:
         return {"file_path": file_name, "content": "", "exists": False}
-    with open(file_path, "r") as f:
-        return {"file_path": file_name, "content": f.read(), "exists": True}
+    if section is not None:
+        entry = document.find_section(section)
+        if entry is None:
+            raise ModelRetry(f"Section {section!r} not found in {file_name}, use `get_document_outline` to list them")
+        start_line, end_line = entry.start_line, entry.end_line
+    if start_line is None and end_line is None:
+        return {"file_path": file_name, "content": document.content, "exists": True}
+    start, end, content = document.line_range(start_line, end_line)
+    return {
+        "file_path": file_name,
+        "content": content,
+        "exists": True,
+        "start_line": start,
+        "end_line": end,
+        "total_lines": document.total_lines,
+    }
+
+
+@generate_patch_agent.tool(retries=5)
+async def get_document_outline(ctx: RunContext[Deps], file_name: str) -> DocumentOutline:
+    """List the sections of a documentation file with their line ranges.
+
+    Args:
+        ctx: The call context.
+        file_name: Path of the file in the documentation repository.
+    """
+    logger.info(f"get_document_outline {file_name}")
+    document = ctx.deps.documents.get(file_name)
+    if document is None:
+        return {"file_path": file_name, "exists": False, "total_lines": 0, "sections": []}
+    return {
+        "file_path": file_name,
+        "exists": True,
+        "total_lines": document.total_lines,
+        "sections": [
+            {"level": entry.level, "title": entry.title, "start_line": entry.start_line, "end_line": entry.end_line}
+            for entry in document.table_of_contents()
+        ],
+    }
+
+
+def describe_apply_failures(failures: List[ApplyFailure]) -> str:
+    lines = ["The patch does not apply to the documentation repository:"]
+    for failure in failures:
+        if failure.pair is None:
+            lines.append(f"- {failure.file_path}: {failure.reason}")
+            continue
+        lines.append(f"- {failure.file_path}, block starting at patch line {failure.pair.start_line}: {failure.reason}")
+        lines.append(format_pairs(failure.file_path, [failure.pair]))
+    lines.append(
+        "Use the `get_document` tool to read the current content and copy the SEARCH lines exactly as they are."
+    )
+    return "\n".join(lines)
 
 
 @generate_patch_agent.result_validator
-async def validate_patch(result: PullRequestContent) -> PullRequestContent:
+async def validate_patch(ctx: RunContext[Deps], result: PullRequestContent) -> PullRequestContent:
     logger.info("validating patch")
     try:
         is_ok = validate_patch_impl(result.patch_diff)
-        if is_ok == "OK":
-            logger.info("Patch is valid")
-            return result
-        raise ModelRetry("Patch is invalid")
     except Exception as e:
         logger.error(f"validate_patch exception: {e}")
         raise ModelRetry(str(e))
+    if is_ok != "OK":
+        raise ModelRetry("Patch is invalid")
+
+    # Catch SEARCH sections that do not match before any branch or PR is created
+    failures = dry_run_search_replace(ctx.deps.docs_repo_path, result.patch_diff)
+    if failures:
+        message = describe_apply_failures(failures)
+        logger.error(f"validate_patch dry run failed: {message}")
+        raise ModelRetry(message)
+
+    logger.info("Patch is valid")
+    return result
@@ -0,0 +1,164 @@
+"""
+Batch mode: run lapo for many source PRs against one docs repo in one process.
+
+The vector index and embeddings client are loaded once, then every PR is
+processed in its own git worktree of the docs repo mirror with at most
+`concurrency` PRs in flight. PR URLs can come from a list or from an async
+iterator, e.g. lines read from stdin, so the process can keep running and take
+new PRs as they arrive. The mirror is synced again before a worktree is added
+once `mirror_sync_interval` seconds have passed since the last sync, so PRs
+taken later branch from the current docs main.
+"""
+import asyncio
+import logging
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List
+
+from src.agents import docs_search_agent
+from src.functions import git_worktree
+from src.functions.git_pr import MAIN_BRANCH
+from src.lapo import lapo_async
+from src.metrics import Budget, StageMetrics
+from src import run_ledger
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 4
+# seconds, a sync that finds the mirror up to date costs one `git ls-remote`
+DEFAULT_MIRROR_SYNC_INTERVAL = 60.0
+
+
+@dataclass
+class BatchResult:
+    pr_url: str
+    # "ok" or "error"
+    status: str
+    seconds: float
+    error: str | None = None
+    metrics: Dict[str, Any] = field(default_factory=dict)
+
+
+async def read_lines(stream=None) -> AsyncIterator[str]:
+    """Yield the non-empty lines of `stream` (stdin by default) as they arrive, without blocking the event loop."""
+    stream = stream or sys.stdin
+    while True:
+        line = await asyncio.to_thread(stream.readline)
+        if not line:
+            return
+        if line.strip():
+            yield line.strip()
+
+
+async def _iterate(pr_urls: Iterable[str] | AsyncIterator[str]) -> AsyncIterator[str]:
+    if hasattr(pr_urls, "__aiter__"):
+        async for pr_url in pr_urls:
+            yield pr_url
+    else:
+        for pr_url in pr_urls:
+            yield pr_url
+
+
+async def lapo_batch(
+    docs_repo: str,
+    docs_path: str,
+    pr_urls: Iterable[str] | AsyncIterator[str],
+    concurrency: int = DEFAULT_CONCURRENCY,
+    retrieval_mode: str = "direct",
+    auto_accept_distance: float | None = None,
+    budget: Budget | None = None,
+    on_stage: Callable[[str, StageMetrics], None] | None = None,
+    on_result: Callable[[BatchResult], None] | None = None,
+    ledger_path: str | None = run_ledger.LEDGER_PATH,
+    force: bool = False,
+    mirror_sync_interval: float = DEFAULT_MIRROR_SYNC_INTERVAL,
+) -> List[BatchResult]:
+    """
+    Args:
+        docs_repo (str): Docs repo in the format owner/repo
+        docs_path (str): Path to the docs relative to the root of the docs repo
+        pr_urls (Iterable[str] | AsyncIterator[str]): Source PRs in the format https://github.com/owner/repo/pull/123
+        concurrency (int): How many PRs are processed at the same time.
+        retrieval_mode (str): See `lapo_async`.
+        auto_accept_distance (float | None): See `lapo_async`.
+        budget (Budget | None): Limits for each PR, not for the whole batch.
+        on_stage (Callable[[str, StageMetrics], None] | None): Called with the PR URL and the metrics of every
+            stage as soon as it completes.
+        on_result (Callable[[BatchResult], None] | None): Called as soon as a PR is done.
+        ledger_path (str | None): See `lapo_async`.
+        force (bool): See `lapo_async`.
+        mirror_sync_interval (float): Least number of seconds between two syncs of the docs repo mirror.
+
+    Returns:
+        List[BatchResult]: One result per PR, in the order they were finished. A failing PR does not stop
+            the batch, its error is recorded in its result.
+    """
+    if concurrency < 1:
+        raise ValueError("concurrency must be at least 1")
+
+    logger.info(f"Preparing docs repo {docs_repo} and the vector index")
+    github_url = "https://github.com/" + docs_repo
+    mirror_path, search_deps = await asyncio.gather(
+        asyncio.to_thread(git_worktree.sync_mirror, github_url),
+        asyncio.to_thread(docs_search_agent.deps),
+    )
+    synced_at = time.monotonic()
+    sync_lock = asyncio.Lock()
+
+    async def sync_mirror() -> None:
+        nonlocal synced_at
+        async with sync_lock:
+            if time.monotonic() - synced_at >= mirror_sync_interval:
+                await asyncio.to_thread(git_worktree.sync_mirror, github_url)
+                synced_at = time.monotonic()
+
+    semaphore = asyncio.Semaphore(concurrency)
+    results: List[BatchResult] = []
+
+    async def process(pr_url: str) -> None:
+        st = time.monotonic()
+        result = BatchResult(pr_url=pr_url, status="ok", seconds=0.0)
+        try:
+            await sync_mirror()
+            worktree_path = await asyncio.to_thread(git_worktree.add_worktree, mirror_path, MAIN_BRANCH, [docs_path])
+            try:
+                metrics = await lapo_async(
+                    docs_repo,
+                    docs_path,
+                    pr_url,
+                    retrieval_mode=retrieval_mode,
+                    auto_accept_distance=auto_accept_distance,
+                    budget=budget,
+                    on_stage=(lambda stage: on_stage(pr_url, stage)) if on_stage else None,
+                    repository_path=worktree_path,
+                    search_deps=search_deps,
+                    ledger_path=ledger_path,
+                    force=force,
+                )
+                result.metrics = metrics.as_dict()
+            finally:
+                await asyncio.to_thread(git_worktree.remove_worktree, mirror_path, worktree_path)
+        except Exception as e:
+            logger.exception(f"Failed to process {pr_url}")
+            result.status = "error"
+            result.error = f"{type(e).__name__}: {e}"
+        finally:
+            semaphore.release()
+        result.seconds = time.monotonic() - st
+        results.append(result)
+        if on_result is not None:
+            on_result(result)
+
+    tasks = set()
+    async for pr_url in _iterate(pr_urls):
+        # wait for a free slot before taking the next PR, so a long queue is not read ahead
+        await semaphore.acquire()
+        task = asyncio.create_task(process(pr_url))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.gather(*tasks)
+
+    logger.info(f"Processed {len(results)} PRs, {sum(r.status == 'error' for r in results)} failed")
+    return results
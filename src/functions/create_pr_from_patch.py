@@ -2,12 +2,12 @@ import inspect
 import os
 import subprocess
 import tempfile
-import requests
 import re
 import logging
 from src.functions.git_pr import clone_or_update_github_repo
+from src.functions.github_client import get_client
 
-GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
+GIT_IDENTITY = ["-c", "user.email=lapodocs@grafana.com", "-c", "user.name=Lapo Docs"]
 logger = logging.getLogger(__name__)
 
 
@@ -19,7 +19,13 @@ def create_pr_from_patch(
     title: str | None = None,
     patch: str | None = None,
     triggered_by: str | None = None,
+    update_base: bool = True,
 ):
+    """
+    Args:
+        update_base (bool): Check out main and pull it before branching off. Pass False when `repo_path`
+            is a fresh worktree of an up to date clone, the branch is then created from its HEAD.
+    """
 
     logger.info(f"repo_path: {repo_path}")
     logger.info(f"repo_url: {repo_url}")
@@ -69,17 +75,12 @@ def create_pr_from_patch(
         try:
 
             logger.info(f"repo_path {repo_path}")
-            # first checkout to main and pull
-            result = subprocess.run(["git", "checkout", "main"], cwd=repo_path, check=True)
-            logger.info(f"checkout {result}")
-            result = subprocess.run(["git", "pull", "origin", "main"], cwd=repo_path, check=True)
-            logger.info(f"pull {result}")
-
-            # configure git
-            result = subprocess.run(["git", "config", "--global", "user.email", "lapodocs@grafana.com"], check=True)
-            logger.info(f"config {result}")
-            result = subprocess.run(["git", "config", "--global", "user.name", "Lapo Docs"], check=True)
-            logger.info(f"config {result}")
+            if update_base:
+                # first checkout to main and pull
+                result = subprocess.run(["git", "checkout", "main"], cwd=repo_path, check=True)
+                logger.info(f"checkout {result}")
+                result = subprocess.run(["git", "pull", "origin", "main"], cwd=repo_path, check=True)
+                logger.info(f"pull {result}")
 
             result = subprocess.run(["git", "checkout", "-b", branch_name], cwd=repo_path, check=True)
             logger.info(f"checkout {result}")
@@ -90,8 +91,9 @@ def create_pr_from_patch(
             result = subprocess.run(["git", "apply", f.name], cwd=repo_path, capture_output=True, check=True)
             logger.info(f"patch applied {result}")
 
+            # the identity is passed per command, concurrent runs must not write the global git config
             result = subprocess.run(
-                ["git", "commit", "-a", "-m", reasoning], cwd=repo_path, capture_output=True, check=True
+                ["git", *GIT_IDENTITY, "commit", "-a", "-m", reasoning], cwd=repo_path, capture_output=True, check=True
             )
             logger.info(f"commit {result}")
             result = subprocess.run(
@@ -112,8 +114,6 @@ def create_pr_from_patch(
             raise ValueError(f"Error creating PR: {str(e)}")
 
     # Create the pull request
-    headers = {"Authorization": f"token {GITHUB_TOKEN}", "Accept": "application/vnd.github.v3+json"}
-
     pr_title = "LapoDocs: "
     if title is not None:
         pr_title += title
@@ -136,7 +136,8 @@ def create_pr_from_patch(
     pr_data = {"title": pr_title, "body": description, "head": branch_name, "base": "main"}
     logger.debug(pr_data)
 
-    response = requests.post(f"https://api.github.com/repos/{owner}/{repo}/pulls", headers=headers, json=pr_data)
+    client = get_client()
+    response = client.post(f"repos/{owner}/{repo}/pulls", json=pr_data)
 
     if response.status_code != 201:
         raise ValueError(f"Failed to create PR: {response.status_code} - {response.text}")
@@ -146,9 +147,7 @@ def create_pr_from_patch(
     # Add labels to the PR
     pr_number = pr_info["number"]
     labels_data = {"labels": ["lapo-docs", "type-docs", "no-changelog"]}
-    label_response = requests.post(
-        f"https://api.github.com/repos/{owner}/{repo}/issues/{pr_number}/labels", headers=headers, json=labels_data
-    )
+    label_response = client.post(f"repos/{owner}/{repo}/issues/{pr_number}/labels", json=labels_data)
 
     if label_response.status_code != 200:
         logger.warning(f"Failed to add labels to PR: {label_response.status_code} - {label_response.text}")
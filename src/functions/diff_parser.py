@@ -0,0 +1,284 @@
+"""
+Streaming parser for unified diffs and git format-patch (mbox) output.
+
+The parser walks the diff line by line and yields one `FileDiff` per file
+section, with its hunks split into added, removed and context lines. Email
+headers, commit messages, diffstats and binary patches are skipped. The parsed
+records are used to build bounded retrieval queries for the docs search.
+"""
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Iterator, List, Optional
+
+DEFAULT_QUERY_MAX_CHARS = 6000
+MAX_SYMBOLS = 20
+
+_DIFF_GIT_RE = re.compile(r"^diff --git a/(.*) b/(.*)$")
+_HUNK_RE = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@ ?(.*)$")
+_IDENTIFIER_RE = re.compile(r"[A-Za-z_$][A-Za-z0-9_$]{2,}")
+_DEV_NULL = "/dev/null"
+
+# Words too common in source code to be useful as search terms
+_STOP_WORDS = {
+    "and", "any", "async", "await", "bool", "break", "case", "catch", "class", "const", "continue", "def", "default",
+    "elif", "else", "export", "extends", "false", "final", "for", "from", "func", "function", "if", "implements",
+    "import", "interface", "let", "new", "nil", "none", "not", "null", "package", "private", "protected", "public",
+    "return", "self", "static", "string", "struct", "super", "switch", "this", "throw", "true", "try", "type",
+    "undefined", "var", "void", "while", "with", "yield", "the", "err",
+}
+
+
+@dataclass
+class Hunk:
+    old_start: int
+    old_lines: int
+    new_start: int
+    new_lines: int
+    section: str = ""
+    added: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+    context: List[str] = field(default_factory=list)
+    # the hunk body in order, each line with its ' ', '+' or '-' prefix
+    lines: List[str] = field(default_factory=list)
+
+    @property
+    def header(self) -> str:
+        header = f"@@ -{self.old_start},{self.old_lines} +{self.new_start},{self.new_lines} @@"
+        return f"{header} {self.section}" if self.section else header
+
+
+@dataclass
+class FileDiff:
+    old_path: Optional[str]
+    new_path: Optional[str]
+    hunks: List[Hunk] = field(default_factory=list)
+    is_binary: bool = False
+
+    @property
+    def path(self) -> str:
+        return self.new_path or self.old_path or ""
+
+    @property
+    def is_new(self) -> bool:
+        return self.old_path is None and self.new_path is not None
+
+    @property
+    def is_deleted(self) -> bool:
+        return self.new_path is None and self.old_path is not None
+
+    @property
+    def added_lines(self) -> int:
+        return sum(len(h.added) for h in self.hunks)
+
+    @property
+    def removed_lines(self) -> int:
+        return sum(len(h.removed) for h in self.hunks)
+
+    def symbols(self, limit: int = MAX_SYMBOLS) -> List[str]:
+        """Identifiers touched by the change, most specific first.
+
+        Identifiers that appear only on one side of the change (e.g. the old and
+        new name of a renamed variable) come first, then identifiers from the
+        hunk headers' function context, then the rest by frequency.
+        """
+        added: Counter = Counter()
+        removed: Counter = Counter()
+        sections: Counter = Counter()
+        for hunk in self.hunks:
+            for line in hunk.added:
+                added.update(_identifiers(line))
+            for line in hunk.removed:
+                removed.update(_identifiers(line))
+            sections.update(_identifiers(hunk.section))
+
+        changed = (added - removed) + (removed - added)
+        ordered: List[str] = []
+        for counter in (changed, sections, added + removed):
+            for symbol, _ in counter.most_common():
+                if symbol not in ordered:
+                    ordered.append(symbol)
+        return ordered[:limit]
+
+    def to_patch(self) -> str:
+        """Render the file section back as a unified diff."""
+        lines = [f"--- {'a/' + self.old_path if self.old_path else _DEV_NULL}"]
+        lines.append(f"+++ {'b/' + self.new_path if self.new_path else _DEV_NULL}")
+        for hunk in self.hunks:
+            lines.append(hunk.header)
+            lines.extend(hunk.lines)
+        return "\n".join(lines) + "\n"
+
+
+def _identifiers(text: str) -> Iterator[str]:
+    for match in _IDENTIFIER_RE.finditer(text):
+        word = match.group(0)
+        if word.lower() not in _STOP_WORDS:
+            yield word
+
+
+def _strip_prefix(path: str, prefix: str) -> Optional[str]:
+    path = path.strip()
+    if path == _DEV_NULL:
+        return None
+    if path.startswith(prefix):
+        return path[len(prefix) :]
+    return path
+
+
+def split_lines(text: str) -> List[str]:
+    """Split a diff into lines on "\\n" only.
+
+    `str.splitlines` also breaks on "\\r", form feeds, "\\u2028" and other separators, which
+    would cut a changed line in two and make the parser drop the rest of its hunk.
+    """
+    lines = text.split("\n")
+    if lines[-1] == "":
+        lines.pop()
+    return lines
+
+
+def parse_unified_diff(lines: Iterable[str], default_path: Optional[str] = None) -> Iterator[FileDiff]:
+    """Parse a unified diff or a `git format-patch` mbox into per-file records.
+
+    Args:
+        lines: The diff, line by line (with or without line endings), e.g. an open file.
+        default_path: Path for hunks that are not preceded by file headers, which
+            happens when a diff was already split per file.
+
+    Yields:
+        A `FileDiff` per file section, in the order they appear. A file changed
+        by several commits of a patch series is yielded once per commit, see
+        `group_by_file`.
+    """
+    current: Optional[FileDiff] = None
+    hunk: Optional[Hunk] = None
+    old_remaining = new_remaining = 0
+    pending_old_path: Optional[str] = None
+    has_pending_old_path = False
+
+    for raw_line in lines:
+        line = raw_line.rstrip("\n").rstrip("\r")
+
+        if hunk is not None and (old_remaining > 0 or new_remaining > 0):
+            tag = line[:1]
+            if tag == "\\":
+                # "\ No newline at end of file"
+                continue
+            if tag == "+":
+                hunk.added.append(line[1:])
+                new_remaining -= 1
+            elif tag == "-":
+                hunk.removed.append(line[1:])
+                old_remaining -= 1
+            elif tag == " " or line == "":
+                hunk.context.append(line[1:])
+                old_remaining -= 1
+                new_remaining -= 1
+            else:
+                # malformed hunk, resynchronise on the current line
+                hunk = None
+            if hunk is not None:
+                hunk.lines.append(line if line else " ")
+                continue
+        hunk = None
+
+        diff_git = _DIFF_GIT_RE.match(line)
+        if diff_git:
+            if current is not None:
+                yield current
+            current = FileDiff(old_path=diff_git.group(1), new_path=diff_git.group(2))
+            has_pending_old_path = False
+            continue
+
+        if line.startswith("--- "):
+            pending_old_path = _strip_prefix(line[4:], "a/")
+            has_pending_old_path = True
+            continue
+
+        if line.startswith("+++ ") and has_pending_old_path:
+            new_path = _strip_prefix(line[4:], "b/")
+            has_pending_old_path = False
+            if current is None or current.hunks:
+                # plain unified diff without "diff --git" headers
+                if current is not None:
+                    yield current
+                current = FileDiff(old_path=pending_old_path, new_path=new_path)
+            else:
+                current.old_path = pending_old_path
+                current.new_path = new_path
+            continue
+        has_pending_old_path = False
+
+        hunk_match = _HUNK_RE.match(line)
+        if hunk_match:
+            if current is None:
+                current = FileDiff(old_path=default_path, new_path=default_path)
+            old_start, old_lines, new_start, new_lines, section = hunk_match.groups()
+            hunk = Hunk(
+                old_start=int(old_start),
+                old_lines=int(old_lines) if old_lines is not None else 1,
+                new_start=int(new_start),
+                new_lines=int(new_lines) if new_lines is not None else 1,
+                section=section.strip(),
+            )
+            old_remaining, new_remaining = hunk.old_lines, hunk.new_lines
+            current.hunks.append(hunk)
+            continue
+
+        if current is None:
+            continue
+        if line.startswith("Binary files ") or line == "GIT binary patch":
+            current.is_binary = True
+        elif line.startswith("rename from "):
+            current.old_path = line[len("rename from ") :]
+        elif line.startswith("rename to "):
+            current.new_path = line[len("rename to ") :]
+        elif line.startswith("new file mode"):
+            current.old_path = None
+        elif line.startswith("deleted file mode"):
+            current.new_path = None
+
+    if current is not None:
+        yield current
+
+
+def group_by_file(file_diffs: Iterable[FileDiff]) -> List[FileDiff]:
+    """Merge the sections of files changed by several commits of a patch series."""
+    by_path: Dict[str, FileDiff] = {}
+    for file_diff in file_diffs:
+        existing = by_path.get(file_diff.path)
+        if existing is None:
+            by_path[file_diff.path] = FileDiff(
+                old_path=file_diff.old_path,
+                new_path=file_diff.new_path,
+                hunks=list(file_diff.hunks),
+                is_binary=file_diff.is_binary,
+            )
+            continue
+        existing.hunks.extend(file_diff.hunks)
+        existing.new_path = file_diff.new_path
+        existing.is_binary = existing.is_binary or file_diff.is_binary
+    return list(by_path.values())
+
+
+def build_retrieval_query(file_diff: FileDiff, max_chars: int = DEFAULT_QUERY_MAX_CHARS) -> str:
+    """Build a bounded search query for the documentation affected by a file change.
+
+    The query lists the file path and touched symbols, followed by the changed
+    lines of every hunk (context lines are left out) until `max_chars` is reached.
+    """
+    parts = [f"File: {file_diff.path}"]
+    symbols = file_diff.symbols()
+    if symbols:
+        parts.append("Symbols: " + ", ".join(symbols))
+    size = sum(len(part) + 1 for part in parts)
+
+    for hunk in file_diff.hunks:
+        changed = [line for line in hunk.lines if line[:1] in ("+", "-") and line[1:].strip()]
+        for line in ([hunk.section] if hunk.section else []) + changed:
+            if size + len(line) + 1 > max_chars:
+                return "\n".join(parts)[:max_chars]
+            parts.append(line)
+            size += len(line) + 1
+    return "\n".join(parts)[:max_chars]
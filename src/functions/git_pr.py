@@ -1,10 +1,9 @@
 import subprocess
 import os
 import hashlib
-import requests
 import re
-from github import Github, Auth
 import logging
+from src.functions.pr_diff import PullRequestDiff, fetch_pr_diff
 
 logger = logging.getLogger(__name__)
 
@@ -12,32 +11,24 @@ DIFF_CONTEXT_SIZE = 32
 MAIN_BRANCH = "main"
 
 
-def get_pr_diff_hunk(pr_url: str) -> str:
-    """Get PR changes directly from GitHub PR patch URL"""
-    match = re.search(r"github.com/(.+)/(.+)/pull/(\d+)", pr_url)
-    if not match:
-        raise ValueError("Invalid PR URL")
-
-    owner, repo_name, pr_number = match.groups()
-
-    # Construct the patch URL
-    patch_url = f"https://github.com/{owner}/{repo_name}/pull/{pr_number}.patch"
-
-    # Use requests to fetch the patch
+def get_pr_diff(pr_url: str) -> PullRequestDiff:
+    """Get the net diff of a PR at its current head, cached by head SHA (see `pr_diff`)"""
     token = os.getenv("GITHUB_TOKEN")
     if token is None or token == "":
         raise ValueError("GITHUB_TOKEN environment variable not set")
 
-    headers = {"Authorization": f"token {token}"}
+    return fetch_pr_diff(pr_url)
 
-    logger.info(f"Fetching PR patch from {patch_url}")
-    response = requests.get(patch_url, headers=headers)
-    response.raise_for_status()
 
-    # The patch content contains the diff with sufficient context
-    hunk = response.text
+def get_pr_diff_hunk(pr_url: str) -> str:
+    """The whole diff of a PR as one string. To parse it, stream `get_pr_diff(pr_url).lines()` instead."""
+    return get_pr_diff(pr_url).read()
+
 
-    return hunk
+def get_head_commit(repo_path: str) -> str:
+    return subprocess.run(
+        ["git", "-C", repo_path, "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+    ).stdout.strip()
 
 
 def clone_or_update_github_repo(
@@ -80,6 +71,7 @@ def clone_or_update_github_repo(
                 [
                     "git",
                     "clone",
+                    "--filter=blob:none",  # blobs are fetched when they are checked out
                     "--depth=50",  # can't use depth=1 because we need the branches
                     "--branch",
                     MAIN_BRANCH,
@@ -97,23 +89,30 @@ def clone_or_update_github_repo(
             check=True,
         )
 
-        # For each branch you want to fetch
+        # Set up remote tracking for the branches
         for branch in branches:
-            logger.info(f"Fetching branch {branch}")
-            # Set up remote tracking for the branch
             subprocess.run(
                 ["git", "-C", repo_path, "remote", "set-branches", "--add", "origin", branch],
                 stderr=subprocess.STDOUT,
                 check=True,
             )
 
-            # Fetch the specific branch with depth=1
+        # Fetch all the branches that moved on the remote at once
+        remote = remote_heads(repo_path, branches)
+        stale = [
+            branch
+            for branch in branches
+            if branch not in remote or remote[branch] != rev_parse(repo_path, f"refs/remotes/origin/{branch}")
+        ]
+        if stale:
+            logger.info(f"Fetching branches {', '.join(stale)}")
             subprocess.run(
-                ["git", "-C", repo_path, "fetch", "--depth=50", "origin", branch],
+                ["git", "-C", repo_path, "fetch", "--depth=50", "origin"]
+                + [f"+refs/heads/{branch}:refs/remotes/origin/{branch}" for branch in stale],
                 stderr=subprocess.STDOUT,
                 check=True,
             )
-            logger.info(f"Successfully fetched branch {branch}")
+            logger.info(f"Successfully fetched branches {', '.join(stale)}")
 
         # finally checkout to branch
         logger.info(f"Checking out branch {branches[0]}")
@@ -135,6 +134,29 @@ def clone_or_update_github_repo(
         raise e
 
 
+def remote_heads(repo_path: str, branches: list[str]) -> dict[str, str]:
+    """The commits of `branches` on the origin remote, without fetching anything."""
+    output = subprocess.run(
+        ["git", "-C", repo_path, "ls-remote", "origin", *(f"refs/heads/{branch}" for branch in branches)],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    heads = {}
+    for line in output.splitlines():
+        sha, ref = line.split("\t", 1)
+        heads[ref.removeprefix("refs/heads/")] = sha
+    return heads
+
+
+def rev_parse(repo_path: str, ref: str) -> str | None:
+    """The commit `ref` points to, None if it does not exist."""
+    result = subprocess.run(
+        ["git", "-C", repo_path, "rev-parse", "--verify", "-q", f"{ref}^{{commit}}"], capture_output=True, text=True
+    )
+    return result.stdout.strip() if result.returncode == 0 else None
+
+
 def get_authenticated_github_url(url):
     # Extract the repository path from the URL
     match = re.match(r'https://github.com/(.+?)(?:\.git)?$', url)
@@ -0,0 +1,197 @@
+"""
+Shared bare mirrors of GitHub repositories and disposable worktrees of them.
+
+Each repository is fetched into one bare mirror per machine. Runs never check
+out or commit in the mirror: every run gets its own worktree, which has its own
+working directory, index and HEAD but shares the objects and refs of the
+mirror, so creating one is cheap and concurrent runs cannot see each other's
+checkouts, branches in progress or untracked files.
+
+Mirrors are blobless partial clones: only commits and trees are fetched up
+front, and file contents are fetched on demand when a worktree checks them
+out. Worktrees can be sparse, limited to the docs path, so a run on a large
+monorepo only downloads and writes the files it can edit. A sync asks the
+remote for its branch heads first and skips the fetch when the mirror already
+has them.
+
+Fetches into the mirror and `git worktree add/remove`, which update the
+mirror's administrative files, are serialised with an exclusive `flock` on a
+lock file next to the mirror. The lock works across threads and processes.
+"""
+import fcntl
+import hashlib
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+from contextlib import contextmanager
+from typing import Iterator, Sequence
+
+from src.functions.git_pr import MAIN_BRANCH, get_authenticated_github_url, remote_heads, rev_parse
+
+logger = logging.getLogger(__name__)
+
+MIRRORS_PATH = os.path.join(os.path.expanduser("~"), ".cache", "github_repos", "mirrors")
+WORKTREES_PATH = os.path.join(os.path.expanduser("~"), ".cache", "lapo_worktrees")
+FETCH_DEPTH = 50
+# commits and trees only, blobs are fetched lazily from the remote when they are checked out
+CLONE_FILTER = "blob:none"
+
+
+@contextmanager
+def repo_lock(repo_path: str) -> Iterator[None]:
+    """Hold the exclusive lock of the repository at `repo_path`, waiting for other runs to release it."""
+    lock_path = repo_path.rstrip(os.sep) + ".lock"
+    os.makedirs(os.path.dirname(lock_path) or ".", exist_ok=True)
+    with open(lock_path, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def mirror_path(github_url: str) -> str:
+    repo_hash = hashlib.sha256(github_url.encode()).hexdigest()[:16]
+    return os.path.join(MIRRORS_PATH, repo_hash + ".git")
+
+
+def _git(repo_path: str, *args: str) -> str:
+    return subprocess.run(["git", "-C", repo_path, *args], capture_output=True, text=True, check=True).stdout
+
+
+def sync_mirror(github_url: str, branches: list[str] = [MAIN_BRANCH]) -> str:
+    """Create or update the bare mirror of `github_url`, with `branches` at their current commit on GitHub.
+
+    Args:
+        github_url (str): The GitHub repository URL
+        branches (list[str]): Branches to fetch, the local branches are reset to the remote ones
+
+    Returns:
+        str: Path to the bare mirror
+
+    Raises:
+        subprocess.CalledProcessError: If the git command fails
+    """
+    path = mirror_path(github_url)
+    auth_github_url = get_authenticated_github_url(github_url)
+    with repo_lock(path):
+        if not os.path.exists(os.path.join(path, "HEAD")):
+            logger.info(f"Creating mirror of {github_url}")
+            shutil.rmtree(path, ignore_errors=True)
+            subprocess.run(
+                [
+                    "git",
+                    "clone",
+                    "--bare",
+                    f"--filter={CLONE_FILTER}",
+                    f"--depth={FETCH_DEPTH}",
+                    "--branch",
+                    branches[0],
+                    auth_github_url,
+                    path,
+                ],
+                capture_output=True,
+                check=True,
+            )
+        # the token may have changed since the mirror was created, and worktrees push to this remote
+        subprocess.run(["git", "-C", path, "remote", "set-url", "origin", auth_github_url], check=True)
+
+        remote = remote_heads(path, branches)
+        stale = [
+            branch
+            for branch in branches
+            if branch not in remote or remote[branch] != rev_parse(path, f"refs/heads/{branch}")
+        ]
+        if stale:
+            logger.info(f"Fetching branches {', '.join(stale)}")
+            # one fetch for all the branches. The mirror owns its branches, force them to the remote
+            # ones. Worktrees are detached, so no branch that is being updated can be checked out.
+            subprocess.run(
+                ["git", "-C", path, "fetch", f"--depth={FETCH_DEPTH}", "origin"]
+                + [f"+refs/heads/{branch}:refs/heads/{branch}" for branch in stale],
+                capture_output=True,
+                check=True,
+            )
+        else:
+            logger.info(f"Branches {', '.join(branches)} are up to date, skipping the fetch")
+        # forget the worktrees of runs that died without removing them
+        subprocess.run(["git", "-C", path, "worktree", "prune"], capture_output=True, check=True)
+    return path
+
+
+def add_worktree(repo_path: str, ref: str = "HEAD", sparse_paths: Sequence[str] | None = None) -> str:
+    """Check out `ref` of the repository at `repo_path` in a new detached worktree.
+
+    Args:
+        repo_path (str): The repository, usually a mirror
+        ref (str): Commit or branch to check out
+        sparse_paths (Sequence[str] | None): Only check out these directories, plus the files at the root
+            of the repository. The whole tree is checked out when None or empty.
+
+    Returns:
+        str: Path to the worktree
+
+    Raises:
+        subprocess.CalledProcessError: If the git command fails
+    """
+    os.makedirs(WORKTREES_PATH, exist_ok=True)
+    path = tempfile.mkdtemp(prefix="lapo-", dir=WORKTREES_PATH)
+    sparse_paths = [p.strip("/") for p in sparse_paths or [] if p.strip("/.")]
+    try:
+        with repo_lock(repo_path):
+            if not sparse_paths:
+                _git(repo_path, "worktree", "add", "--detach", path, ref)
+            else:
+                _git(repo_path, "worktree", "add", "--no-checkout", "--detach", path, ref)
+                # writes the per-worktree config, enabling it in the shared config the first time
+                _git(path, "sparse-checkout", "set", "--cone", *sparse_paths)
+    except subprocess.CalledProcessError:
+        shutil.rmtree(path, ignore_errors=True)
+        subprocess.run(["git", "-C", repo_path, "worktree", "prune"], capture_output=True)
+        raise
+    if sparse_paths:
+        try:
+            # fetches the missing blobs of the sparse paths only
+            _git(path, "checkout", "--detach", "HEAD")
+        except subprocess.CalledProcessError:
+            remove_worktree(repo_path, path)
+            raise
+    logger.info(f"Created worktree {path} at {ref}" + (f" for {', '.join(sparse_paths)}" if sparse_paths else ""))
+    return path
+
+
+def remove_worktree(repo_path: str, path: str) -> None:
+    """Delete the worktree at `path`, including local changes, and forget it in the repository.
+
+    Worktrees are added detached, so a branch checked out in one was created by its run, e.g. the PR
+    branch, which is pushed by the time the worktree is removed. It is deleted from the repository too,
+    instead of piling up in the shared mirror.
+    """
+    branch = subprocess.run(
+        ["git", "-C", path, "symbolic-ref", "-q", "--short", "HEAD"], capture_output=True, text=True
+    ).stdout.strip()
+    with repo_lock(repo_path):
+        result = subprocess.run(
+            ["git", "-C", repo_path, "worktree", "remove", "--force", path], capture_output=True, text=True
+        )
+        if result.returncode != 0:
+            logger.warning(f"Could not remove worktree {path}: {result.stderr.strip()}")
+            shutil.rmtree(path, ignore_errors=True)
+            subprocess.run(["git", "-C", repo_path, "worktree", "prune"], capture_output=True)
+        if branch and branch != MAIN_BRANCH:
+            result = subprocess.run(["git", "-C", repo_path, "branch", "-D", branch], capture_output=True, text=True)
+            if result.returncode != 0:
+                logger.warning(f"Could not delete branch {branch}: {result.stderr.strip()}")
+    logger.info(f"Removed worktree {path}")
+
+
+@contextmanager
+def worktree(repo_path: str, ref: str = "HEAD", sparse_paths: Sequence[str] | None = None) -> Iterator[str]:
+    """A worktree of `ref` that is removed on exit."""
+    path = add_worktree(repo_path, ref, sparse_paths)
+    try:
+        yield path
+    finally:
+        remove_worktree(repo_path, path)
@@ -0,0 +1,245 @@
+"""
+Shared HTTP client for GitHub, for the REST API and for github.com downloads.
+
+All requests of the process go through one keep-alive connection pool, with
+timeouts. Idempotent requests are retried with exponential backoff on
+connection errors and 5xx responses. Any request rejected by a rate limit
+(HTTP 429, or 403 with an exhausted `X-RateLimit-Remaining` or a `Retry-After`
+header for secondary limits) is retried after the time GitHub asks for.
+
+GET responses that carry an `ETag` or `Last-Modified` header are stored in an
+on-disk cache and revalidated with `If-None-Match`/`If-Modified-Since`, so a
+repeated fetch of an unchanged resource costs a 304 and no download. 304
+responses do not count against the GitHub API rate limit either.
+"""
+import hashlib
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+API_URL = "https://api.github.com"
+CACHE_PATH = os.getenv("LAPO_GITHUB_CACHE_PATH", os.path.join(os.path.expanduser("~"), ".cache", "lapo", "github"))
+# (connect, read) in seconds
+DEFAULT_TIMEOUT = (10.0, 60.0)
+DEFAULT_MAX_RETRIES = 4
+DEFAULT_BACKOFF = 1.0
+# longest wait for a rate limit to reset before giving up
+DEFAULT_MAX_RATE_LIMIT_WAIT = 300.0
+POOL_SIZE = 16
+
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+_CACHED_HEADERS = ("Content-Type", "ETag", "Last-Modified", "Link")
+
+
+class GitHubError(RuntimeError):
+    pass
+
+
+class ResponseCache:
+    """GET responses on disk, keyed by URL and the request headers that change the representation."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    @staticmethod
+    def key(url: str, headers: Dict[str, str]) -> str:
+        # the token is part of the key, a response must not be served to a client that cannot see it
+        vary = {name: headers.get(name, "") for name in ("Accept", "Authorization")}
+        return hashlib.sha256(json.dumps([url, vary], sort_keys=True).encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[Tuple[Dict[str, str], bytes]]:
+        try:
+            with open(os.path.join(self.path, key + ".json")) as f:
+                meta = json.load(f)
+            with open(os.path.join(self.path, key + ".body"), "rb") as f:
+                return meta, f.read()
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key: str, meta: Dict[str, str], body: bytes) -> None:
+        # body first, then the metadata: an entry is only visible once it is complete
+        self._write(key + ".body", body)
+        self._write(key + ".json", json.dumps(meta).encode())
+
+    def _write(self, name: str, data: bytes) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=self.path)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, os.path.join(self.path, name))
+
+
+class GitHubClient:
+    def __init__(
+        self,
+        token: Optional[str] = None,
+        api_url: str = API_URL,
+        cache_path: Optional[str] = CACHE_PATH,
+        timeout: Tuple[float, float] = DEFAULT_TIMEOUT,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        backoff: float = DEFAULT_BACKOFF,
+        max_rate_limit_wait: float = DEFAULT_MAX_RATE_LIMIT_WAIT,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        """
+        Args:
+            token: GitHub token. Defaults to the GITHUB_TOKEN environment variable, read on every request.
+            api_url: Base URL of the REST API, for requests made with a path instead of a URL.
+            cache_path: Directory of the response cache, None disables conditional requests.
+        """
+        self._token = token
+        self.api_url = api_url.rstrip("/")
+        self.cache = ResponseCache(cache_path) if cache_path else None
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_rate_limit_wait = max_rate_limit_wait
+        self._sleep = sleep
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.requests = 0
+        self.not_modified = 0
+
+    @property
+    def token(self) -> Optional[str]:
+        return self._token or os.getenv("GITHUB_TOKEN") or None
+
+    def url(self, path_or_url: str) -> str:
+        if path_or_url.startswith(("http://", "https://")):
+            return path_or_url
+        return f"{self.api_url}/{path_or_url.lstrip('/')}"
+
+    def headers(self, extra: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+        headers = {"Accept": "application/vnd.github.v3+json"}
+        if self.token:
+            headers["Authorization"] = f"token {self.token}"
+        headers.update(extra or {})
+        return headers
+
+    def get(self, path_or_url: str, headers: Optional[Dict[str, str]] = None, **kwargs: Any) -> requests.Response:
+        """GET with revalidation of the cached response. A 304 is returned as the cached 200 response."""
+        url = self.url(path_or_url)
+        headers = self.headers(headers)
+        if self.cache is None or kwargs.get("stream"):
+            return self.request("GET", url, headers=headers, **kwargs)
+
+        key = self.cache.key(url, headers)
+        cached = self.cache.get(key)
+        if cached is not None:
+            meta, _ = cached
+            if meta.get("ETag"):
+                headers["If-None-Match"] = meta["ETag"]
+            if meta.get("Last-Modified"):
+                headers["If-Modified-Since"] = meta["Last-Modified"]
+
+        response = self.request("GET", url, headers=headers, **kwargs)
+        if response.status_code == 304 and cached is not None:
+            self.not_modified += 1
+            logger.info(f"{url} not modified, using the cached response")
+            return self._cached_response(url, *cached)
+        if response.status_code == 200 and ("ETag" in response.headers or "Last-Modified" in response.headers):
+            meta = {name: response.headers[name] for name in _CACHED_HEADERS if name in response.headers}
+            self.cache.put(key, meta, response.content)
+        return response
+
+    def post(self, path_or_url: str, json: Any = None, headers: Optional[Dict[str, str]] = None) -> requests.Response:
+        return self.request("POST", self.url(path_or_url), headers=self.headers(headers), json=json)
+
+    def request(self, method: str, url: str, **kwargs: Any) -> requests.Response:
+        """Send a request, retrying it when it is rejected by a rate limit or, if idempotent, when it fails.
+
+        Raises:
+            requests.RequestException: If the request still fails to connect after the retries.
+            GitHubError: If a rate limit does not reset within `max_rate_limit_wait` seconds.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                self.requests += 1
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if not idempotent or attempt > self.max_retries:
+                    raise
+                delay = self._backoff_delay(attempt)
+                logger.warning(f"{method} {url} failed ({e}), retrying in {delay:.1f}s")
+                self._sleep(delay)
+                continue
+
+            rate_limit_wait = self._rate_limit_wait(response)
+            if rate_limit_wait is not None:
+                if rate_limit_wait > self.max_rate_limit_wait:
+                    raise GitHubError(
+                        f"GitHub rate limit for {url} resets in {rate_limit_wait:.0f}s, "
+                        f"longer than {self.max_rate_limit_wait:.0f}s"
+                    )
+                if attempt <= self.max_retries:
+                    logger.warning(f"{method} {url} was rate limited, retrying in {rate_limit_wait:.1f}s")
+                    self._sleep(rate_limit_wait)
+                    continue
+            elif response.status_code >= 500 and idempotent and attempt <= self.max_retries:
+                delay = self._backoff_delay(attempt)
+                logger.warning(f"{method} {url} returned {response.status_code}, retrying in {delay:.1f}s")
+                self._sleep(delay)
+                continue
+            return response
+
+    def _backoff_delay(self, attempt: int) -> float:
+        return self.backoff * 2 ** (attempt - 1) * (1 + random.random() / 2)
+
+    @staticmethod
+    def _rate_limit_wait(response: requests.Response) -> Optional[float]:
+        """Seconds to wait if the response was rejected by a rate limit, None if it was not."""
+        if response.status_code not in (403, 429):
+            return None
+        retry_after = response.headers.get("Retry-After")
+        if retry_after is not None:
+            try:
+                return max(0.0, float(retry_after))
+            except ValueError:
+                pass
+        if response.headers.get("X-RateLimit-Remaining") == "0":
+            reset = float(response.headers.get("X-RateLimit-Reset", time.time()))
+            return max(0.0, reset - time.time()) + 1
+        # secondary rate limits without a Retry-After header: GitHub asks to wait at least a minute
+        if response.status_code == 429 or "rate limit" in response.text.lower():
+            return 60.0
+        # a plain 403 is a permission error, not a rate limit
+        return None
+
+    @staticmethod
+    def _cached_response(url: str, meta: Dict[str, str], body: bytes) -> requests.Response:
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response._content = body
+        response.headers.update(meta)
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers) or "utf-8"
+        return response
+
+
+_client: Optional[GitHubClient] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> GitHubClient:
+    """The process-wide client, so that connections and the response cache are shared by all runs."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = GitHubClient()
+        return _client
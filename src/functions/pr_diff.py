@@ -0,0 +1,190 @@
+"""
+Net diffs of source PRs, cached on disk by head commit.
+
+A PR is resolved to its head SHA with one API request, which the GitHub
+client revalidates with its ETag, so a PR that did not change costs a 304. The
+diff of that head is then read from the cache, or downloaded once as the net
+diff of the PR (not the per-commit mbox of `pull/N.patch`) and streamed to disk
+in chunks. Entries are keyed by (owner, repo, PR number, head SHA): a push to
+the PR makes a new entry and replaces the old one.
+"""
+import logging
+import os
+import re
+import tempfile
+from dataclasses import dataclass
+from typing import Iterator
+
+from src.functions.github_client import GitHubClient, GitHubError, get_client
+
+logger = logging.getLogger(__name__)
+
+CACHE_PATH = os.getenv("LAPO_PR_DIFF_CACHE_PATH", os.path.join(os.path.expanduser("~"), ".cache", "lapo", "pr_diffs"))
+DIFF_MEDIA_TYPE = "application/vnd.github.v3.diff"
+CHUNK_SIZE = 1024 * 1024
+# downloads of a PR that is pushed to while its diff is fetched
+MAX_DOWNLOAD_ATTEMPTS = 3
+
+_SHA_RE = re.compile(r"^[0-9a-f]{40}$")
+
+
+@dataclass(frozen=True)
+class PullRequestRef:
+    owner: str
+    repo: str
+    number: int
+
+    @classmethod
+    def from_url(cls, pr_url: str) -> "PullRequestRef":
+        match = re.search(r"github.com/(.+)/(.+)/pull/(\d+)", pr_url)
+        if not match:
+            raise ValueError("Invalid PR URL")
+        owner, repo, number = match.groups()
+        return cls(owner=owner, repo=repo, number=int(number))
+
+
+@dataclass(frozen=True)
+class PullRequestDiff:
+    pr: PullRequestRef
+    head_sha: str
+    # file with the diff in the cache
+    path: str
+    size: int
+    # False when the diff was downloaded by this call
+    cached: bool
+
+    def read(self) -> str:
+        """The whole diff as one string, for prompts. Parse it with `lines` instead."""
+        with open(self.path, "rb") as f:
+            return f.read().decode("utf-8", errors="replace")
+
+    def lines(self) -> Iterator[str]:
+        """The diff line by line, read from the cache as it is consumed.
+
+        Lines are split on "\\n" only: text mode would also split on a lone "\\r" inside a changed line.
+        """
+        with open(self.path, "rb") as f:
+            for line in f:
+                yield line.decode("utf-8", errors="replace")
+
+    def is_blank(self) -> bool:
+        """Whether the diff is empty or only whitespace, checked one chunk at a time."""
+        with open(self.path, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                if chunk.strip():
+                    return False
+        return True
+
+
+class PRDiffCache:
+    def __init__(self, path: str = CACHE_PATH) -> None:
+        self.path = path
+
+    def entry_path(self, pr: PullRequestRef, head_sha: str) -> str:
+        if not _SHA_RE.match(head_sha):
+            raise ValueError(f"Invalid head SHA {head_sha!r}")
+        return os.path.join(self.path, pr.owner, pr.repo, str(pr.number), head_sha + ".diff")
+
+    def get(self, pr: PullRequestRef, head_sha: str) -> str | None:
+        path = self.entry_path(pr, head_sha)
+        return path if os.path.isfile(path) else None
+
+    def open_entry(self, pr: PullRequestRef, head_sha: str) -> "_Entry":
+        return _Entry(self, pr, head_sha)
+
+
+class _Entry:
+    """Write a diff to a temporary file and move it into the cache only once it is complete."""
+
+    def __init__(self, cache: PRDiffCache, pr: PullRequestRef, head_sha: str) -> None:
+        self.path = cache.entry_path(pr, head_sha)
+        self.directory = os.path.dirname(self.path)
+
+    def __enter__(self):
+        os.makedirs(self.directory, exist_ok=True)
+        fd, self.tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        self.file = os.fdopen(fd, "wb")
+        return self.file
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.file.close()
+        if exc_type is not None:
+            os.remove(self.tmp_path)
+            return
+        os.replace(self.tmp_path, self.path)
+        # older heads of the PR are not fetched again
+        for name in os.listdir(self.directory):
+            if name.endswith(".diff") and os.path.join(self.directory, name) != self.path:
+                os.remove(os.path.join(self.directory, name))
+
+
+def get_head_sha(pr: PullRequestRef, client: GitHubClient | None = None) -> str:
+    client = client or get_client()
+    response = client.get(f"repos/{pr.owner}/{pr.repo}/pulls/{pr.number}")
+    response.raise_for_status()
+    return response.json()["head"]["sha"]
+
+
+class _HeadMoved(Exception):
+    pass
+
+
+def fetch_pr_diff(
+    pr_url: str, client: GitHubClient | None = None, cache: PRDiffCache | None = None
+) -> PullRequestDiff:
+    """The net diff of the PR at its current head, from the cache when that head was fetched before.
+
+    The diff endpoints cannot be pinned to a commit, so the head is read again once the diff is
+    downloaded, and the download is discarded and retried if the PR was pushed to meanwhile.
+
+    Raises:
+        ValueError: If the PR URL is invalid
+        requests.HTTPError: If GitHub does not return the PR or its diff
+        GitHubError: If the head of the PR changed during every download attempt
+    """
+    client = client or get_client()
+    cache = cache or PRDiffCache()
+    pr = PullRequestRef.from_url(pr_url)
+
+    for _ in range(MAX_DOWNLOAD_ATTEMPTS):
+        head_sha = get_head_sha(pr, client)
+        path = cache.get(pr, head_sha)
+        if path is not None:
+            logger.info(f"Using cached diff of {pr_url} at {head_sha}")
+            return PullRequestDiff(pr=pr, head_sha=head_sha, path=path, size=os.path.getsize(path), cached=True)
+
+        try:
+            _download_diff(pr, head_sha, client, cache)
+        except _HeadMoved:
+            logger.info(f"{pr_url} was pushed to while its diff was downloaded, fetching it again")
+            continue
+
+        path = cache.entry_path(pr, head_sha)
+        size = os.path.getsize(path)
+        logger.info(f"Cached {size} bytes of diff for {pr_url}")
+        return PullRequestDiff(pr=pr, head_sha=head_sha, path=path, size=size, cached=False)
+
+    raise GitHubError(f"The head of {pr_url} kept changing while its diff was downloaded")
+
+
+def _download_diff(pr: PullRequestRef, head_sha: str, client: GitHubClient, cache: PRDiffCache) -> None:
+    """Stream the diff of `pr` into the cache entry of `head_sha`, which is only kept if the head did not move."""
+    logger.info(f"Fetching diff of {pr.owner}/{pr.repo}#{pr.number} at {head_sha}")
+    response = client.get(
+        f"repos/{pr.owner}/{pr.repo}/pulls/{pr.number}", headers={"Accept": DIFF_MEDIA_TYPE}, stream=True
+    )
+    if response.status_code == 406:
+        # the API refuses diffs that are too large, github.com still serves them
+        response.close()
+        logger.info("Diff too large for the API, fetching it from github.com")
+        response = client.get(
+            f"https://github.com/{pr.owner}/{pr.repo}/pull/{pr.number}.diff", headers={"Accept": "*/*"}, stream=True
+        )
+    with response:
+        response.raise_for_status()
+        with cache.open_entry(pr, head_sha) as f:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                f.write(chunk)
+            # raising discards the entry
+            if get_head_sha(pr, client) != head_sha:
+                raise _HeadMoved()
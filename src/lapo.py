@@ -1,13 +1,21 @@
+import asyncio
+import concurrent.futures
 import json
 import re
 import logging
+from typing import Any, Awaitable, Callable
 from rich import print as rprint
 from src.functions import git_pr
 from src.agents import docs_search_agent
 from src.agents import generate_patch_agent
 from src.tools.search_replace.search_replace_apply import generate_git_patch_from_search_replace
 from src.functions import create_pr_from_patch
-from src.functions.git_pr import clone_or_update_github_repo
+from src.functions import git_worktree
+from src.functions.git_pr import MAIN_BRANCH
+from src.metrics import Budget, BudgetExceededError, RunMetrics, StageMetrics
+from src.rag import rag
+from src import run_ledger
+from src.run_ledger import RunKey, RunLedger
 
 # Configure once at program start
 logging.basicConfig(
@@ -18,44 +26,299 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
+RETRIEVAL_MODES = ("direct", "agent")
 
-def lapo(docs_repo: str, docs_path: str, source_change_pr: str) -> None:
+
+def lapo(
+    docs_repo: str,
+    docs_path: str,
+    source_change_pr: str,
+    retrieval_mode: str = "direct",
+    auto_accept_distance: float | None = None,
+    budget: Budget | None = None,
+    metrics_path: str | None = None,
+    on_stage: Callable[[StageMetrics], None] | None = None,
+    ledger_path: str | None = run_ledger.LEDGER_PATH,
+    force: bool = False,
+) -> None:
+    """Synchronous entry point, runs `lapo_async` in a new event loop. See `lapo_async` for the arguments."""
+    asyncio.run(
+        lapo_async(
+            docs_repo,
+            docs_path,
+            source_change_pr,
+            retrieval_mode=retrieval_mode,
+            auto_accept_distance=auto_accept_distance,
+            budget=budget,
+            metrics_path=metrics_path,
+            on_stage=on_stage,
+            ledger_path=ledger_path,
+            force=force,
+        )
+    )
+
+
+async def lapo_async(
+    docs_repo: str,
+    docs_path: str,
+    source_change_pr: str,
+    retrieval_mode: str = "direct",
+    auto_accept_distance: float | None = None,
+    budget: Budget | None = None,
+    metrics_path: str | None = None,
+    on_stage: Callable[[StageMetrics], None] | None = None,
+    repository_path: str | None = None,
+    search_deps: docs_search_agent.Deps | None = None,
+    ledger_path: str | None = run_ledger.LEDGER_PATH,
+    force: bool = False,
+) -> RunMetrics:
     """
+    Cloning the docs repo, fetching the PR diff and loading the vector index are independent, so they run
+    concurrently. The clone is only awaited by the patch agent, and keeps running during the docs search.
+    The docs repo is checked out in a sparse worktree of the shared mirror (see `git_worktree`), limited to
+    `docs_path` and removed at the end of the run, so concurrent runs on one machine do not interfere.
+
+    Finished runs are recorded in the run ledger (see `run_ledger`). A run whose PR head, docs commit,
+    index and configuration match a recorded run replays its outcome without calling any model. The
+    ledger lookup needs the docs commit, which is the mirror's main branch once it is synced, so with a
+    ledger the docs search waits for the mirror fetch but not for the worktree checkout.
+
     Args:
         docs_path (str): Path to the docs relative to the root of the docs repo
         docs_repo (str): Docs repo in the format owner/repo
         source_change_pr (str): PR in the format https://github.com/owner/repo/pull/123
+        retrieval_mode (str): "direct" parses the diff and runs the vector search in-process, only asking
+            the model which of the retrieved chunks are relevant. "agent" lets the docs search agent split
+            the diff and call the search tool itself.
+        auto_accept_distance (float | None): In direct mode, skip the relevance judgment and keep every
+            retrieved chunk when all of them are at most this distance from their diff.
+        budget (Budget | None): Limits on wall time, tokens and LLM requests. The run is aborted with
+            `BudgetExceededError` when it goes over them, the running stage is cancelled when the wall time
+            runs out. Stages in worker threads cannot be stopped, the run still waits for them to finish.
+        metrics_path (str | None): Where to write the JSON metrics report of the run. It is always logged.
+        on_stage (Callable[[StageMetrics], None] | None): Called with the metrics of every stage as soon as
+            it completes, whether it succeeded or not.
+        repository_path (str | None): Checkout of the docs repo to patch, instead of a new worktree. It is
+            expected to be up to date, and the PR branch is created from its HEAD.
+        search_deps (docs_search_agent.Deps | None): Already loaded index and embeddings for the docs search.
+        ledger_path (str | None): SQLite file of the run ledger, None disables it.
+        force (bool): Run the whole pipeline even when the ledger has the outcome, and record the new one.
+
+    Returns:
+        RunMetrics: The metrics of the run.
 
     """
+    if retrieval_mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Unknown retrieval mode {retrieval_mode}, expected one of {RETRIEVAL_MODES}")
+
+    metrics = RunMetrics(budget, on_stage_end=on_stage)
+    timeout = asyncio.timeout(metrics.remaining_seconds())
+    try:
+        async with timeout:
+            await _lapo(
+                metrics,
+                docs_repo,
+                docs_path,
+                source_change_pr,
+                retrieval_mode,
+                auto_accept_distance,
+                repository_path,
+                search_deps,
+                run_ledger.get_ledger(ledger_path) if ledger_path else None,
+                force,
+            )
+    except TimeoutError as e:
+        if not timeout.expired():
+            raise
+        raise BudgetExceededError(
+            f"Run took {metrics.elapsed_seconds:.1f}s, over the budget of {metrics.budget.max_seconds}s"
+        ) from e
+    finally:
+        logger.info(f"Run metrics:\n{metrics.to_json()}")
+        if metrics_path:
+            metrics.write(metrics_path)
+    return metrics
+
+
+async def _in_thread(metrics: RunMetrics, name: str, func: Callable[..., Any], *args: Any) -> Any:
+    """Run a blocking stage in a worker thread, so that other stages can run meanwhile."""
+    with metrics.stage(name):
+        return await asyncio.to_thread(func, *args)
 
+
+async def _ready(value: Any) -> Any:
+    return value
+
+
+async def _lapo(
+    metrics: RunMetrics,
+    docs_repo: str,
+    docs_path: str,
+    source_change_pr: str,
+    retrieval_mode: str,
+    auto_accept_distance: float | None,
+    repository_path: str | None,
+    search_deps: docs_search_agent.Deps | None,
+    ledger: RunLedger | None,
+    force: bool,
+) -> None:
     logger.info(f"Docs Path: {docs_path}")
     logger.info(f"Docs Repo: {docs_repo}")
     logger.info(f"Source Change PR: {source_change_pr}\n\n")
 
     pr_link = source_change_pr
 
-    logger.info("Cloning repository")
-    repository_clone_path = clone_or_update_github_repo("https://github.com/" + docs_repo)
-    logger.info("Cloned repository")
+    # recorded as soon as they exist, the clone stage can still fail afterwards on the budget check
+    mirror: list[str] = []
+    worktree: list[str] = []
+    if repository_path is None:
+        logger.info("Cloning repository")
+        # the docs commit, set by the clone as soon as the mirror is synced
+        synced: concurrent.futures.Future[str] = concurrent.futures.Future()
+
+        def checkout() -> str:
+            try:
+                mirror.append(git_worktree.sync_mirror("https://github.com/" + docs_repo))
+                docs_head_sha = git_pr.rev_parse(mirror[0], f"refs/heads/{MAIN_BRANCH}")
+            except BaseException as e:
+                synced.set_exception(e)
+                raise
+            synced.set_result(docs_head_sha)
+            # the commit rather than the branch, which a concurrent run may fetch again meanwhile
+            worktree.append(git_worktree.add_worktree(mirror[0], docs_head_sha, [docs_path]))
+            return worktree[0]
+
+        clone = asyncio.create_task(_in_thread(metrics, "clone", checkout))
+
+        async def docs_head() -> str:
+            return await asyncio.wrap_future(synced)
+
+    else:
+        clone = asyncio.create_task(_ready(repository_path))
+
+        async def docs_head() -> str:
+            return await asyncio.to_thread(git_pr.get_head_commit, repository_path)
 
-    pr_diff_hunk = git_pr.get_pr_diff_hunk(pr_link)
+    if search_deps is None:
+        index = asyncio.create_task(_in_thread(metrics, "index_load", docs_search_agent.deps))
+    else:
+        index = asyncio.create_task(_ready(search_deps))
+    try:
+        await _run(
+            metrics, docs_repo, pr_link, retrieval_mode, auto_accept_distance, clone, docs_head, index, ledger, force
+        )
+    finally:
+        # Worker threads cannot be cancelled, and a clone stopped halfway would leave the docs repo
+        # in a broken state, so wait for the background stages even when the run stops early. The
+        # cleanup is shielded to also run when the run is cancelled on its wall time budget.
+        cleanup = asyncio.ensure_future(_cleanup(clone, index, mirror, worktree))
+        try:
+            await asyncio.shield(cleanup)
+        except asyncio.CancelledError:
+            await cleanup
+            raise
+    # a background stage the run returned without awaiting can still have failed, e.g. on the budget
+    for task in (clone, index):
+        if not task.cancelled() and task.exception() is not None:
+            raise task.exception()
+
+
+async def _cleanup(clone: asyncio.Task, index: asyncio.Task, mirror: list[str], worktree: list[str]) -> None:
+    await asyncio.gather(clone, index, return_exceptions=True)
+    if worktree:
+        await asyncio.to_thread(git_worktree.remove_worktree, mirror[0], worktree[0])
+
+
+async def _run(
+    metrics: RunMetrics,
+    docs_repo: str,
+    pr_link: str,
+    retrieval_mode: str,
+    auto_accept_distance: float | None,
+    clone: "asyncio.Task[str]",
+    docs_head: Callable[[], Awaitable[str]],
+    index: "asyncio.Task[docs_search_agent.Deps]",
+    ledger: RunLedger | None,
+    force: bool,
+) -> None:
+    def fetch_diff():
+        pr_diff = git_pr.get_pr_diff(pr_link)
+        return pr_diff, pr_diff.is_blank()
+
+    # the diff stays in the cache file, it is streamed to the parser and only read whole for a prompt
+    pr_diff, is_blank = await _in_thread(metrics, "diff_fetch", fetch_diff)
+    head_sha = pr_diff.head_sha
     logger.info("Got PR diff hunk")
 
-    if re.sub(r"\s+", "", pr_diff_hunk) == "":
+    if is_blank:
         logger.info("No changes detected")
-        exit(0)
+        return
 
-    logger.info("Running docs search agent")
-    docs_search_response = docs_search_agent.agent.run_sync(
-        docs_search_agent.question(pr_diff_hunk), deps=docs_search_agent.deps()
-    )
-    logger.info(f"Got docs search response with docs: {len(docs_search_response.data)}")
+    search_deps = await index
+    run_key = None
+    if ledger is not None:
+        run_key = RunKey(
+            source_pr=pr_link,
+            source_head_sha=head_sha,
+            docs_repo=docs_repo,
+            docs_head_sha=await docs_head(),
+            index_fingerprint=search_deps.vectordb.fingerprint(),
+            config=run_config(retrieval_mode, auto_accept_distance),
+        )
+        record = ledger.get(run_key)
+        if record is not None and not force:
+            logger.info(f"{pr_link} at {head_sha} already ran against these docs: {record.outcome}, skipping")
+            if record.patch:
+                rprint(record.patch)
+                rprint(record.git_patch)
+            if record.pr_url:
+                logger.info(f"Docs PR: {record.pr_url}")
+            return
+
+    if retrieval_mode == "direct":
+        logger.info("Running direct docs search")
+
+        def retrieve():
+            diffs = docs_search_agent.file_changes_from_diff(pr_diff.lines())
+            return docs_search_agent.search_related_documentation(search_deps, diffs) if diffs else {}
+
+        related = await _in_thread(metrics, "retrieval", retrieve)
+        with metrics.stage("search_agent") as stage:
+            docs_changes = await docs_search_agent.judge_relevance_async(
+                related, auto_accept_distance, usage=stage.usage, usage_limits=metrics.usage_limits()
+            )
+    else:
+        logger.info("Running docs search agent")
+        diff_text = await asyncio.to_thread(pr_diff.read)
+        with metrics.stage("search_agent") as stage:
+            docs_search_response = await docs_search_agent.agent.run(
+                docs_search_agent.question(diff_text),
+                deps=search_deps,
+                usage=stage.usage,
+                usage_limits=metrics.usage_limits(),
+            )
+            stage.record_messages(docs_search_response.all_messages())
+        docs_changes = docs_search_response.data
+    logger.info(f"Got docs search response with docs: {len(docs_changes)}")
+
+    if not docs_changes:
+        logger.info("No related documentation found")
+        if run_key is not None:
+            ledger.record(run_key, run_ledger.NO_DOCS)
+        return
+
+    repository_clone_path = await clone
+    logger.info("Cloned repository")
 
     logger.info("Running generate patch agent")
-    patch_agent_response = generate_patch_agent.generate_patch_agent.run_sync(
-        json.dumps([x.model_dump() for x in docs_search_response.data]),
-        deps=generate_patch_agent.Deps(docs_repo_path=repository_clone_path),
-    )
+    with metrics.stage("patch_agent") as stage:
+        patch_agent_response = await generate_patch_agent.generate_patch_agent.run(
+            json.dumps([x.model_dump() for x in docs_changes]),
+            deps=generate_patch_agent.Deps(docs_repo_path=repository_clone_path),
+            usage=stage.usage,
+            usage_limits=metrics.usage_limits(),
+        )
+        stage.record_messages(patch_agent_response.all_messages())
     logger.info("Got patch agent response")
 
     patch = patch_agent_response.data.patch_diff
@@ -64,24 +327,59 @@ def lapo(docs_repo: str, docs_path: str, source_change_pr: str) -> None:
     clean_patch = re.sub(r"\s+", "", patch)
     if len(clean_patch) == 0:
         logger.info("No changes detected")
-        exit(0)
+        if run_key is not None:
+            ledger.record(run_key, run_ledger.EMPTY_PATCH)
+        return
 
     logger.info("generating git patch")
-    git_patch = generate_git_patch_from_search_replace(repository_clone_path, patch)
+    git_patch = await _in_thread(
+        metrics, "patch_generation", generate_git_patch_from_search_replace, repository_clone_path, patch
+    )
     logger.info("Generated git patch")
 
     rprint(patch)
     rprint(git_patch)
 
     logger.info("Creating PR")
-    pr_response = create_pr_from_patch.create_pr_from_patch(
-        repo_url=f"https://github.com/{docs_repo}/",
-        repo_path=repository_clone_path,
-        reasoning=patch_agent_response.data.reasoning,
-        title=patch_agent_response.data.title,
-        patch=git_patch,
-        triggered_by=pr_link,
-    )
+    with metrics.stage("pr_creation"):
+        pr_response = await asyncio.to_thread(
+            create_pr_from_patch.create_pr_from_patch,
+            repo_url=f"https://github.com/{docs_repo}/",
+            repo_path=repository_clone_path,
+            reasoning=patch_agent_response.data.reasoning,
+            title=patch_agent_response.data.title,
+            patch=git_patch,
+            triggered_by=pr_link,
+            update_base=False,
+        )
 
     logger.info("Created PR")
     rprint(pr_response)
+    if run_key is not None:
+        ledger.record(run_key, run_ledger.PR_CREATED, patch=patch, git_patch=git_patch, pr_url=pr_response["pr_url"])
+
+
+def _model_name(agent: Any) -> str:
+    model = agent.model
+    if isinstance(model, str):
+        return model
+    return f"{getattr(model, 'system', '')}:{getattr(model, 'model_name', type(model).__name__)}"
+
+
+def run_config(retrieval_mode: str, auto_accept_distance: float | None) -> dict:
+    """The models and settings a run's outcome depends on, part of its run ledger key."""
+    search_agent = docs_search_agent.relevance_agent if retrieval_mode == "direct" else docs_search_agent.agent
+    return {
+        "retrieval_mode": retrieval_mode,
+        "auto_accept_distance": auto_accept_distance,
+        "search_model": _model_name(search_agent),
+        "patch_model": _model_name(generate_patch_agent.generate_patch_agent),
+        "embeddings_model": rag.EMBEDDINGS_MODEL,
+        "retrieval": {
+            "k": rag.RETRIEVAL_K,
+            "max_distance": rag.RETRIEVAL_MAX_DISTANCE,
+            "mmr_lambda": rag.RETRIEVAL_MMR_LAMBDA,
+            "fetch_k": rag.RETRIEVAL_FETCH_K,
+            "max_chunks_per_file": rag.RETRIEVAL_MAX_CHUNKS_PER_FILE,
+        },
+    }
@@ -0,0 +1,210 @@
+"""
+Per-run metrics and budgets for the lapo pipeline.
+
+Every pipeline stage runs inside `RunMetrics.stage`, which records its wall
+time, LLM usage (accumulated by pydantic-ai into the stage's `Usage`), tool
+calls, retries and embedding calls. Stages may overlap when the pipeline runs
+them concurrently, so their times do not add up to the run time. Embedding calls
+are counted in the stage's context (see `embedding_pipeline.count_calls`), so
+overlapping stages and concurrent runs each count their own. The report is plain JSON so CI can keep it
+as an artifact. A `Budget` turns the same numbers into hard limits: agents get
+the remaining tokens and requests as `UsageLimits`, a run that goes over its
+token budget is aborted with `BudgetExceededError`, and the pipeline cancels a
+run that is still going when `remaining_seconds` runs out.
+"""
+import asyncio
+import json
+import logging
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
+
+from pydantic_ai.exceptions import UsageLimitExceeded
+from pydantic_ai.messages import ModelMessage, ModelRequest, ModelResponse, RetryPromptPart, ToolCallPart
+from pydantic_ai.usage import Usage, UsageLimits
+
+from src.rag.embedding_pipeline import count_calls
+
+logger = logging.getLogger(__name__)
+
+# Name of the tool pydantic-ai uses to return structured results, not a real tool call
+_RESULT_TOOL_NAME = "final_result"
+# pydantic-ai's default request limit per agent run
+DEFAULT_REQUEST_LIMIT = 50
+
+
+class BudgetExceededError(RuntimeError):
+    pass
+
+
+@dataclass(frozen=True)
+class Budget:
+    """Hard limits for a whole run. None means unlimited."""
+
+    max_seconds: Optional[float] = None
+    max_total_tokens: Optional[int] = None
+    max_requests: Optional[int] = None
+
+
+@dataclass
+class StageMetrics:
+    name: str
+    status: str = "running"
+    seconds: float = 0.0
+    tool_calls: int = 0
+    retries: int = 0
+    embedding_requests: int = 0
+    embedded_texts: int = 0
+    embedding_cache_hits: int = 0
+    # accumulated by pydantic-ai when passed as `usage=` to an agent run
+    usage: Usage = field(default_factory=Usage)
+
+    def record_messages(self, messages: Sequence[ModelMessage]) -> None:
+        """Count the tool calls and retries of an agent run from its messages."""
+        for message in messages:
+            if isinstance(message, ModelResponse):
+                self.tool_calls += sum(
+                    1 for part in message.parts if isinstance(part, ToolCallPart) and part.tool_name != _RESULT_TOOL_NAME
+                )
+            elif isinstance(message, ModelRequest):
+                self.retries += sum(1 for part in message.parts if isinstance(part, RetryPromptPart))
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "status": self.status,
+            "seconds": round(self.seconds, 3),
+            "requests": self.usage.requests,
+            "request_tokens": self.usage.request_tokens or 0,
+            "response_tokens": self.usage.response_tokens or 0,
+            "total_tokens": self.usage.total_tokens or 0,
+            "tool_calls": self.tool_calls,
+            "retries": self.retries,
+            "embedding_requests": self.embedding_requests,
+            "embedded_texts": self.embedded_texts,
+            "embedding_cache_hits": self.embedding_cache_hits,
+        }
+
+
+class RunMetrics:
+    def __init__(
+        self,
+        budget: Optional[Budget] = None,
+        clock: Callable[[], float] = time.monotonic,
+        on_stage_end: Optional[Callable[[StageMetrics], None]] = None,
+    ) -> None:
+        self.budget = budget or Budget()
+        self.stages: List[StageMetrics] = []
+        self.on_stage_end = on_stage_end
+        self._clock = clock
+        self._started = clock()
+
+    @property
+    def elapsed_seconds(self) -> float:
+        return self._clock() - self._started
+
+    @property
+    def total_tokens(self) -> int:
+        return sum(stage.usage.total_tokens or 0 for stage in self.stages)
+
+    @property
+    def requests(self) -> int:
+        return sum(stage.usage.requests for stage in self.stages)
+
+    def remaining_seconds(self) -> Optional[float]:
+        """Wall time left in the budget, None when it is unlimited."""
+        if self.budget.max_seconds is None:
+            return None
+        return max(0.0, self.budget.max_seconds - self.elapsed_seconds)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[StageMetrics]:
+        """Measure a pipeline stage, then enforce the budget.
+
+        Raises:
+            BudgetExceededError: If an agent run in the stage hit its usage limits, or the
+                run is over its budget once the stage is done.
+        """
+        self.check_budget()
+        stage = StageMetrics(name=name)
+        self.stages.append(stage)
+        embedding_calls: Dict[str, int] = {}
+        started = self._clock()
+        try:
+            with count_calls(embedding_calls):
+                yield stage
+            stage.status = "ok"
+        except UsageLimitExceeded as e:
+            stage.status = "budget_exceeded"
+            raise BudgetExceededError(f"Stage {name} exceeded the run budget: {e}") from e
+        except asyncio.CancelledError:
+            stage.status = "cancelled"
+            raise
+        except BaseException:
+            stage.status = "error"
+            raise
+        finally:
+            stage.seconds = self._clock() - started
+            stage.embedding_requests = embedding_calls.get("requests", 0)
+            stage.embedded_texts = embedding_calls.get("texts", 0)
+            stage.embedding_cache_hits = embedding_calls.get("cache_hits", 0)
+            logger.info(f"Stage {name} {stage.status} in {stage.seconds:.2f}s")
+            if self.on_stage_end is not None:
+                self.on_stage_end(stage)
+        self.check_budget()
+
+    def usage_limits(self) -> UsageLimits:
+        """Limits for the next agent run: what is left of the run budget.
+
+        Usage is counted from the start of the agent run, so the limits are what remains
+        after the stages that already ran.
+        """
+        request_limit = DEFAULT_REQUEST_LIMIT
+        if self.budget.max_requests is not None:
+            request_limit = max(0, self.budget.max_requests - self.requests)
+        total_tokens_limit = None
+        if self.budget.max_total_tokens is not None:
+            total_tokens_limit = max(0, self.budget.max_total_tokens - self.total_tokens)
+        return UsageLimits(request_limit=request_limit, total_tokens_limit=total_tokens_limit)
+
+    def check_budget(self) -> None:
+        budget = self.budget
+        if budget.max_seconds is not None and self.elapsed_seconds > budget.max_seconds:
+            raise BudgetExceededError(f"Run took {self.elapsed_seconds:.1f}s, over the budget of {budget.max_seconds}s")
+        if budget.max_total_tokens is not None and self.total_tokens > budget.max_total_tokens:
+            raise BudgetExceededError(
+                f"Run used {self.total_tokens} tokens, over the budget of {budget.max_total_tokens}"
+            )
+        if budget.max_requests is not None and self.requests > budget.max_requests:
+            raise BudgetExceededError(f"Run made {self.requests} LLM requests, over the budget of {budget.max_requests}")
+
+    def as_dict(self) -> Dict[str, Any]:
+        stages = [stage.as_dict() for stage in self.stages]
+        totals = {
+            key: sum(stage[key] for stage in stages)
+            for key in (
+                "requests",
+                "request_tokens",
+                "response_tokens",
+                "total_tokens",
+                "tool_calls",
+                "retries",
+                "embedding_requests",
+                "embedded_texts",
+                "embedding_cache_hits",
+            )
+        }
+        return {
+            "seconds": round(self.elapsed_seconds, 3),
+            "totals": totals,
+            "stages": stages,
+            "budget": asdict(self.budget),
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.as_dict(), indent=2)
+
+    def write(self, path: str) -> None:
+        with open(path, "w") as f:
+            f.write(self.to_json())
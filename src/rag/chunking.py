@@ -0,0 +1,251 @@
+"""
+Heading-aware chunking of markdown documents before embedding.
+
+Documents are first split into sections at markdown headings (ignoring headings
+inside fenced code blocks and front matter). Each section is then split into
+paragraphs and fenced code blocks, which are packed into chunks that respect a
+token budget. Consecutive chunks of the same section overlap by a few paragraphs
+so that content at a chunk boundary is not lost.
+"""
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+DEFAULT_MAX_TOKENS = 512
+DEFAULT_OVERLAP_TOKENS = 64
+HEADING_PATH_SEPARATOR = " > "
+
+_HEADING_RE = re.compile(r"^ {0,3}(#{1,6})(?:[ \t]+(.*?))?[ \t#]*$")
+_FENCE_RE = re.compile(r"^ {0,3}(`{3,}|~{3,})")
+
+
+@dataclass
+class Chunk:
+    """A contiguous slice of a markdown document.
+
+    Lines are 1-based and inclusive, bytes are 0-based and end-exclusive offsets
+    into the UTF-8 encoded document.
+    """
+
+    file_name: str
+    content: str
+    heading_path: List[str]
+    chunk_index: int
+    start_line: int
+    end_line: int
+    start_byte: int
+    end_byte: int
+
+    @property
+    def id(self) -> str:
+        return chunk_id(self.file_name, self.chunk_index)
+
+    def metadata(self) -> Dict:
+        return {
+            "file_name": self.file_name,
+            "heading_path": HEADING_PATH_SEPARATOR.join(self.heading_path),
+            "chunk_index": self.chunk_index,
+            "start_line": self.start_line,
+            "end_line": self.end_line,
+            "start_byte": self.start_byte,
+            "end_byte": self.end_byte,
+        }
+
+
+@dataclass
+class _Unit:
+    # Line range [start, end) of a paragraph or fenced block
+    start: int
+    end: int
+    tokens: int
+
+
+def chunk_id(file_name: str, chunk_index: int) -> str:
+    return f"{file_name}#{chunk_index}"
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token), good enough for budgeting."""
+    return max(1, len(text) // 4)
+
+
+def chunk_markdown(
+    file_name: str,
+    text: str,
+    max_tokens: int = DEFAULT_MAX_TOKENS,
+    overlap_tokens: int = DEFAULT_OVERLAP_TOKENS,
+) -> List[Chunk]:
+    """Split a markdown document into heading-aware chunks.
+
+    Args:
+        file_name: Name of the document, stored in the metadata of every chunk.
+        text: The markdown content.
+        max_tokens: Maximum estimated tokens per chunk. A single line longer than
+            this is kept whole.
+        overlap_tokens: Maximum estimated tokens repeated from the end of the
+            previous chunk of the same section.
+
+    Returns:
+        The chunks in document order.
+    """
+    lines = text.splitlines(keepends=True)
+    byte_offsets = [0]
+    for line in lines:
+        byte_offsets.append(byte_offsets[-1] + len(line.encode("utf-8")))
+
+    chunks: List[Chunk] = []
+    for section_start, section_end, heading_path in _split_sections(lines):
+        units = _split_units(lines, section_start, section_end, max_tokens)
+        for start, end in _pack_units(units, max_tokens, overlap_tokens):
+            content = "".join(lines[start:end])
+            if not content.strip():
+                continue
+            chunks.append(
+                Chunk(
+                    file_name=file_name,
+                    content=content,
+                    heading_path=heading_path,
+                    chunk_index=len(chunks),
+                    start_line=start + 1,
+                    end_line=end,
+                    start_byte=byte_offsets[start],
+                    end_byte=byte_offsets[end],
+                )
+            )
+    return chunks
+
+
+def parse_headings(lines: List[str]) -> List[Tuple[int, int, str]]:
+    """Find the markdown headings of a document.
+
+    Returns:
+        A list of (line_index, level, title) tuples, skipping headings inside
+        fenced code blocks and front matter.
+    """
+    headings: List[Tuple[int, int, str]] = []
+    fence: str | None = None
+    in_front_matter = bool(lines) and lines[0].strip() == "---"
+
+    for i, line in enumerate(lines):
+        if in_front_matter:
+            if i > 0 and line.strip() in ("---", "..."):
+                in_front_matter = False
+            continue
+
+        if fence is not None:
+            if _closes_fence(line, fence):
+                fence = None
+            continue
+        fence_match = _FENCE_RE.match(line)
+        if fence_match:
+            fence = fence_match.group(1)
+            continue
+
+        heading_match = _HEADING_RE.match(line.rstrip("\r\n"))
+        if heading_match:
+            headings.append((i, len(heading_match.group(1)), (heading_match.group(2) or "").strip()))
+    return headings
+
+
+def _closes_fence(line: str, fence: str) -> bool:
+    match = _FENCE_RE.match(line)
+    return (
+        match is not None
+        and match.group(1)[0] == fence[0]
+        and len(match.group(1)) >= len(fence)
+        and line.strip() == match.group(1)
+    )
+
+
+def _split_sections(lines: List[str]) -> List[Tuple[int, int, List[str]]]:
+    sections: List[Tuple[int, int, List[str]]] = []
+    stack: List[Tuple[int, str]] = []
+    section_start = 0
+    section_path: List[str] = []
+
+    for line_index, level, title in parse_headings(lines):
+        if line_index > section_start:
+            sections.append((section_start, line_index, section_path))
+        while stack and stack[-1][0] >= level:
+            stack.pop()
+        stack.append((level, title))
+        section_start = line_index
+        section_path = [t for _, t in stack]
+
+    if section_start < len(lines):
+        sections.append((section_start, len(lines), section_path))
+    return sections
+
+
+def _split_units(lines: List[str], start: int, end: int, max_tokens: int) -> List[_Unit]:
+    """Split a section into paragraphs and fenced code blocks.
+
+    Blank lines are attached to the preceding unit so that units cover the whole
+    section. Units larger than `max_tokens` are split at line boundaries.
+    """
+    ranges: List[Tuple[int, int]] = []
+    i = start
+    while i < end:
+        unit_start = i
+        fence_match = _FENCE_RE.match(lines[i])
+        if fence_match:
+            fence = fence_match.group(1)
+            i += 1
+            while i < end:
+                i += 1
+                if _closes_fence(lines[i - 1], fence):
+                    break
+        else:
+            while i < end and lines[i].strip() and not (i > unit_start and _FENCE_RE.match(lines[i])):
+                i += 1
+        while i < end and not lines[i].strip():
+            i += 1
+        if i == unit_start:
+            i += 1
+        ranges.append((unit_start, i))
+
+    units: List[_Unit] = []
+    for unit_start, unit_end in ranges:
+        tokens = estimate_tokens("".join(lines[unit_start:unit_end]))
+        if tokens <= max_tokens:
+            units.append(_Unit(unit_start, unit_end, tokens))
+            continue
+        piece_start = unit_start
+        piece_tokens = 0
+        for j in range(unit_start, unit_end):
+            line_tokens = estimate_tokens(lines[j])
+            if j > piece_start and piece_tokens + line_tokens > max_tokens:
+                units.append(_Unit(piece_start, j, piece_tokens))
+                piece_start = j
+                piece_tokens = 0
+            piece_tokens += line_tokens
+        units.append(_Unit(piece_start, unit_end, piece_tokens))
+    return units
+
+
+def _pack_units(units: List[_Unit], max_tokens: int, overlap_tokens: int) -> List[Tuple[int, int]]:
+    """Greedily pack units into line ranges of at most `max_tokens`."""
+    packed: List[Tuple[int, int]] = []
+    current: List[_Unit] = []
+    current_tokens = 0
+
+    for unit in units:
+        if current and current_tokens + unit.tokens > max_tokens:
+            packed.append((current[0].start, current[-1].end))
+            carry: List[_Unit] = []
+            carry_tokens = 0
+            for previous in reversed(current):
+                if carry_tokens + previous.tokens > overlap_tokens:
+                    break
+                carry.insert(0, previous)
+                carry_tokens += previous.tokens
+            if carry and carry_tokens + unit.tokens <= max_tokens:
+                current, current_tokens = carry, carry_tokens
+            else:
+                current, current_tokens = [], 0
+        current.append(unit)
+        current_tokens += unit.tokens
+
+    if current:
+        packed.append((current[0].start, current[-1].end))
+    return packed
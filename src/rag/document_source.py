@@ -0,0 +1,143 @@
+"""
+Documents of a git repository, read from git's object store.
+
+Files are enumerated with `git ls-files` (or `git ls-tree` for a commit), so
+only tracked files are indexed: ignored build output or `node_modules` never
+are. Each file comes with its blob SHA, which changes exactly when its content
+changes and serves as the change key of the index manifest without the file
+being read. Contents are read from a single `git cat-file --batch` process and
+yielded one document at a time, so the docs tree is never held in memory as a
+whole.
+
+Without a ref, files are read as they are in the index. Changes that are not
+staged are not seen, a warning lists how many files have some.
+"""
+import logging
+import subprocess
+from dataclasses import dataclass
+from typing import Iterable, Iterator, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+DOCUMENT_EXTENSIONS = (".md", ".mdx")
+# regular files, symlinks and submodules are skipped
+_FILE_MODES = ("100644", "100755")
+
+
+@dataclass(frozen=True)
+class SourceFile:
+    # relative to the root of the repository
+    path: str
+    blob_sha: str
+
+
+@dataclass(frozen=True)
+class SourceDocument:
+    path: str
+    blob_sha: str
+    content: str
+
+
+def _git(repo_path: str, *args: str) -> bytes:
+    return subprocess.run(["git", "-C", repo_path, *args], capture_output=True, check=True).stdout
+
+
+def list_files(
+    repo_path: str,
+    docs_path: str = ".",
+    ref: Optional[str] = None,
+    extensions: Sequence[str] = DOCUMENT_EXTENSIONS,
+) -> List[SourceFile]:
+    """Tracked files under `docs_path` with one of `extensions`, with their blob SHAs.
+
+    Args:
+        repo_path (str): Root of the git repository
+        docs_path (str): Directory to list, relative to the root of the repository
+        ref (Optional[str]): Commit to list the files of, None for the index
+
+    Raises:
+        subprocess.CalledProcessError: If the git command fails
+    """
+    if ref is None:
+        # <mode> <sha> <stage>\t<path>
+        output = _git(repo_path, "ls-files", "-z", "--stage", "--", docs_path)
+    else:
+        # <mode> <type> <sha>\t<path>
+        output = _git(repo_path, "ls-tree", "-r", "-z", ref, "--", docs_path)
+
+    files: List[SourceFile] = []
+    for record in output.decode("utf-8", errors="surrogateescape").split("\0"):
+        if not record:
+            continue
+        info, path = record.split("\t", 1)
+        fields = info.split(" ")
+        if ref is None:
+            mode, blob_sha, stage = fields
+            # unmerged files have one entry per side of the conflict and none in stage 0
+            if stage != "0":
+                continue
+        else:
+            mode, _, blob_sha = fields
+        if mode in _FILE_MODES and path.lower().endswith(tuple(extensions)):
+            files.append(SourceFile(path=path, blob_sha=blob_sha))
+
+    if ref is None:
+        unstaged = _git(repo_path, "ls-files", "-z", "--modified", "--", docs_path).split(b"\0")
+        indexed = {f.path.encode("utf-8", errors="surrogateescape") for f in files}
+        count = len(indexed.intersection(unstaged))
+        if count:
+            logger.warning(f"{count} documents have unstaged changes, they are read as they are in the index")
+    return files
+
+
+def read_documents(repo_path: str, files: Iterable[SourceFile]) -> Iterator[SourceDocument]:
+    """Read the content of `files` from the object store, one document at a time.
+
+    Contents are decoded as UTF-8, invalid bytes are replaced.
+
+    Raises:
+        ValueError: If the blob of a file is not in the repository
+    """
+    process = subprocess.Popen(
+        ["git", "-C", repo_path, "cat-file", "--batch"],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    try:
+        for file in files:
+            # one object at a time: git answers each request before reading the next one, so neither pipe fills up
+            process.stdin.write(file.blob_sha.encode() + b"\n")
+            process.stdin.flush()
+            header = process.stdout.readline().decode().split()
+            if len(header) != 3 or header[1] != "blob":
+                raise ValueError(f"Blob {file.blob_sha} of {file.path} is missing from {repo_path}")
+            data = process.stdout.read(int(header[2]) + 1)[:-1]
+            yield SourceDocument(path=file.path, blob_sha=file.blob_sha, content=_decode(file.path, data))
+    finally:
+        try:
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+        process.stdout.close()
+        # also reached when the consumer stops early, git exits once its input is closed
+        process.wait()
+        process.stderr.close()
+
+
+def iter_documents(
+    repo_path: str,
+    docs_path: str = ".",
+    ref: Optional[str] = None,
+    extensions: Sequence[str] = DOCUMENT_EXTENSIONS,
+) -> Iterator[SourceDocument]:
+    """Tracked documents under `docs_path` with their content. See `list_files`."""
+    return read_documents(repo_path, list_files(repo_path, docs_path, ref=ref, extensions=extensions))
+
+
+def _decode(path: str, data: bytes) -> str:
+    try:
+        return data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        logger.warning(f"{path} is not valid UTF-8, invalid bytes are replaced")
+        return data.decode("utf-8-sig", errors="replace")
@@ -0,0 +1,164 @@
+"""
+Persistent, content-addressed cache of embedding vectors.
+
+Vectors are stored in SQLite keyed by the embedding model and the SHA-256 of the
+embedded text, so unchanged documents and repeated search queries (e.g. the same
+diff on a PR re-run) never reach the embedding provider twice. The cache is
+bounded in number of entries and evicts the least recently used vectors first.
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from src.rag.embedding_pipeline import record_calls
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ENTRIES = 200_000
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, path: str, max_entries: int = DEFAULT_MAX_ENTRIES) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._last_used = 0
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used INTEGER NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+
+    def get_many(self, model: str, texts: Sequence[str]) -> List[Optional[List[float]]]:
+        """Look up the vectors of `texts`, returning None for the ones not cached."""
+        hashes = [text_hash(text) for text in texts]
+        found: Dict[str, List[float]] = {}
+        with self._lock:
+            unique = list(dict.fromkeys(hashes))
+            # stay well below SQLite's limit of host parameters per statement
+            for i in range(0, len(unique), 500):
+                part = unique[i : i + 500]
+                placeholders = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *part],
+                ).fetchall()
+                for h, blob in rows:
+                    found[h] = np.frombuffer(blob, dtype=np.float32).tolist()
+            if found:
+                now = self._now()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                    [(now, model, h) for h in found],
+                )
+                self._conn.commit()
+            result = [found.get(h) for h in hashes]
+            hits = sum(1 for vector in result if vector is not None)
+            self.hits += hits
+            self.misses += len(result) - hits
+        return result
+
+    def put_many(self, model: str, texts: Sequence[str], vectors: Sequence[Sequence[float]]) -> None:
+        with self._lock:
+            now = self._now()
+        rows = [
+            (model, text_hash(text), np.asarray(vector, dtype=np.float32).tobytes(), now)
+            for text, vector in zip(texts, vectors)
+        ]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)", rows)
+            self._evict()
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _now(self) -> int:
+        # strictly increasing so that LRU order is well defined within a process
+        self._last_used = max(time.time_ns(), self._last_used + 1)
+        return self._last_used
+
+    def _evict(self) -> None:
+        count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        excess = count - self.max_entries
+        if excess <= 0:
+            return
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+            (excess,),
+        )
+        self.evictions += excess
+        logger.debug(f"Evicted {excess} cached embeddings")
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that serves vectors from an `EmbeddingCache` when possible.
+
+    Documents and queries are cached separately because providers embed them
+    differently (e.g. Gemini's retrieval_document and retrieval_query task types).
+    """
+
+    def __init__(self, inner: Embeddings, cache: EmbeddingCache, model: str | None = None) -> None:
+        self.inner = inner
+        self.cache = cache
+        self.model = model or getattr(inner, "model", type(inner).__name__)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(texts, f"{self.model}:document", self.inner.embed_documents)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_queries([text])[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        embed_queries = getattr(self.inner, "embed_queries", None)
+        if embed_queries is None:
+
+            def embed_queries(queries: List[str]) -> List[List[float]]:
+                return [self.inner.embed_query(query) for query in queries]
+
+        return self._embed(texts, f"{self.model}:query", embed_queries)
+
+    def _embed(self, texts: List[str], key: str, embed) -> List[List[float]]:
+        vectors = self.cache.get_many(key, texts)
+        hits = sum(1 for vector in vectors if vector is not None)
+        record_calls(cache_hits=hits, cache_misses=len(vectors) - hits)
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        if missing:
+            computed = dict(zip(missing, embed(missing)))
+            self.cache.put_many(key, missing, [computed[text] for text in missing])
+            vectors = [vector if vector is not None else computed[text] for text, vector in zip(texts, vectors)]
+        return vectors
@@ -0,0 +1,319 @@
+"""
+Batched, concurrent embedding client.
+
+`BatchEmbeddings` wraps any langchain `Embeddings` implementation and sends the
+texts in fixed-size batches over a bounded thread pool. Requests go through a
+token-bucket rate limiter and are retried with exponential backoff when the
+provider answers with a rate limit or transient error. Throughput is reported
+through `EmbeddingStats`, for the whole process, and through `count_calls`, for
+the callers in one context, e.g. one stage of a run.
+
+`FakeEmbeddings` is a deterministic offline embedder with configurable latency
+and rate limiting, used to benchmark the pipeline without network access:
+
+    ./uvrun.sh src/rag/embedding_pipeline.py --texts 2000 --latency 0.2 --workers 8
+"""
+import argparse
+import hashlib
+import inspect
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from src.rag.chunking import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_MAX_RETRIES = 6
+
+_RETRYABLE_ERROR_NAMES = {"ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "DeadlineExceeded"}
+_RETRYABLE_MESSAGES = ("429", "resource exhausted", "resource has been exhausted", "rate limit", "503", "unavailable")
+
+# counters of the enclosing `count_calls` blocks
+_call_counters: ContextVar[Tuple[Dict[str, int], ...]] = ContextVar("embedding_call_counters", default=())
+_call_counters_lock = threading.Lock()
+
+
+@contextmanager
+def count_calls(counters: Dict[str, int]) -> Iterator[Dict[str, int]]:
+    """Add the embedding calls made in this block to `counters`.
+
+    The counters follow the context, which asyncio copies into tasks and `asyncio.to_thread` workers, so
+    calls made concurrently by other stages or runs are not counted. Keys are "requests" and "texts" sent
+    to the provider, and "cache_hits" and "cache_misses" of `CachedEmbeddings`.
+    """
+    token = _call_counters.set(_call_counters.get() + (counters,))
+    try:
+        yield counters
+    finally:
+        _call_counters.reset(token)
+
+
+def record_calls(**counts: int) -> None:
+    """Add `counts` to the counters of the enclosing `count_calls` blocks."""
+    _add_calls(_call_counters.get(), counts)
+
+
+def _add_calls(counters: Tuple[Dict[str, int], ...], counts: Dict[str, int]) -> None:
+    with _call_counters_lock:
+        for counter in counters:
+            for key, value in counts.items():
+                counter[key] = counter.get(key, 0) + value
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """Whether an embedding error is a rate limit or transient failure worth retrying."""
+    if type(error).__name__ in _RETRYABLE_ERROR_NAMES:
+        return True
+    status_code = getattr(error, "status_code", None) or getattr(error, "code", None)
+    if status_code in (429, 500, 502, 503, 504):
+        return True
+    message = str(error).lower()
+    return any(m in message for m in _RETRYABLE_MESSAGES)
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, bursts of up to `capacity`."""
+
+    def __init__(
+        self,
+        rate: float,
+        capacity: float | None = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float = 1.0) -> float:
+        """Block until `amount` tokens are available.
+
+        Returns:
+            The number of seconds spent waiting.
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return waited
+                wait = (amount - self._tokens) / self.rate
+            self._sleep(wait)
+            waited += wait
+
+
+@dataclass
+class EmbeddingStats:
+    texts: int = 0
+    tokens: int = 0
+    requests: int = 0
+    retries: int = 0
+    throttled_seconds: float = 0.0
+    seconds: float = 0.0
+
+    @property
+    def texts_per_second(self) -> float:
+        return self.texts / self.seconds if self.seconds else 0.0
+
+    @property
+    def tokens_per_second(self) -> float:
+        return self.tokens / self.seconds if self.seconds else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            **asdict(self),
+            "texts_per_second": round(self.texts_per_second, 2),
+            "tokens_per_second": round(self.tokens_per_second, 2),
+        }
+
+
+class BatchEmbeddings(Embeddings):
+    """Embeddings wrapper that batches, parallelises, rate limits and retries requests."""
+
+    def __init__(
+        self,
+        inner: Embeddings,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        requests_per_minute: float | None = None,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        initial_backoff: float = 1.0,
+        max_backoff: float = 60.0,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        self.inner = inner
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.rate_limiter = TokenBucket(requests_per_minute / 60.0, sleep=sleep) if requests_per_minute else None
+        self.stats = EmbeddingStats()
+        self._sleep = sleep
+        self._stats_lock = threading.Lock()
+        self._inner_accepts_task_type = "task_type" in inspect.signature(inner.embed_documents).parameters
+
+    @property
+    def model(self) -> str:
+        return getattr(self.inner, "model", type(self.inner).__name__)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(texts, query=False)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed([text], query=True)[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Embed several search queries, batching them like documents."""
+        return self._embed(texts, query=True)
+
+    def _embed(self, texts: List[str], query: bool) -> List[List[float]]:
+        if not texts:
+            return []
+        st = time.monotonic()
+        batches = [texts[i : i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        # the pool threads do not inherit the context of the caller
+        counters = _call_counters.get()
+        if len(batches) == 1 or self.max_workers <= 1:
+            results = [self._embed_batch(batch, query, counters) for batch in batches]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(batches))) as executor:
+                results = list(executor.map(lambda batch: self._embed_batch(batch, query, counters), batches))
+        with self._stats_lock:
+            self.stats.seconds += time.monotonic() - st
+        return [vector for batch_result in results for vector in batch_result]
+
+    def _embed_batch(
+        self, batch: List[str], query: bool, counters: Tuple[Dict[str, int], ...] = ()
+    ) -> List[List[float]]:
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                waited = self.rate_limiter.acquire()
+                if waited:
+                    with self._stats_lock:
+                        self.stats.throttled_seconds += waited
+            try:
+                vectors = self._call_inner(batch, query)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable_error(e):
+                    raise
+                delay = min(self.max_backoff, self.initial_backoff * 2**attempt) * random.uniform(0.5, 1.0)
+                logger.warning(f"Embedding request failed ({e}), retrying in {delay:.1f}s")
+                with self._stats_lock:
+                    self.stats.retries += 1
+                self._sleep(delay)
+                attempt += 1
+                continue
+
+            with self._stats_lock:
+                self.stats.requests += 1
+                self.stats.texts += len(batch)
+                self.stats.tokens += sum(estimate_tokens(text) for text in batch)
+            _add_calls(counters, {"requests": 1, "texts": len(batch)})
+            return vectors
+
+    def _call_inner(self, batch: List[str], query: bool) -> List[List[float]]:
+        if not query:
+            return self.inner.embed_documents(batch)
+        if self._inner_accepts_task_type:
+            return self.inner.embed_documents(batch, task_type="retrieval_query")
+        return [self.inner.embed_query(text) for text in batch]
+
+
+class FakeRateLimitError(Exception):
+    def __init__(self) -> None:
+        super().__init__("429 Resource has been exhausted (simulated)")
+
+
+class FakeEmbeddings(Embeddings):
+    """Deterministic offline embedder for tests and benchmarks.
+
+    Args:
+        size: Dimension of the generated vectors.
+        latency: Seconds each call to the embedder takes, simulating a network round trip.
+        rate_limit_every: If set, every n-th call fails with a simulated 429 error.
+    """
+
+    def __init__(self, size: int = 768, latency: float = 0.0, rate_limit_every: int | None = None) -> None:
+        self.size = size
+        self.latency = latency
+        self.rate_limit_every = rate_limit_every
+        self.model = f"fake-{size}"
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with self._lock:
+            self.calls += 1
+            call = self.calls
+        if self.latency:
+            time.sleep(self.latency)
+        if self.rate_limit_every and call % self.rate_limit_every == 0:
+            raise FakeRateLimitError()
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    def _vector(self, text: str) -> List[float]:
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.size).astype(np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+
+def benchmark(
+    n_texts: int,
+    batch_size: int,
+    max_workers: int,
+    latency: float,
+    requests_per_minute: Optional[float] = None,
+    rate_limit_every: Optional[int] = None,
+) -> EmbeddingStats:
+    embedder = BatchEmbeddings(
+        FakeEmbeddings(latency=latency, rate_limit_every=rate_limit_every),
+        batch_size=batch_size,
+        max_workers=max_workers,
+        requests_per_minute=requests_per_minute,
+        initial_backoff=0.01,
+    )
+    texts = [f"document {i} " + "lorem ipsum " * 50 for i in range(n_texts)]
+    embedder.embed_documents(texts)
+    return embedder.stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the embedding pipeline against a fake embedder")
+    parser.add_argument("--texts", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=DEFAULT_MAX_WORKERS)
+    parser.add_argument("--latency", type=float, default=0.1, help="Simulated seconds per request")
+    parser.add_argument("--requests-per-minute", type=float, default=None)
+    parser.add_argument("--rate-limit-every", type=int, default=None, help="Simulate a 429 every n requests")
+    args = parser.parse_args()
+
+    stats = benchmark(
+        args.texts, args.batch_size, args.workers, args.latency, args.requests_per_minute, args.rate_limit_every
+    )
+    print(stats.as_dict())
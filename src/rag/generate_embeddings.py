@@ -1,11 +1,19 @@
+import argparse
 import os
 import sys
 import time
 import logging
-from typing import List, Dict
-import rag
-from langchain_community.vectorstores import FAISS
-import shutil
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple
+import numpy as np
+
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from src.rag import rag
+from src.rag.chunking import Chunk, chunk_markdown
+from src.rag.document_source import SourceDocument, SourceFile, list_files, read_documents
+from src.rag.index_manifest import IndexManifest, ManifestEntry
+from src.rag.vector_index import SUPPORTED_DTYPES, VectorIndex, replace_directory
 
 # Configure once at program start
 logging.basicConfig(
@@ -15,47 +23,149 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Chunks embedded per call while documents stream in, enough batches to keep every embedding worker busy
+EMBED_CHUNK_COUNT = rag.EMBEDDINGS_BATCH_SIZE * rag.EMBEDDINGS_MAX_WORKERS
+
 
-def main(docs_path: str) -> None:
+def main(docs_path: str, full_rebuild: bool = False, dtype: str = "float32") -> None:
 
     repo_path = find_git_root(docs_path)
     if repo_path is None:
         raise ValueError(f"Could not find git repo at {docs_path}")
 
     logger.info(f"Loading documents from {docs_path} in repo {repo_path}")
-    markdown_documents = get_documents(repo_path, docs_path)
+    files = get_document_files(repo_path, docs_path)
 
-    # Convert documents to format expected by FAISS
-    texts: List[str] = []
-    metadatas: List[Dict] = []
-
-    logger.info(f"Processing {len(markdown_documents)} documents...")
-    for k in markdown_documents:
-        logger.info(f"Processing {k}")
-        texts.append(markdown_documents[k])
-        metadatas.append({"file_name": k})
-
-    logger.info("Generating embeddings and storing in FAISS...")
     st = time.monotonic()
 
-    # Create new FAISS instance with documents
-    vectorstore = FAISS.from_texts(texts=texts, embedding=rag.embeddings, metadatas=metadatas)
+    manifest = None if full_rebuild else load_manifest(dtype)
+    index = None
+    if manifest is not None:
+        try:
+            index = VectorIndex.load(rag.VECTORDB_DATA_PATH)
+        except Exception as e:
+            logger.warning(f"Could not load existing vector index, rebuilding it: {e}")
+    if index is None:
+        # nothing to reuse, every document is embedded again
+        manifest = IndexManifest(embeddings_model=rag.EMBEDDINGS_MODEL, dtype=dtype)
 
-    # delete old vectorstore
-    if os.path.exists(rag.VECTORDB_DATA_PATH):
-        # delete dir
-        logger.info(f"Deleting old vectorstore at {rag.VECTORDB_DATA_PATH}")
-        shutil.rmtree(rag.VECTORDB_DATA_PATH)
-
-    # Save to disk
-    os.makedirs(rag.VECTORDB_DATA_PATH, exist_ok=True)
-    vectorstore.save_local(rag.VECTORDB_DATA_PATH)
+    update_index(index, manifest, repo_path, files, dtype)
 
     et = time.monotonic()
+    logger.info(f"Embedding stats: {rag.get_embeddings_client().stats.as_dict()}")
+    logger.info(f"Embedding cache stats: {rag.get_embeddings().cache.stats()}")
     logger.info(f"Done. Took {et - st:.2f} seconds")
     return None
 
 
+def load_manifest(dtype: str) -> IndexManifest | None:
+    """The manifest of the existing index, None when the index must be rebuilt.
+
+    Vectors of another embedding model cannot be mixed with new ones, and vectors stored with another dtype
+    would be kept as they are, so an index built with either is rebuilt even when no document changed.
+    """
+    manifest = IndexManifest.load(rag.VECTORDB_DATA_PATH)
+    if manifest is None:
+        return None
+    if (manifest.embeddings_model, manifest.dtype) != (rag.EMBEDDINGS_MODEL, dtype):
+        logger.info(
+            f"Vector index was built with {manifest.embeddings_model} as {manifest.dtype}, "
+            f"rebuilding it with {rag.EMBEDDINGS_MODEL} as {dtype}"
+        )
+        return None
+    return manifest
+
+
+def update_index(
+    index: VectorIndex | None,
+    manifest: IndexManifest,
+    repo_path: str,
+    files: Sequence[SourceFile],
+    dtype: str,
+) -> None:
+    """Re-embed only the documents that were added or modified since the index was built.
+
+    The blob SHAs of the files are their change keys, only the changed files are read from the repository.
+    """
+    diff = manifest.diff({f.path: f.blob_sha for f in files})
+    logger.info(
+        f"Index update: {len(diff.added)} added, {len(diff.modified)} modified, "
+        f"{len(diff.removed)} removed, {len(diff.unchanged)} unchanged"
+    )
+    if index is not None and not diff.has_changes():
+        logger.info("Vector index is up to date")
+        return
+
+    stale_ids = set(manifest.stale_ids(diff))
+    for k in diff.removed:
+        del manifest.entries[k]
+
+    changed = set(diff.added + diff.modified)
+    documents = read_documents(repo_path, [f for f in files if f.path in changed])
+    texts, metadatas, ids, vectors = embed_documents(documents, manifest)
+
+    if index is not None:
+        logger.info(f"Reusing {len(index) - len(stale_ids)} vectors, dropping {len(stale_ids)} stale vectors")
+        kept_ids, kept_texts, kept_metadatas, kept_vectors = index.export(exclude_ids=stale_ids)
+        ids = kept_ids + ids
+        texts = kept_texts + texts
+        metadatas = kept_metadatas + metadatas
+        if len(vectors) == 0:
+            vectors = vectors.reshape(0, kept_vectors.shape[1])
+        vectors = np.concatenate([kept_vectors, vectors])
+        index.close()
+
+    # Write the new index next to the old one and swap it in once it is complete
+    tmp_path = rag.VECTORDB_DATA_PATH + ".tmp"
+    VectorIndex.write(tmp_path, ids, texts, metadatas, vectors, dtype=dtype)
+    manifest.save(tmp_path)
+    replace_directory(tmp_path, rag.VECTORDB_DATA_PATH)
+    logger.info(f"Saved {len(ids)} vectors to {rag.VECTORDB_DATA_PATH}")
+
+
+def chunk_documents(documents: Iterable[SourceDocument], manifest: IndexManifest) -> Iterator[Chunk]:
+    """Split documents into chunks one document at a time and record their ids in the manifest."""
+    for document in documents:
+        chunks = chunk_markdown(document.path, document.content)
+        logger.info(f"Processing {document.path} ({len(chunks)} chunks)")
+        manifest.entries[document.path] = ManifestEntry(
+            content_hash=document.blob_sha, ids=[chunk.id for chunk in chunks]
+        )
+        yield from chunks
+
+
+def embed_documents(
+    documents: Iterable[SourceDocument], manifest: IndexManifest, batch_size: int = EMBED_CHUNK_COUNT
+) -> Tuple[List[str], List[Dict], List[str], np.ndarray]:
+    """Chunk and embed documents as they are read, `batch_size` chunks at a time.
+
+    The content of a document is released once it is chunked, and the embeddings of a batch once they are
+    packed as float32. What is kept is what goes into the index: the chunk texts, metadata, ids and vectors.
+    """
+    embeddings = rag.get_embeddings()
+    texts: List[str] = []
+    metadatas: List[Dict] = []
+    ids: List[str] = []
+    vectors: List[np.ndarray] = []
+    embedded = 0
+
+    def embed_pending() -> None:
+        nonlocal embedded
+        logger.info(f"Generating embeddings for {len(texts) - embedded} chunks...")
+        vectors.append(np.asarray(embeddings.embed_documents(texts[embedded:]), dtype=np.float32))
+        embedded = len(texts)
+
+    for chunk in chunk_documents(documents, manifest):
+        texts.append(chunk.content)
+        metadatas.append(chunk.metadata())
+        ids.append(chunk.id)
+        if len(texts) - embedded >= batch_size:
+            embed_pending()
+    if len(texts) > embedded:
+        embed_pending()
+    return texts, metadatas, ids, np.concatenate(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+
+
 def find_git_root(directory):
     while True:
         if os.path.exists(os.path.join(directory, ".git")):
@@ -66,28 +176,38 @@ def find_git_root(directory):
         directory = parent
 
 
-def get_documents(repo_path: str, docs_path: str) -> rag.Documents:
+def get_document_files(repo_path: str, docs_path: str) -> List[SourceFile]:
+    """Markdown files tracked under `docs_path`, ignored and untracked files are left out."""
     if not os.path.isdir(repo_path):
         raise ValueError(f"Path {repo_path} does not exist")
-    if not os.path.isdir(os.path.join(repo_path, ".git")):
+    # .git is a file in worktrees
+    if not os.path.exists(os.path.join(repo_path, ".git")):
         raise ValueError(f"Path {repo_path} is not a git repository")
     working_path = os.path.join(repo_path, docs_path)
     if not os.path.isdir(working_path):
         raise ValueError(
             f"Path {working_path} does not contain docusaurus docs, make sure the folder points to the root of the plugin-tools repository."
         )
-    documents = rag.Documents()
-    for root, _, files in os.walk(working_path):
-        for file in files:
-            if not file.endswith(".md"):
-                continue
-            fn = os.path.join(root, file)
-            relative_file_name = os.path.relpath(fn, repo_path)
-            with open(fn, "r") as f:
-                documents[relative_file_name] = f.read()
-    return documents
+    return list_files(repo_path, os.path.relpath(working_path, repo_path))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate embeddings for the documentation")
+    parser.add_argument("docs_path", help="Path to the documentation inside a git repository")
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Re-embed every document instead of only the ones that changed since the last run",
+    )
+    parser.add_argument(
+        "--dtype",
+        choices=SUPPORTED_DTYPES,
+        default="float32",
+        help="Precision of the stored vectors. float16 halves the size of the index",
+    )
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
-    docs_folder = sys.argv[1]
-    main(docs_folder)
+    args = parse_args()
+    main(args.docs_path, full_rebuild=args.full, dtype=args.dtype)
@@ -0,0 +1,115 @@
+"""
+Per-file change tracking for the embeddings index.
+
+The manifest is stored next to the vector index and records, for every indexed
+file, a hash of its content (its git blob SHA) and the ids of the vectors generated from it. It is
+used to re-embed only the files that changed since the index was last built. It also records the
+embedding model and the dtype of the stored vectors, the index is rebuilt when either changes.
+"""
+import hashlib
+import json
+import os
+from dataclasses import dataclass, field
+from typing import Dict, List, Mapping
+
+MANIFEST_FILE_NAME = "manifest.json"
+# Bump when the way documents are turned into vectors changes, so that old
+# indexes are rebuilt from scratch instead of being mixed with new vectors.
+MANIFEST_VERSION = 2
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class ManifestEntry:
+    content_hash: str
+    ids: List[str]
+
+
+@dataclass
+class ManifestDiff:
+    added: List[str] = field(default_factory=list)
+    modified: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+    unchanged: List[str] = field(default_factory=list)
+
+    def has_changes(self) -> bool:
+        return bool(self.added or self.modified or self.removed)
+
+
+class IndexManifest:
+    def __init__(
+        self,
+        entries: Dict[str, ManifestEntry] | None = None,
+        embeddings_model: str | None = None,
+        dtype: str | None = None,
+    ) -> None:
+        self.entries: Dict[str, ManifestEntry] = entries if entries is not None else {}
+        # None in manifests written before they were recorded
+        self.embeddings_model = embeddings_model
+        self.dtype = dtype
+
+    @classmethod
+    def load(cls, index_path: str) -> "IndexManifest | None":
+        """Load the manifest stored in `index_path`.
+
+        Returns:
+            The manifest, or None if there is no manifest or it was written by an
+            incompatible version, in which case the index must be fully rebuilt.
+        """
+        manifest_path = os.path.join(index_path, MANIFEST_FILE_NAME)
+        if not os.path.exists(manifest_path):
+            return None
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != MANIFEST_VERSION:
+            return None
+        entries = {
+            file_name: ManifestEntry(content_hash=entry["content_hash"], ids=list(entry["ids"]))
+            for file_name, entry in data["files"].items()
+        }
+        return cls(entries, embeddings_model=data.get("embeddings_model"), dtype=data.get("dtype"))
+
+    def save(self, index_path: str) -> None:
+        os.makedirs(index_path, exist_ok=True)
+        data = {
+            "version": MANIFEST_VERSION,
+            "embeddings_model": self.embeddings_model,
+            "dtype": self.dtype,
+            "files": {
+                file_name: {"content_hash": entry.content_hash, "ids": entry.ids}
+                for file_name, entry in sorted(self.entries.items())
+            },
+        }
+        manifest_path = os.path.join(index_path, MANIFEST_FILE_NAME)
+        tmp_path = manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=1)
+        os.replace(tmp_path, manifest_path)
+
+    def diff(self, hashes: Mapping[str, str]) -> ManifestDiff:
+        """Compare the manifest against the current content hash of every file.
+
+        Args:
+            hashes: Mapping of file name to the hash of its current content.
+        """
+        result = ManifestDiff()
+        for file_name, file_hash in hashes.items():
+            entry = self.entries.get(file_name)
+            if entry is None:
+                result.added.append(file_name)
+            elif entry.content_hash != file_hash:
+                result.modified.append(file_name)
+            else:
+                result.unchanged.append(file_name)
+        result.removed = [file_name for file_name in self.entries if file_name not in hashes]
+        return result
+
+    def stale_ids(self, diff: ManifestDiff) -> List[str]:
+        """Ids of the vectors that belong to modified or removed files."""
+        ids: List[str] = []
+        for file_name in diff.modified + diff.removed:
+            ids.extend(self.entries[file_name].ids)
+        return ids
@@ -1,31 +1,139 @@
+"""
+Shared access to the embeddings client and the documentation vector store.
+
+Nothing is configured or loaded at import time: the embeddings client is built
+on first use and the vector store is loaded on the first query, then cached for
+the rest of the process.
+"""
+import logging
 import os
-from typing import Iterator, OrderedDict
-import google.generativeai as genai
-from langchain_community.vectorstores import FAISS
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
+import threading
+import time
+from typing import TYPE_CHECKING, Iterator, OrderedDict
 
-# You'll need to set your Google API key
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-if not GEMINI_API_KEY:
-    raise ValueError("Please set the GEMINI_API_KEY environment variable")
+if TYPE_CHECKING:
+    from src.rag.embedding_cache import CachedEmbeddings
+    from src.rag.embedding_pipeline import BatchEmbeddings
+    from src.rag.vector_index import VectorIndex
 
-genai.configure(api_key=GEMINI_API_KEY)
+logger = logging.getLogger(__name__)
 
 DEFAULT_PLUGIN_TOOLS_REPO_PATH = os.path.join("..", "plugin-tools")
-VECTORDB_DATA_PATH = os.path.join(".data", "faiss")
-
-# Initialize Google embeddings
-embeddings = GoogleGenerativeAIEmbeddings(
-    model="models/embedding-001",
-    google_api_key=GEMINI_API_KEY,
-)
-
-VECTORDB_DATA_PATH_PKL = os.path.join(VECTORDB_DATA_PATH, "index.pkl")
-# Create FAISS instance if it exists, otherwise None
-try:
-    vectordb = FAISS.load_local(VECTORDB_DATA_PATH, embeddings, allow_dangerous_deserialization=True)
-except:
-    vectordb = None
+VECTORDB_DATA_PATH = os.path.join(".data", "index")
+
+EMBEDDINGS_MODEL = "models/embedding-001"
+EMBEDDINGS_BATCH_SIZE = int(os.getenv("LAPO_EMBEDDINGS_BATCH_SIZE", "100"))
+EMBEDDINGS_MAX_WORKERS = int(os.getenv("LAPO_EMBEDDINGS_MAX_WORKERS", "4"))
+EMBEDDINGS_REQUESTS_PER_MINUTE = float(os.getenv("LAPO_EMBEDDINGS_REQUESTS_PER_MINUTE", "1500"))
+EMBEDDINGS_CACHE_PATH = os.getenv("LAPO_EMBEDDINGS_CACHE_PATH", os.path.join(".data", "embeddings_cache.sqlite"))
+EMBEDDINGS_CACHE_MAX_ENTRIES = int(os.getenv("LAPO_EMBEDDINGS_CACHE_MAX_ENTRIES", "200000"))
+
+
+def _optional_float_env(name: str, default: str = "") -> float | None:
+    value = os.getenv(name, default)
+    return float(value) if value else None
+
+
+RETRIEVAL_K = int(os.getenv("LAPO_RETRIEVAL_K", "5"))
+# Squared L2 distance, from 0 to 4 for unit vectors. Empty means no cutoff.
+RETRIEVAL_MAX_DISTANCE = _optional_float_env("LAPO_RETRIEVAL_MAX_DISTANCE")
+# Empty disables the MMR re-ranking
+RETRIEVAL_MMR_LAMBDA = _optional_float_env("LAPO_RETRIEVAL_MMR_LAMBDA", "0.7")
+RETRIEVAL_FETCH_K = int(os.getenv("LAPO_RETRIEVAL_FETCH_K", "20"))
+RETRIEVAL_MAX_CHUNKS_PER_FILE = int(os.getenv("LAPO_RETRIEVAL_MAX_CHUNKS_PER_FILE", "3"))
+
+_lock = threading.RLock()
+_embeddings_client: "BatchEmbeddings | None" = None
+_embeddings: "CachedEmbeddings | None" = None
+_vectordb: "VectorIndex | None" = None
+_vectordb_loaded = False
+_vectordb_load_seconds: float | None = None
+
+
+def get_embeddings_client() -> "BatchEmbeddings":
+    """The batched Gemini embeddings client, without the cache in front of it.
+
+    Raises:
+        ValueError: If the GEMINI_API_KEY environment variable is not set.
+    """
+    global _embeddings_client
+    with _lock:
+        if _embeddings_client is None:
+            # You'll need to set your Google API key
+            gemini_api_key = os.getenv("GEMINI_API_KEY")
+            if not gemini_api_key:
+                raise ValueError("Please set the GEMINI_API_KEY environment variable")
+
+            import google.generativeai as genai
+            from langchain_google_genai import GoogleGenerativeAIEmbeddings
+            from src.rag.embedding_pipeline import BatchEmbeddings
+
+            genai.configure(api_key=gemini_api_key)
+            _embeddings_client = BatchEmbeddings(
+                GoogleGenerativeAIEmbeddings(model=EMBEDDINGS_MODEL, google_api_key=gemini_api_key),
+                batch_size=EMBEDDINGS_BATCH_SIZE,
+                max_workers=EMBEDDINGS_MAX_WORKERS,
+                requests_per_minute=EMBEDDINGS_REQUESTS_PER_MINUTE,
+            )
+        return _embeddings_client
+
+
+def get_embeddings() -> "CachedEmbeddings":
+    """The embeddings used to build and query the vector store.
+
+    Every embedding goes through the on-disk cache before reaching the Gemini API.
+    """
+    global _embeddings
+    with _lock:
+        if _embeddings is None:
+            from src.rag.embedding_cache import CachedEmbeddings, EmbeddingCache
+
+            _embeddings = CachedEmbeddings(
+                get_embeddings_client(), EmbeddingCache(EMBEDDINGS_CACHE_PATH, EMBEDDINGS_CACHE_MAX_ENTRIES)
+            )
+        return _embeddings
+
+
+def get_vectordb() -> "VectorIndex | None":
+    """Open the memory-mapped vector index on first use.
+
+    Returns:
+        The vector store, or None if it has not been generated yet.
+    """
+    global _vectordb, _vectordb_loaded, _vectordb_load_seconds
+    with _lock:
+        if not _vectordb_loaded:
+            from src.rag.vector_index import VectorIndex
+
+            st = time.monotonic()
+            try:
+                _vectordb = VectorIndex.load(VECTORDB_DATA_PATH)
+            except (FileNotFoundError, ValueError) as e:
+                logger.warning(f"Could not load vector index from {VECTORDB_DATA_PATH}: {e}")
+                _vectordb = None
+            _vectordb_load_seconds = time.monotonic() - st
+            _vectordb_loaded = True
+            logger.info(f"Loaded vector index in {_vectordb_load_seconds:.3f} seconds")
+        return _vectordb
+
+
+def load_stats() -> dict:
+    return {
+        "vectordb_loaded": _vectordb_loaded,
+        "vectordb_available": _vectordb is not None,
+        "vectordb_load_seconds": _vectordb_load_seconds,
+    }
+
+
+def embedding_stats() -> dict:
+    """Embedding calls made by this process so far, without creating the client."""
+    with _lock:
+        stats = _embeddings_client.stats.as_dict() if _embeddings_client is not None else {}
+        if _embeddings is not None:
+            cache_stats = _embeddings.cache.stats()
+            stats["cache_hits"] = cache_stats["hits"]
+            stats["cache_misses"] = cache_stats["misses"]
+        return stats
 
 
 class Documents:
@@ -0,0 +1,50 @@
+"""
+Maximal marginal relevance (MMR) re-ranking of retrieved chunks.
+
+MMR picks results one at a time, trading similarity to the query against
+similarity to the results already picked, so that near-duplicate chunks (e.g.
+the same paragraph in two versions of a page) do not crowd out the others. It
+only needs the vectors already stored in the index, no extra embedding call.
+"""
+from typing import List
+
+import numpy as np
+
+DEFAULT_LAMBDA = 0.5
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+
+def mmr(query: np.ndarray, candidates: np.ndarray, k: int, lambda_mult: float = DEFAULT_LAMBDA) -> List[int]:
+    """Select `k` candidates by maximal marginal relevance.
+
+    Args:
+        query: The query vector, shape (dim,).
+        candidates: The candidate vectors, shape (n, dim).
+        k: Number of candidates to select.
+        lambda_mult: 1 ranks purely by relevance, 0 purely by diversity.
+
+    Returns:
+        The indices of the selected candidates, in selection order.
+    """
+    candidates = np.asarray(candidates, dtype=np.float32)
+    k = min(k, len(candidates))
+    if k <= 0:
+        return []
+    candidates = _normalize(candidates)
+    relevance = candidates @ _normalize(np.asarray(query, dtype=np.float32))
+    similarity = candidates @ candidates.T
+
+    selected = [int(np.argmax(relevance))]
+    # highest similarity of every candidate to the already selected ones
+    redundancy = similarity[selected[0]].copy()
+    while len(selected) < k:
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[selected] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        redundancy = np.maximum(redundancy, similarity[best])
+    return selected
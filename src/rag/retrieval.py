@@ -0,0 +1,138 @@
+"""
+Batched retrieval of documentation chunks for a set of queries.
+
+All queries are embedded in one batched request and searched with a single
+matrix search over the vector index, instead of one embedding round trip and
+one search per query. Hits can be cut off by distance, re-ranked with maximal
+marginal relevance and de-duplicated across queries.
+"""
+import asyncio
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from src.rag.rerank import mmr
+from src.rag.vector_index import IndexedChunk, VectorIndex
+
+DEFAULT_K = 5
+# Number of nearest rows MMR chooses the k results from
+DEFAULT_FETCH_K = 20
+
+
+@dataclass(frozen=True)
+class RetrievalHit:
+    chunk: IndexedChunk
+    distance: float
+
+
+def embed_queries(embeddings, texts: Sequence[str]) -> np.ndarray:
+    """Embed search queries, in a single batch when the embeddings support it."""
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+    embed_many = getattr(embeddings, "embed_queries", None)
+    if embed_many is not None:
+        vectors = embed_many(list(texts))
+    else:
+        vectors = [embeddings.embed_query(text) for text in texts]
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def search(
+    index: VectorIndex,
+    embeddings,
+    queries: Sequence[Tuple[str, str]],
+    k: int = DEFAULT_K,
+    max_distance: Optional[float] = None,
+    mmr_lambda: Optional[float] = None,
+    fetch_k: int = DEFAULT_FETCH_K,
+) -> Dict[str, List[RetrievalHit]]:
+    """Find the chunks closest to every query.
+
+    Args:
+        index: The vector index to search.
+        embeddings: Embeddings used to embed the queries.
+        queries: (key, text) pairs, e.g. a source file path and its diff.
+        k: Maximum number of chunks per query.
+        max_distance: Drop hits further than this from their query.
+        mmr_lambda: Re-rank the `fetch_k` nearest rows with maximal marginal
+            relevance (see `rerank.mmr`) instead of keeping the `k` nearest.
+        fetch_k: Number of candidates for the MMR re-ranking.
+
+    Returns:
+        A dictionary from query key to its hits, sorted by increasing distance,
+        or in MMR selection order when re-ranking. Queries without any hit are left out.
+    """
+    if not queries:
+        return {}
+    vectors = embed_queries(embeddings, [text for _, text in queries])
+    rows, distances = index.search_rows(vectors, max(k, fetch_k) if mmr_lambda is not None else k)
+
+    selected: List[List[Tuple[int, float]]] = []
+    for vector, query_rows, query_distances in zip(vectors, rows, distances):
+        candidates = [
+            (int(row), float(distance))
+            for row, distance in zip(query_rows, query_distances)
+            if max_distance is None or distance <= max_distance
+        ]
+        if mmr_lambda is not None and len(candidates) > k:
+            candidate_vectors = index.vectors[[row for row, _ in candidates]]
+            candidates = [candidates[i] for i in mmr(vector, candidate_vectors, k, mmr_lambda)]
+        selected.append(candidates[:k])
+
+    chunks = {chunk.row: chunk for chunk in index.get_rows(sorted({row for hits in selected for row, _ in hits}))}
+    results: Dict[str, List[RetrievalHit]] = {}
+    for (key, _), hits in zip(queries, selected):
+        if hits:
+            results[key] = [RetrievalHit(chunk=chunks[row], distance=distance) for row, distance in hits]
+    return results
+
+
+async def search_async(
+    index: VectorIndex,
+    embeddings,
+    queries: Sequence[Tuple[str, str]],
+    k: int = DEFAULT_K,
+    max_distance: Optional[float] = None,
+    mmr_lambda: Optional[float] = None,
+    fetch_k: int = DEFAULT_FETCH_K,
+) -> Dict[str, List[RetrievalHit]]:
+    """Like `search`, but runs the blocking embedding call and search in a worker thread."""
+    return await asyncio.to_thread(search, index, embeddings, queries, k, max_distance, mmr_lambda, fetch_k)
+
+
+def deduplicate(
+    results: Dict[str, List[RetrievalHit]], max_chunks_per_file: Optional[int] = None
+) -> Dict[str, List[RetrievalHit]]:
+    """Keep every chunk only once across queries.
+
+    A chunk returned for several queries is kept under the query it is closest to.
+    With `max_chunks_per_file`, at most that many chunks of the same documentation
+    file are kept overall, the closest ones first.
+
+    Returns:
+        The results in the same shape, without the queries left with no hit.
+    """
+    # chunk id -> (query key, hit) of its closest query
+    best: Dict[str, Tuple[str, RetrievalHit]] = {}
+    for key, hits in results.items():
+        for hit in hits:
+            if hit.chunk.id not in best or hit.distance < best[hit.chunk.id][1].distance:
+                best[hit.chunk.id] = (key, hit)
+
+    kept = set(best)
+    if max_chunks_per_file is not None:
+        per_file: Dict[str, int] = {}
+        kept = set()
+        for chunk_id, (_, hit) in sorted(best.items(), key=lambda item: item[1][1].distance):
+            file_name = hit.chunk.metadata.get("file_name", chunk_id)
+            if per_file.get(file_name, 0) < max_chunks_per_file:
+                per_file[file_name] = per_file.get(file_name, 0) + 1
+                kept.add(chunk_id)
+
+    deduplicated: Dict[str, List[RetrievalHit]] = {}
+    for key, hits in results.items():
+        unique = [hit for hit in hits if hit.chunk.id in kept and best[hit.chunk.id][0] == key]
+        if unique:
+            deduplicated[key] = unique
+    return deduplicated
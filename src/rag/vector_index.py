@@ -0,0 +1,257 @@
+"""
+Memory-mapped vector index for the documentation chunks.
+
+An index is a directory with:
+
+- `vectors.bin`: the raw row-major vectors (float32 or float16), memory-mapped
+  read-only so that opening is near-instant and several processes share the pages.
+- `norms.bin`: the squared L2 norm of every vector (float32), used for search.
+- `metadata.sqlite`: the id, content and metadata of every row, plus index info.
+
+Indexes are immutable once written: updates write a new directory and swap it
+in place, so no pickled data is ever loaded.
+"""
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from src.rag.index_manifest import MANIFEST_FILE_NAME
+
+INDEX_FORMAT_VERSION = 1
+VECTORS_FILE_NAME = "vectors.bin"
+NORMS_FILE_NAME = "norms.bin"
+METADATA_FILE_NAME = "metadata.sqlite"
+SUPPORTED_DTYPES = ("float32", "float16")
+
+# Number of index rows scored at once, bounds the memory used by a search
+_SEARCH_BLOCK_ROWS = 65536
+
+
+@dataclass(frozen=True)
+class IndexedChunk:
+    """A row of the index. Mirrors the `page_content`/`metadata` of langchain documents."""
+
+    row: int
+    id: str
+    page_content: str
+    metadata: Dict[str, Any]
+
+
+class VectorIndex:
+    def __init__(self, path: str, vectors: np.ndarray, norms: np.ndarray, conn: sqlite3.Connection) -> None:
+        self.path = path
+        self.vectors = vectors
+        self.norms = norms
+        self._conn = conn
+        self._fingerprint: Optional[str] = None
+
+    @classmethod
+    def load(cls, path: str) -> "VectorIndex":
+        """Open an index directory.
+
+        Raises:
+            FileNotFoundError: If there is no index at `path`.
+            ValueError: If the index was written by an incompatible version.
+        """
+        metadata_path = os.path.join(path, METADATA_FILE_NAME)
+        if not os.path.exists(metadata_path):
+            raise FileNotFoundError(f"No vector index found at {path}")
+        conn = sqlite3.connect(f"file:{os.path.abspath(metadata_path)}?mode=ro", uri=True, check_same_thread=False)
+        info = dict(conn.execute("SELECT key, value FROM info").fetchall())
+        if int(info.get("format_version", 0)) != INDEX_FORMAT_VERSION:
+            conn.close()
+            raise ValueError(f"Unsupported vector index format at {path}")
+
+        count, dim, dtype = int(info["count"]), int(info["dim"]), info["dtype"]
+        if count == 0:
+            vectors = np.zeros((0, dim), dtype=dtype)
+            norms = np.zeros(0, dtype=np.float32)
+        else:
+            vectors = np.memmap(os.path.join(path, VECTORS_FILE_NAME), dtype=dtype, mode="r", shape=(count, dim))
+            norms = np.memmap(os.path.join(path, NORMS_FILE_NAME), dtype=np.float32, mode="r", shape=(count,))
+        return cls(path, vectors, norms, conn)
+
+    @staticmethod
+    def write(
+        path: str,
+        ids: Sequence[str],
+        contents: Sequence[str],
+        metadatas: Sequence[Dict[str, Any]],
+        vectors: np.ndarray,
+        dtype: str = "float32",
+    ) -> None:
+        """Write a new index directory at `path`, replacing anything already there."""
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"Unsupported dtype {dtype}, expected one of {SUPPORTED_DTYPES}")
+        if not (len(ids) == len(contents) == len(metadatas) == len(vectors)):
+            raise ValueError("ids, contents, metadatas and vectors must have the same length")
+        if len(set(ids)) != len(ids):
+            raise ValueError("ids must be unique")
+
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.makedirs(path)
+
+        vectors = np.ascontiguousarray(vectors, dtype=dtype) if len(ids) else np.zeros((0, 0), dtype=dtype)
+        vectors.tofile(os.path.join(path, VECTORS_FILE_NAME))
+        stored = vectors.astype(np.float32)
+        np.einsum("ij,ij->i", stored, stored).astype(np.float32).tofile(os.path.join(path, NORMS_FILE_NAME))
+
+        conn = sqlite3.connect(os.path.join(path, METADATA_FILE_NAME))
+        try:
+            conn.execute("CREATE TABLE info (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            conn.execute(
+                "CREATE TABLE chunks (row INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE, "
+                "file_name TEXT, content TEXT NOT NULL, metadata TEXT NOT NULL)"
+            )
+            conn.executemany(
+                "INSERT INTO info VALUES (?, ?)",
+                [
+                    ("format_version", str(INDEX_FORMAT_VERSION)),
+                    ("count", str(len(ids))),
+                    ("dim", str(vectors.shape[1])),
+                    ("dtype", dtype),
+                ],
+            )
+            conn.executemany(
+                "INSERT INTO chunks VALUES (?, ?, ?, ?, ?)",
+                (
+                    (row, chunk_id, metadata.get("file_name"), content, json.dumps(metadata))
+                    for row, (chunk_id, content, metadata) in enumerate(zip(ids, contents, metadatas))
+                ),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def __len__(self) -> int:
+        return self.vectors.shape[0]
+
+    @property
+    def dim(self) -> int:
+        return self.vectors.shape[1]
+
+    def fingerprint(self) -> str:
+        """A hash that changes whenever the indexed content changes.
+
+        Built from the index info and the manifest (the content hash and vector ids of every
+        indexed file) when there is one, else from the size and modification time of the files.
+        """
+        if self._fingerprint is None:
+            digest = hashlib.sha256()
+            digest.update(json.dumps(sorted(self._conn.execute("SELECT key, value FROM info").fetchall())).encode())
+            manifest_path = os.path.join(self.path, MANIFEST_FILE_NAME)
+            if os.path.exists(manifest_path):
+                with open(manifest_path, "rb") as f:
+                    digest.update(f.read())
+            else:
+                for name in (VECTORS_FILE_NAME, METADATA_FILE_NAME):
+                    stat = os.stat(os.path.join(self.path, name))
+                    digest.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+            self._fingerprint = digest.hexdigest()
+        return self._fingerprint
+
+    def ids(self) -> List[str]:
+        return [row[0] for row in self._conn.execute("SELECT id FROM chunks ORDER BY row")]
+
+    def get_rows(self, rows: Iterable[int]) -> List[IndexedChunk]:
+        rows = [int(row) for row in rows]
+        if not rows:
+            return []
+        placeholders = ",".join("?" * len(rows))
+        by_row = {
+            row: IndexedChunk(row=row, id=chunk_id, page_content=content, metadata=json.loads(metadata))
+            for row, chunk_id, content, metadata in self._conn.execute(
+                f"SELECT row, id, content, metadata FROM chunks WHERE row IN ({placeholders})", rows
+            )
+        }
+        return [by_row[row] for row in rows]
+
+    def export(
+        self, exclude_ids: Optional[Set[str]] = None
+    ) -> Tuple[List[str], List[str], List[Dict[str, Any]], np.ndarray]:
+        """All rows except `exclude_ids`, in the format accepted by `write`."""
+        exclude_ids = exclude_ids or set()
+        ids: List[str] = []
+        contents: List[str] = []
+        metadatas: List[Dict[str, Any]] = []
+        rows: List[int] = []
+        for row, chunk_id, content, metadata in self._conn.execute(
+            "SELECT row, id, content, metadata FROM chunks ORDER BY row"
+        ):
+            if chunk_id in exclude_ids:
+                continue
+            rows.append(row)
+            ids.append(chunk_id)
+            contents.append(content)
+            metadatas.append(json.loads(metadata))
+        return ids, contents, metadatas, np.asarray(self.vectors[rows], dtype=np.float32)
+
+    def search(self, queries: np.ndarray, k: int) -> List[List[Tuple[IndexedChunk, float]]]:
+        """Find the `k` nearest rows of every query vector.
+
+        Args:
+            queries: A (n_queries, dim) array.
+            k: Number of results per query.
+
+        Returns:
+            For every query, a list of (chunk, distance) pairs sorted by increasing
+            squared L2 distance.
+        """
+        rows, distances = self.search_rows(queries, k)
+        chunks = {chunk.row: chunk for chunk in self.get_rows(sorted(set(rows.ravel().tolist())))}
+        return [
+            [(chunks[int(row)], float(distance)) for row, distance in zip(query_rows, query_distances)]
+            for query_rows, query_distances in zip(rows, distances)
+        ]
+
+    def search_rows(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Like `search`, but returns (rows, distances) arrays of shape (n_queries, k')."""
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        n = len(self)
+        k = min(k, n)
+        if k <= 0:
+            empty = np.zeros((queries.shape[0], 0))
+            return empty.astype(np.int64), empty.astype(np.float32)
+
+        query_norms = np.einsum("ij,ij->i", queries, queries)
+        best_rows = np.zeros((queries.shape[0], 0), dtype=np.int64)
+        best_distances = np.zeros((queries.shape[0], 0), dtype=np.float32)
+        for start in range(0, n, _SEARCH_BLOCK_ROWS):
+            block = np.asarray(self.vectors[start : start + _SEARCH_BLOCK_ROWS], dtype=np.float32)
+            distances = query_norms[:, None] + self.norms[None, start : start + len(block)] - 2.0 * queries @ block.T
+            distances = np.maximum(distances, 0.0)
+            rows = np.broadcast_to(np.arange(start, start + len(block)), distances.shape)
+            best_rows = np.concatenate([best_rows, rows], axis=1)
+            best_distances = np.concatenate([best_distances, distances], axis=1)
+            if best_rows.shape[1] > k:
+                top = np.argpartition(best_distances, k - 1, axis=1)[:, :k]
+                best_rows = np.take_along_axis(best_rows, top, axis=1)
+                best_distances = np.take_along_axis(best_distances, top, axis=1)
+
+        order = np.argsort(best_distances, axis=1, kind="stable")
+        return np.take_along_axis(best_rows, order, axis=1), np.take_along_axis(best_distances, order, axis=1)
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def replace_directory(source: str, destination: str) -> None:
+    """Move the `source` directory to `destination`, replacing it as atomically as possible.
+
+    Processes that already memory-mapped the old files keep reading them until they reopen the index.
+    """
+    old = destination + ".old"
+    if os.path.exists(old):
+        shutil.rmtree(old)
+    if os.path.exists(destination):
+        os.rename(destination, old)
+    os.rename(source, destination)
+    if os.path.exists(old):
+        shutil.rmtree(old)
@@ -0,0 +1,126 @@
+"""
+Persistent ledger of finished lapo runs.
+
+A run is identified by everything its result depends on: the head commit of
+the source PR, the commit of the docs repo it was compared with, the
+fingerprint of the embeddings index and the models and retrieval settings.
+When a run with the same key already finished, its outcome is replayed (the
+patch and the URL of the docs PR it opened) instead of running the agents
+again, so a re-triggered run costs no LLM or embedding call and never opens a
+duplicate docs PR. Failed runs are not recorded.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+LEDGER_PATH = os.getenv("LAPO_RUN_LEDGER_PATH", os.path.join(".data", "run_ledger.sqlite"))
+# Bump when a change to the pipeline makes recorded outcomes stale
+LEDGER_VERSION = 1
+
+# outcomes of a finished run
+NO_DOCS = "no_docs"
+EMPTY_PATCH = "empty_patch"
+PR_CREATED = "pr_created"
+
+
+@dataclass(frozen=True)
+class RunKey:
+    source_pr: str
+    source_head_sha: str
+    docs_repo: str
+    docs_head_sha: str
+    index_fingerprint: str
+    config: Dict[str, Any]
+
+    def digest(self) -> str:
+        data = {"version": LEDGER_VERSION, **asdict(self)}
+        return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+
+@dataclass(frozen=True)
+class RunRecord:
+    key: str
+    source_pr: str
+    outcome: str
+    patch: Optional[str]
+    git_patch: Optional[str]
+    pr_url: Optional[str]
+    created_at: float
+
+
+class RunLedger:
+    def __init__(self, path: str = LEDGER_PATH) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS runs (
+                key TEXT PRIMARY KEY,
+                source_pr TEXT NOT NULL,
+                outcome TEXT NOT NULL,
+                patch TEXT,
+                git_patch TEXT,
+                pr_url TEXT,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    def get(self, key: RunKey) -> Optional[RunRecord]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT key, source_pr, outcome, patch, git_patch, pr_url, created_at FROM runs WHERE key = ?",
+                (key.digest(),),
+            ).fetchone()
+        return RunRecord(*row) if row else None
+
+    def record(
+        self,
+        key: RunKey,
+        outcome: str,
+        patch: Optional[str] = None,
+        git_patch: Optional[str] = None,
+        pr_url: Optional[str] = None,
+    ) -> RunRecord:
+        record = RunRecord(
+            key=key.digest(),
+            source_pr=key.source_pr,
+            outcome=outcome,
+            patch=patch,
+            git_patch=git_patch,
+            pr_url=pr_url,
+            created_at=time.time(),
+        )
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?, ?)", tuple(asdict(record).values()))
+            self._conn.commit()
+        logger.info(f"Recorded run of {key.source_pr}: {outcome}")
+        return record
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+_ledgers: Dict[str, RunLedger] = {}
+_ledgers_lock = threading.Lock()
+
+
+def get_ledger(path: str = LEDGER_PATH) -> RunLedger:
+    """The ledger at `path`, opened once per process."""
+    with _ledgers_lock:
+        if path not in _ledgers:
+            _ledgers[path] = RunLedger(path)
+        return _ledgers[path]
@@ -0,0 +1,148 @@
+"""
+Per-run cache of the documentation files served to the patch agent.
+
+Files are read once and kept in memory, bounded by their total size in bytes and
+evicted least recently used first. Besides the full content, a document can be
+served as a table of contents or as a range of lines, e.g. the section around a
+retrieval hit, so that long pages do not have to be sent to the model whole.
+"""
+import logging
+import os
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+from src.rag.chunking import HEADING_PATH_SEPARATOR, parse_headings
+from src.tools.search_replace.search_replace_apply import is_inside_repo
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+
+
+@dataclass(frozen=True)
+class TocEntry:
+    level: int
+    title: str
+    # heading path of the section, e.g. "Install > Linux"
+    path: str
+    # 1-based, inclusive, the section runs until the next heading of the same or a higher level
+    start_line: int
+    end_line: int
+
+
+@dataclass
+class Document:
+    file_path: str
+    content: str
+    mtime_ns: int
+    size: int
+    lines: List[str] = field(init=False)
+    _toc: Optional[List[TocEntry]] = field(default=None, init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        self.lines = self.content.splitlines(keepends=True)
+
+    @property
+    def total_lines(self) -> int:
+        return len(self.lines)
+
+    def table_of_contents(self) -> List[TocEntry]:
+        if self._toc is None:
+            headings = parse_headings(self.lines)
+            toc: List[TocEntry] = []
+            stack: List[Tuple[int, str]] = []
+            for position, (line_index, level, title) in enumerate(headings):
+                end = next(
+                    (other for other, other_level, _ in headings[position + 1 :] if other_level <= level),
+                    len(self.lines),
+                )
+                while stack and stack[-1][0] >= level:
+                    stack.pop()
+                stack.append((level, title))
+                toc.append(
+                    TocEntry(
+                        level=level,
+                        title=title,
+                        path=HEADING_PATH_SEPARATOR.join(t for _, t in stack),
+                        start_line=line_index + 1,
+                        end_line=end,
+                    )
+                )
+            self._toc = toc
+        return self._toc
+
+    def find_section(self, section: str) -> Optional[TocEntry]:
+        """The first section whose title or heading path matches `section`, ignoring case."""
+        wanted = section.strip().lstrip("#").strip().lower()
+        for entry in self.table_of_contents():
+            if entry.title.lower() == wanted or entry.path.lower() == wanted:
+                return entry
+        return None
+
+    def line_range(self, start_line: Optional[int] = None, end_line: Optional[int] = None) -> Tuple[int, int, str]:
+        """Lines `start_line` to `end_line` (1-based, inclusive, clamped to the document) and their content."""
+        start = max(1, start_line or 1)
+        end = min(self.total_lines, end_line or self.total_lines)
+        return start, end, "".join(self.lines[start - 1 : end])
+
+
+class DocumentStore:
+    def __init__(self, root: str, max_bytes: int = DEFAULT_MAX_BYTES) -> None:
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._documents: "OrderedDict[str, Document]" = OrderedDict()
+        self._bytes = 0
+
+    def get(self, file_path: str) -> Optional[Document]:
+        """The document at `file_path` relative to the root, or None if there is no such file.
+
+        Paths that leave the root, including through a symlink, are treated as missing.
+        """
+        key = os.path.normpath(file_path)
+        full_path = os.path.join(self.root, key)
+        outside = key.startswith("..") or os.path.isabs(key) or not is_inside_repo(self.root, key)
+        if outside or not os.path.isfile(full_path):
+            return None
+
+        mtime_ns = os.stat(full_path).st_mtime_ns
+        document = self._documents.get(key)
+        if document is not None and document.mtime_ns == mtime_ns:
+            self.hits += 1
+            self._documents.move_to_end(key)
+            return document
+
+        self.misses += 1
+        if document is not None:
+            self._remove(key)
+        # keep line endings as they are on disk, SEARCH sections must match them
+        with open(full_path, "r", encoding="utf-8", newline="") as f:
+            content = f.read()
+        document = Document(file_path=file_path, content=content, mtime_ns=mtime_ns, size=len(content.encode("utf-8")))
+        if document.size <= self.max_bytes:
+            self._documents[key] = document
+            self._bytes += document.size
+            self._evict()
+        return document
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "documents": len(self._documents),
+            "bytes": self._bytes,
+        }
+
+    def _remove(self, key: str) -> None:
+        self._bytes -= self._documents.pop(key).size
+
+    def _evict(self) -> None:
+        while self._bytes > self.max_bytes and self._documents:
+            key = next(iter(self._documents))
+            self._remove(key)
+            self.evictions += 1
+            logger.debug(f"Evicted {key} from the document store")
@@ -0,0 +1,170 @@
+"""
+Whitespace- and indentation-tolerant location of SEARCH texts in a document.
+
+Matching is tiered, every tier only runs when the previous one found nothing:
+
+1. exact: the SEARCH text occurs verbatim.
+2. whitespace: the lines match once indentation, trailing whitespace and runs
+   of blanks are normalised.
+3. fuzzy: a window of lines is similar enough to the SEARCH lines according
+   to `difflib.SequenceMatcher`.
+
+Candidate windows for the whitespace and fuzzy tiers come from an index of the
+normalised document lines, so only windows sharing at least one line with the
+SEARCH text are ever scored.
+"""
+import difflib
+import re
+from dataclasses import dataclass
+from enum import Enum
+from typing import Dict, List, Optional, Set
+
+DEFAULT_MIN_CONFIDENCE = 0.85
+WHITESPACE_CONFIDENCE = 0.95
+# Upper bound on the windows scored by the fuzzy tier
+MAX_FUZZY_CANDIDATES = 200
+
+_LEADING_WHITESPACE_RE = re.compile(r"^[ \t]*")
+
+
+class MatchTier(str, Enum):
+    EXACT = "exact"
+    WHITESPACE = "whitespace"
+    FUZZY = "fuzzy"
+
+
+@dataclass(frozen=True)
+class FuzzyMatch:
+    """A located SEARCH text. `start` and `end` are offsets in the document."""
+
+    start: int
+    end: int
+    tier: MatchTier
+    confidence: float
+    # the document indentation minus the SEARCH indentation, used to re-indent the replacement
+    indent_delta: str = ""
+    removed_indent: str = ""
+
+
+def normalize_line(line: str) -> str:
+    return " ".join(line.split())
+
+
+def strip_blank_lines(text: str) -> str:
+    """Remove the blank lines around `text`, keeping the indentation of its first line."""
+    lines = text.split("\n")
+    while lines and not lines[0].strip():
+        lines.pop(0)
+    while lines and not lines[-1].strip():
+        lines.pop()
+    return "\n".join(lines)
+
+
+def _indent(line: str) -> str:
+    return _LEADING_WHITESPACE_RE.match(line).group(0)
+
+
+def reindent(text: str, match: FuzzyMatch) -> str:
+    """Shift the indentation of a replacement the same way the document is shifted from the SEARCH text."""
+    if not match.indent_delta and not match.removed_indent:
+        return text
+    lines = []
+    for line in text.split("\n"):
+        if line.strip():
+            if match.removed_indent and line.startswith(match.removed_indent):
+                line = line[len(match.removed_indent) :]
+            line = match.indent_delta + line
+        lines.append(line)
+    return "\n".join(lines)
+
+
+class FuzzyMatcher:
+    """Locates SEARCH texts in one document. Build once per document, query per SEARCH text."""
+
+    def __init__(self, content: str, min_confidence: float = DEFAULT_MIN_CONFIDENCE) -> None:
+        self.content = content
+        self.min_confidence = min_confidence
+        self._lines = content.split("\n")
+        self._normalized = [normalize_line(line) for line in self._lines]
+        self._offsets: List[int] = []
+        offset = 0
+        for line in self._lines:
+            self._offsets.append(offset)
+            offset += len(line) + 1
+        self._index: Dict[str, List[int]] = {}
+        for i, line in enumerate(self._normalized):
+            if line:
+                self._index.setdefault(line, []).append(i)
+
+    def find(self, search: str) -> Optional[FuzzyMatch]:
+        """Locate the first match of `search`, trying the tiers in order."""
+        if not search:
+            return None
+        offset = self.content.find(search)
+        if offset >= 0:
+            return FuzzyMatch(start=offset, end=offset + len(search), tier=MatchTier.EXACT, confidence=1.0)
+
+        search_lines = strip_blank_lines(search).split("\n")
+        normalized = [normalize_line(line) for line in search_lines]
+        if not any(normalized):
+            return None
+        return self._find_whitespace(search_lines, normalized) or self._find_fuzzy(search_lines, normalized)
+
+    def _candidates(self, normalized: List[str], window: int) -> List[int]:
+        starts: Set[int] = set()
+        for i, line in enumerate(normalized):
+            for line_number in self._index.get(line, ()):
+                candidate = line_number - i
+                if 0 <= candidate and candidate + window <= len(self._lines):
+                    starts.add(candidate)
+        return sorted(starts)
+
+    def _find_whitespace(self, search_lines: List[str], normalized: List[str]) -> Optional[FuzzyMatch]:
+        # strip_blank_lines guarantees the first line is not blank
+        for candidate in self._index.get(normalized[0], ()):
+            if candidate + len(normalized) > len(self._lines):
+                continue
+            if self._normalized[candidate : candidate + len(normalized)] == normalized:
+                return self._match(candidate, search_lines, MatchTier.WHITESPACE, WHITESPACE_CONFIDENCE)
+        return None
+
+    def _find_fuzzy(self, search_lines: List[str], normalized: List[str]) -> Optional[FuzzyMatch]:
+        target = "\n".join(normalized)
+        best: Optional[FuzzyMatch] = None
+        best_score = self.min_confidence
+        # allow the model to have dropped or added a line
+        for window in sorted({len(normalized), len(normalized) - 1, len(normalized) + 1}):
+            if window <= 0:
+                continue
+            for candidate in self._candidates(normalized, window)[:MAX_FUZZY_CANDIDATES]:
+                matcher = difflib.SequenceMatcher(
+                    None, "\n".join(self._normalized[candidate : candidate + window]), target, autojunk=False
+                )
+                if matcher.real_quick_ratio() < best_score or matcher.quick_ratio() < best_score:
+                    continue
+                score = matcher.ratio()
+                if score > best_score or (best is None and score >= best_score):
+                    best_score = score
+                    best = self._match(candidate, search_lines, MatchTier.FUZZY, round(score, 3), window)
+        return best
+
+    def _match(
+        self, line_number: int, search_lines: List[str], tier: MatchTier, confidence: float, window: int | None = None
+    ) -> FuzzyMatch:
+        window = window or len(search_lines)
+        last = line_number + window - 1
+        document_indent = _indent(self._lines[line_number])
+        search_indent = _indent(next(line for line in search_lines if line.strip()))
+        indent_delta = removed_indent = ""
+        if document_indent.startswith(search_indent):
+            indent_delta = document_indent[len(search_indent) :]
+        elif search_indent.startswith(document_indent):
+            removed_indent = search_indent[len(document_indent) :]
+        return FuzzyMatch(
+            start=self._offsets[line_number],
+            end=self._offsets[last] + len(self._lines[last]),
+            tier=tier,
+            confidence=confidence,
+            indent_delta=indent_delta,
+            removed_indent=removed_indent,
+        )
@@ -1,9 +1,14 @@
-import re
 import os
-import tempfile
-import subprocess
+import logging
+from dataclasses import dataclass
 from typing import List, Tuple, Optional
 from rich import print
+from src.tools.search_replace.fuzzy_match import strip_blank_lines
+from src.tools.search_replace.search_replace_engine import MatchStatus, apply_search_replace_pairs
+from src.tools.search_replace.search_replace_parser import SearchReplacePair, format_pairs, parse_patch
+from src.tools.search_replace.unified_diff import generate_unified_diff
+
+logger = logging.getLogger(__name__)
 
 
 def split_search_replace_into_file_blocks(patch_content: str) -> List[Tuple[str, str]]:
@@ -36,47 +41,12 @@ def split_search_replace_into_file_blocks(patch_content: str) -> List[Tuple[str,
 
     Returns:
         list: A list of tuples (filename, block_content), where filename is the extracted
-            file path and block_content is the full content for that file's patch including
-            all search/replace sections for that file.
+            file path and block_content is a single fenced block with all search/replace
+            sections for that file.
     """
-    # Match any line that looks like a filepath with forward slashes
-    file_pattern = r"^(\S+/\S+)$"
-
-    # Find all filepath matches
-    filepath_matches = list(re.finditer(file_pattern, patch_content, re.MULTILINE))
-
-    if not filepath_matches:
-        return []
-
-    file_blocks = []
-    # Group blocks by filename
-    filename_to_blocks = {}
-
-    for i, match in enumerate(filepath_matches):
-        filename = match.group(1)
-        start_pos = match.start()
-
-        # Get the end position (either the start of the next filename or the end of the content)
-        if i < len(filepath_matches) - 1:
-            end_pos = filepath_matches[i + 1].start()
-        else:
-            end_pos = len(patch_content)
-
-        # Extract the block content
-        block_content = patch_content[start_pos:end_pos].strip()
-
-        # Add the block to the list for this filename
-        if filename not in filename_to_blocks:
-            filename_to_blocks[filename] = []
-
-        filename_to_blocks[filename].append(block_content)
-
-    # For each filename, combine all blocks for that file
-    for filename, blocks in filename_to_blocks.items():
-        combined_content = "\n\n".join(blocks)
-        file_blocks.append((filename, combined_content))
-
-    return file_blocks
+    return [
+        (filename, format_pairs(filename, pairs)) for filename, pairs in parse_patch(patch_content).files().items()
+    ]
 
 
 def split_block_into_search_replace_pairs(block_content: str) -> List[Tuple[str, str]]:
@@ -91,24 +61,12 @@ def split_block_into_search_replace_pairs(block_content: str) -> List[Tuple[str,
         list: A list of tuples (search_part, replace_part), where search_part is the
             text to find and replace_part is the text to replace it with.
     """
-    # First, remove the filename lines if they exist within the block content
-    # This is necessary as the block may contain multiple sections each with the filename
-    file_pattern = r"^(\S+/\S+)$"
-    block_content = re.sub(file_pattern, "", block_content, flags=re.MULTILINE)
-
-    # Find all search/replace sections directly
-    search_pattern = r"<<<<<<< SEARCH\n(.*?)\n=======\n(.*?)\n>>>>>>> REPLACE"
-    matches = re.findall(search_pattern, block_content, re.DOTALL)
-
-    pairs = []
-    for search_part, replace_part in matches:
-        # Remove markdown code block markers if present
-        search_part = re.sub(r"```\w*\n|\n```", "", search_part).strip()
-        replace_part = re.sub(r"```\w*\n|\n```", "", replace_part).strip()
+    return [_pair_texts(pair) for pair in parse_patch(block_content).pairs]
 
-        pairs.append((search_part, replace_part))
 
-    return pairs
+def _pair_texts(pair: SearchReplacePair) -> Tuple[str, str]:
+    # Only drop surrounding blank lines, the indentation of the first line is part of the match
+    return strip_blank_lines(pair.search), strip_blank_lines(pair.replace)
 
 
 def apply_search_replace_pairs_to_content(content: str, search_replace_pairs: List[Tuple[str, str]]) -> str:
@@ -118,15 +76,29 @@ def apply_search_replace_pairs_to_content(content: str, search_replace_pairs: Li
         content (str): The original file content as a string that will be modified
             by applying search/replace operations.
         search_replace_pairs (list): A list of tuples (search_part, replace_part), where
-            each tuple represents a text replacement operation. Each search_part string
-            will be replaced with its corresponding replace_part string.
+            each tuple represents a text replacement operation. The first occurrence of each
+            search_part string will be replaced with its corresponding replace_part string.
 
     Returns:
         str: The modified content after all search/replace operations have been applied.
+            Pairs whose search_part is not found are skipped, see `apply_search_replace_pairs`
+            for the per-pair results.
     """
-    for search_part, replace_part in search_replace_pairs:
-        content = content.replace(search_part, replace_part)
-    return content
+    result = apply_search_replace_pairs(content, search_replace_pairs)
+    for pair_result in result.results:
+        if not pair_result.applied:
+            logger.warning(f"Search block {pair_result.index} not found in content")
+        elif pair_result.status == MatchStatus.FUZZY:
+            logger.info(
+                f"Search block {pair_result.index} matched lines {pair_result.start_line}-{pair_result.end_line} "
+                f"with confidence {pair_result.confidence}"
+            )
+        elif pair_result.status == MatchStatus.AMBIGUOUS:
+            logger.warning(
+                f"Search block {pair_result.index} matches {pair_result.occurrences} times, "
+                f"replaced the first match at line {pair_result.start_line}"
+            )
+    return result.content
 
 
 def apply_search_replace_to_content(
@@ -151,42 +123,26 @@ def apply_search_replace_to_content(
     if not search_replace_blocks.strip():
         return source_content, True  # Return True for empty patches to match test expectations
 
-    # Get all file blocks from the patch
-    file_blocks = split_search_replace_into_file_blocks(search_replace_blocks)
-    if not file_blocks:
+    files = parse_patch(search_replace_blocks).files()
+    if not files:
         return source_content, False
 
     # If target_filename is provided, verify it matches the filename in the patch
     if target_filename:
-        # Find the file block that matches the target filename
-        for filename, block in file_blocks:
-            if filename == target_filename:
-                # Extract search/replace pairs for this file
-                search_replace_pairs = split_block_into_search_replace_pairs(block)
-
-                # Apply the patch
-                patched_content = apply_search_replace_pairs_to_content(source_content, search_replace_pairs)
-                return patched_content, bool(search_replace_pairs)  # Return True if any pairs were applied
-
-        # No matching filename found
+        if target_filename not in files:
+            # No matching filename found
+            return source_content, False
+        search_replace_pairs = [_pair_texts(pair) for pair in files[target_filename]]
+        patched_content = apply_search_replace_pairs_to_content(source_content, search_replace_pairs)
+        return patched_content, bool(search_replace_pairs)  # Return True if any pairs were applied
+
+    # When no target_filename is provided, apply all blocks
+    # This is potentially dangerous, as it might apply mismatched blocks,
+    # but we keep it for backward compatibility
+    search_replace_pairs = [_pair_texts(pair) for pairs in files.values() for pair in pairs]
+    if not search_replace_pairs:
         return source_content, False
-    else:
-        # When no target_filename is provided, apply all blocks
-        # This is potentially dangerous, as it might apply mismatched blocks,
-        # but we keep it for backward compatibility
-        patched_content = source_content
-        applied = False
-
-        for _, block in file_blocks:
-            # Extract search/replace pairs for this file
-            search_replace_pairs = split_block_into_search_replace_pairs(block)
-
-            # Apply the search/replace pairs
-            if search_replace_pairs:
-                patched_content = apply_search_replace_pairs_to_content(patched_content, search_replace_pairs)
-                applied = True
-
-        return patched_content, applied
+    return apply_search_replace_pairs_to_content(source_content, search_replace_pairs), True
 
 
 def generate_git_patch_from_search_replace(repo_path: str, search_replace_blocks: str) -> str:
@@ -201,22 +157,20 @@ def generate_git_patch_from_search_replace(repo_path: str, search_replace_blocks
         str: A valid git patch that can be applied with git apply.
     """
 
-    # blocks will have all blocks grouped by filename
-    blocks = split_search_replace_into_file_blocks(search_replace_blocks)
-    if not blocks:
+    # pairs grouped by filename, there might be more than one block per file
+    files = parse_patch(search_replace_blocks).files()
+    if not files:
         return ""
 
     patches = []
 
-    # blocks could be for multiple files
-    # and there might be more than one block per file
-    for filename, block_content in blocks:
-
+    for filename, pairs in files.items():
         original_content = get_file_content(repo_path, filename)
-        modified_content, success = apply_search_replace_to_content(original_content, block_content, filename)
+        search_replace_pairs = [_pair_texts(pair) for pair in pairs]
+        modified_content = apply_search_replace_pairs_to_content(original_content, search_replace_pairs)
 
         # TODO handle error
-        if not success:
+        if not search_replace_pairs:
             print(f"Failed to apply search/replace to {filename}")
             continue
 
@@ -225,90 +179,63 @@ def generate_git_patch_from_search_replace(repo_path: str, search_replace_blocks
             print(f"No changes applied to {filename}")
             continue
 
-        # now we'll create a patch for this file
-        with tempfile.NamedTemporaryFile("w", delete=False) as temp_file:
-            temp_file.write(modified_content)
-            temp_file.flush()
-            git_patch = generate_git_patch(repo_path, filename, temp_file.name)
-            patches.append(git_patch)
+        patches.append(generate_unified_diff(filename, original_content, modified_content))
 
-    return "\n".join(patches)
+    return "".join(patches)
 
 
-def generate_git_patch(repo_path: str, orig_file_path: str, modified_file_path: str) -> str:
-    """Generate a git patch by comparing two files.
-
-    Parameters:
-        repo_path (str): The path to the git repository.
-        orig_file_path (str): The path to the original file.
-        modified_file_path (str): The path to the modified file.
-
-    Returns:
-        str: A valid git patch that can be applied with git apply.
-    """
-    try:
-        # Get the original filename without the path
-        orig_filename = os.path.basename(orig_file_path)
-
-        # Use git diff with paths to original and modified files
-        diff_cmd = ["git", "diff", "--no-index", "--no-prefix", "--no-color",
-                    orig_file_path, modified_file_path]
-
-        # Run the command in the repo context
-        result = subprocess.run(
-            diff_cmd,
-            capture_output=True,
-            text=True,
-            check=False,
-            cwd=repo_path,
-        )
-
-        # Only treat exit codes > 1 as errors, exit code 1 means differences found
-        if result.returncode > 1:
-            print(f"Error in git diff command. Return code: {result.returncode}")
-            return ""
-
-        output = cleanup_git_patch(result.stdout)
-
-        # prepend the file name as a/ and b/
-        output = f"+++ b/{orig_file_path}\n" + output
-        output = f"--- a/{orig_file_path}\n" + output
-
-        return output
-    except Exception as e:
-        print(f"Error generating git patch: {e}")
-        return ""
+@dataclass(frozen=True)
+class ApplyFailure:
+    file_path: str
+    reason: str
+    # None when the whole file failed, e.g. because it does not exist
+    pair: Optional[SearchReplacePair] = None
 
 
-def cleanup_git_patch(patch_content: str) -> str:
-    """Clean up a git patch by removing all file-related lines.
-
-    This function removes lines that start with 'diff --git', 'index', '---', and '+++'
+def dry_run_search_replace(repo_path: str, search_replace_blocks: str) -> List[ApplyFailure]:
+    """Apply search/replace blocks in memory and report the ones that do not apply.
 
     Parameters:
-        patch_content (str): The git patch content to clean up.
+        repo_path (str): The path to the git repository.
+        search_replace_blocks (str): String containing one or more search/replace blocks with
+            '<<<<<<< SEARCH', '=======', and '>>>>>>> REPLACE' markers.
 
     Returns:
-        str: The cleaned-up git patch content.
+        list: An `ApplyFailure` for every path outside the repository, every missing file and
+            every SEARCH section that is not found in its file. Empty if the whole patch applies.
     """
-
-    output = patch_content
-    # replace ^diff --git.*?$ with empty
-    output = re.sub(r"^diff --git.*?$\n", "", output, flags=re.MULTILINE)
-
-    # replace ^index.*?$ with empty
-    output = re.sub(r"^index.*?$\n", "", output, flags=re.MULTILINE)
-
-    # replace --- filename
-    output = re.sub(r"^---.*?$\n", "", output, flags=re.MULTILINE)
-
-    # replace +++ filename
-    output = re.sub(r"^\+\+\+.*?$\n", "", output, flags=re.MULTILINE)
-
-    return output
+    failures = []
+    for filename, pairs in parse_patch(search_replace_blocks).files().items():
+        if not is_inside_repo(repo_path, filename):
+            failures.append(ApplyFailure(file_path=filename, reason="the path is outside the docs repository"))
+            continue
+        if not os.path.isfile(os.path.join(repo_path, filename)):
+            failures.append(ApplyFailure(file_path=filename, reason="the file does not exist"))
+            continue
+        result = apply_search_replace_pairs(get_file_content(repo_path, filename), [_pair_texts(p) for p in pairs])
+        for pair_result in result.failed():
+            failures.append(
+                ApplyFailure(
+                    file_path=filename,
+                    reason="the SEARCH section does not match the file content",
+                    pair=pairs[pair_result.index],
+                )
+            )
+    return failures
+
+
+def is_inside_repo(repo_path: str, filename: str) -> bool:
+    """Whether `filename`, relative to `repo_path`, resolves to a path inside it. Absolute paths,
+    '..' components and symlinks pointing out of the repository are rejected."""
+    root = os.path.realpath(repo_path)
+    path = os.path.realpath(os.path.join(root, filename))
+    return os.path.commonpath([root, path]) == root
 
 
 def get_file_content(repo_path: str, filename: str) -> str:
+    if not is_inside_repo(repo_path, filename):
+        raise ValueError(f"{filename} is outside of {repo_path}")
     file_path = os.path.join(repo_path, filename)
-    with open(file_path, "r", encoding="utf-8") as f:
+    # keep line endings as they are on disk so that the patch applies to the file byte for byte
+    with open(file_path, "r", encoding="utf-8", newline="") as f:
         return f.read()
@@ -0,0 +1,212 @@
+"""
+Single-pass application of search/replace pairs to a document.
+
+All SEARCH texts are located in the original document, checked for uniqueness
+and overlaps, and the patched document is built with a single join. Only the first occurrence of every SEARCH text is
+replaced, as the patch agent prompt promises. SEARCH texts without an exact
+occurrence fall back to the whitespace-tolerant and fuzzy tiers of `fuzzy_match`.
+Pairs that overlap an earlier pair or are not found in the original are then
+applied in order to the patched document, with the same tiers, so chained
+edits, whose SEARCH text is the REPLACE text of an earlier pair, still apply.
+"""
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import List, Optional, Sequence, Set, Tuple
+
+from src.tools.search_replace.fuzzy_match import DEFAULT_MIN_CONFIDENCE, FuzzyMatcher, MatchTier, reindent
+
+
+class MatchStatus(str, Enum):
+    APPLIED = "applied"
+    # the SEARCH text occurs several times, the first occurrence was replaced
+    AMBIGUOUS = "ambiguous"
+    # no exact occurrence, matched ignoring whitespace or by similarity, see `confidence`
+    FUZZY = "fuzzy"
+    NOT_FOUND = "not_found"
+    # the first occurrence overlaps the span of an earlier pair
+    OVERLAP = "overlap"
+
+
+@dataclass(frozen=True)
+class PairResult:
+    """The outcome of one search/replace pair.
+
+    `offset` and the 1-based, inclusive line range locate the replaced text in the
+    original content, or in the content left by the earlier pairs for a pair that
+    was deferred because it overlaps an earlier pair or is not in the original.
+    """
+
+    index: int
+    status: MatchStatus
+    applied: bool
+    occurrences: int = 0
+    offset: Optional[int] = None
+    start_line: Optional[int] = None
+    end_line: Optional[int] = None
+    confidence: float = 1.0
+
+
+@dataclass
+class ApplyResult:
+    content: str
+    results: List[PairResult] = field(default_factory=list)
+
+    @property
+    def all_applied(self) -> bool:
+        return all(result.applied for result in self.results)
+
+    def failed(self) -> List[PairResult]:
+        return [result for result in self.results if not result.applied]
+
+
+class MultiPatternMatcher:
+    """Finds all occurrences of several patterns in a text.
+
+    Every pattern is located with `str.find`, which scans at C speed: even with
+    one scan per pattern this is far faster than a single pass of an automaton
+    stepped in Python, for the handful of SEARCH texts of a patch.
+    """
+
+    def __init__(self, patterns: Sequence[str]) -> None:
+        self.patterns = list(patterns)
+
+    def find_first(self, text: str) -> List[Tuple[int, int]]:
+        """The offset of the first occurrence of every pattern, -1 if it has none, and its number of occurrences.
+
+        The count is of non-overlapping occurrences, but is at least 2 when a second, overlapping one exists.
+        """
+        located: List[Tuple[int, int]] = []
+        for pattern in self.patterns:
+            offset = text.find(pattern) if pattern else -1
+            count = 0
+            if offset >= 0:
+                # most SEARCH texts are unique, only count the occurrences of those that are not
+                count = 1 if text.find(pattern, offset + 1) < 0 else max(2, text.count(pattern, offset))
+            located.append((offset, count))
+        return located
+
+
+def _line_range(content: str, offset: int, length: int) -> Tuple[int, int]:
+    """The 1-based, inclusive range of the lines of `content` spanned by `length` characters at `offset`."""
+    start_line = content.count("\n", 0, offset) + 1
+    end_line = start_line + content.count("\n", offset, offset + max(length, 1) - 1)
+    return start_line, end_line
+
+
+def apply_search_replace_pairs(
+    content: str,
+    pairs: Sequence[Tuple[str, str]],
+    fuzzy: bool = True,
+    min_confidence: float = DEFAULT_MIN_CONFIDENCE,
+) -> ApplyResult:
+    """Replace the first occurrence of every SEARCH text in `content`.
+
+    The pairs whose first occurrence does not overlap an earlier pair are applied
+    in a single pass over the original content. A pair that overlaps, or whose
+    SEARCH text is not in the original, is then applied to the result of the
+    earlier pairs, since its SEARCH text was likely written against the already
+    edited text.
+
+    Args:
+        content: The original document.
+        pairs: (search, replace) pairs, in order.
+        fuzzy: Locate SEARCH texts without an exact occurrence with `FuzzyMatcher`.
+        min_confidence: Lowest similarity accepted by the fuzzy tier.
+
+    Returns:
+        The patched content and a `PairResult` for every pair, in the same order.
+    """
+    located = MultiPatternMatcher([search for search, _ in pairs]).find_first(content)
+
+    fuzzy_matcher: Optional[FuzzyMatcher] = None
+
+    results: List[Optional[PairResult]] = [None] * len(pairs)
+    # (start, end, pair index, replacement)
+    spans: List[Tuple[int, int, int, str]] = []
+    deferred: List[int] = []
+    overlapping: Set[int] = set()
+    for index, (search, replace) in enumerate(pairs):
+        status, confidence = MatchStatus.APPLIED, 1.0
+        if not search:
+            start, count = (-1, 0) if content else (0, 1)
+        else:
+            start, count = located[index]
+        end = start + len(search)
+        if start < 0 and search and fuzzy:
+            fuzzy_matcher = fuzzy_matcher or FuzzyMatcher(content, min_confidence)
+            match = fuzzy_matcher.find(search)
+            if match is not None and match.tier != MatchTier.EXACT:
+                start, end, count = match.start, match.end, 1
+                status, confidence, replace = MatchStatus.FUZZY, match.confidence, reindent(replace, match)
+        if start < 0:
+            if search:
+                # may be a chained edit, matching only the output of an earlier pair
+                deferred.append(index)
+            else:
+                results[index] = PairResult(index=index, status=MatchStatus.NOT_FOUND, applied=False)
+            continue
+
+        if any(start < other_end and other_start < end for other_start, other_end, _, _ in spans):
+            deferred.append(index)
+            overlapping.add(index)
+            continue
+        spans.append((start, end, index, replace))
+        if count > 1:
+            status = MatchStatus.AMBIGUOUS
+        start_line, end_line = _line_range(content, start, end - start)
+        results[index] = PairResult(
+            index=index,
+            status=status,
+            applied=True,
+            occurrences=count,
+            offset=start,
+            start_line=start_line,
+            end_line=end_line,
+            confidence=confidence,
+        )
+
+    parts: List[str] = []
+    position = 0
+    for start, end, _, replace in sorted(spans):
+        parts.append(content[position:start])
+        parts.append(replace)
+        position = end
+    parts.append(content[position:])
+    patched = "".join(parts)
+
+    for index in deferred:
+        search, replace = pairs[index]
+        confidence = 1.0
+        offset = patched.find(search)
+        end = offset + len(search)
+        if offset >= 0:
+            count = patched.count(search)
+            if index in overlapping:
+                status = MatchStatus.OVERLAP
+            else:
+                status = MatchStatus.AMBIGUOUS if count > 1 else MatchStatus.APPLIED
+        elif fuzzy:
+            # the edited text changes with every deferred pair, so the matcher is built for each one
+            match = FuzzyMatcher(patched, min_confidence).find(search)
+            if match is not None:
+                offset, end, count = match.start, match.end, 1
+                status, confidence, replace = MatchStatus.FUZZY, match.confidence, reindent(replace, match)
+        if offset < 0:
+            # a pair that is neither in the original nor in the edited text is a plain miss
+            status = MatchStatus.OVERLAP if index in overlapping else MatchStatus.NOT_FOUND
+            results[index] = PairResult(index=index, status=status, applied=False, occurrences=located[index][1])
+            continue
+        start_line, end_line = _line_range(patched, offset, end - offset)
+        patched = patched[:offset] + replace + patched[end:]
+        results[index] = PairResult(
+            index=index,
+            status=status,
+            applied=True,
+            occurrences=count,
+            offset=offset,
+            start_line=start_line,
+            end_line=end_line,
+            confidence=confidence,
+        )
+
+    return ApplyResult(content=patched, results=[result for result in results if result is not None])
@@ -0,0 +1,259 @@
+"""
+Single-pass parser for SEARCH/REPLACE patch text.
+
+The patch is tokenized line by line, once, into an immutable tree:
+
+    Patch -> FencedBlock (file path + code fence) -> SearchReplacePair
+
+Every node records the 1-based patch lines it came from. Structural problems
+are collected as `PatchError`s instead of raised, so that the validator can
+report them while the applier still uses whatever could be parsed. Parsed
+patches are cached, so the validator and the applier share one parse of the
+same text.
+
+Inside a fenced block, a file path line between pairs retargets the following
+pairs to that file. Lines inside a SEARCH or REPLACE section are kept verbatim,
+including code fences, so documentation with code blocks can be edited.
+"""
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+SEARCH_MARKER = "<<<<<<< SEARCH"
+DIVIDER_MARKER = "======="
+REPLACE_MARKER = ">>>>>>> REPLACE"
+FENCE_MARKER = "```"
+
+MISSING_FILE_PATH = "Missing file path at the start of patch"
+MISSING_BEGIN_FENCE = "Missing begin code fence markers"
+MISSING_CLOSING_FENCE = "Missing closing code fence markers"
+MISSING_SEARCH = f"Missing '{SEARCH_MARKER}' marker"
+MISSING_DIVIDER = f"Missing '{DIVIDER_MARKER}' divider"
+MISSING_REPLACE = f"Missing '{REPLACE_MARKER}' marker"
+EMPTY_SEARCH = "Search section is empty"
+EMPTY_REPLACE = "Replace section is empty"
+
+# Match valid Unix filepaths:
+# - Can start with / (absolute) or not (relative)
+# - Can contain letters, numbers, underscore, hyphen, period
+# - Can have directories separated by /
+# - No consecutive slashes
+_FILEPATH_RE = re.compile(r"^(/)?([A-Za-z0-9_\-\.]+/)*([A-Za-z0-9_\-\.]+)?$")
+
+
+def is_valid_filepath(filepath: str) -> bool:
+    return bool(_FILEPATH_RE.match(filepath))
+
+
+def _is_retarget_path(line: str) -> bool:
+    # stricter than a block header, so that stray words between pairs are not taken for files
+    return "/" in line and is_valid_filepath(line)
+
+
+@dataclass(frozen=True)
+class PatchError:
+    message: str
+    line: int
+    # errors in the block/fence layout, reported before errors inside the blocks
+    structural: bool
+
+
+@dataclass(frozen=True)
+class SearchReplacePair:
+    file_path: Optional[str]
+    search: str
+    replace: str
+    # lines of the SEARCH and REPLACE markers
+    start_line: int
+    end_line: int
+
+
+@dataclass(frozen=True)
+class FencedBlock:
+    file_path: Optional[str]
+    # line of the file path, or of the opening fence when the path is missing
+    start_line: int
+    # line of the closing fence, None when the block is not closed
+    end_line: Optional[int]
+    pairs: Tuple[SearchReplacePair, ...]
+
+
+@dataclass(frozen=True)
+class Patch:
+    blocks: Tuple[FencedBlock, ...]
+    errors: Tuple[PatchError, ...]
+
+    @property
+    def pairs(self) -> List[SearchReplacePair]:
+        return [pair for block in self.blocks for pair in block.pairs]
+
+    def files(self) -> Dict[str, List[SearchReplacePair]]:
+        """The pairs grouped by file, in order of first appearance. Files of blocks without pairs are included."""
+        files: Dict[str, List[SearchReplacePair]] = {}
+        for block in self.blocks:
+            if block.file_path is not None:
+                files.setdefault(block.file_path, [])
+            for pair in block.pairs:
+                if pair.file_path is not None:
+                    files.setdefault(pair.file_path, []).append(pair)
+        return files
+
+    def first_error(self) -> Optional[PatchError]:
+        """The error the validator reports: the first structural error, else the first error inside a block."""
+        structural = [error for error in self.errors if error.structural]
+        if structural:
+            return structural[0]
+        return self.errors[0] if self.errors else None
+
+
+# tokenizer states
+_OUTSIDE, _EXPECT_FENCE, _IN_FENCE, _IN_SEARCH, _IN_REPLACE = range(5)
+
+
+class _Parser:
+    def __init__(self, default_path: Optional[str]) -> None:
+        self.default_path = default_path
+        self.state = _OUTSIDE
+        self.blocks: List[FencedBlock] = []
+        self.errors: List[PatchError] = []
+        self.block_path: Optional[str] = None
+        self.block_start = 0
+        self.block_pairs: List[SearchReplacePair] = []
+        self.block_errors = 0
+        self.target: Optional[str] = None
+        self.pair_start = 0
+        self.search: List[str] = []
+        self.replace: List[str] = []
+
+    def error(self, message: str, line: int, structural: bool = False) -> None:
+        self.errors.append(PatchError(message=message, line=line, structural=structural))
+        if not structural:
+            self.block_errors += 1
+
+    def open_block(self, path: Optional[str], line: int) -> None:
+        self.block_path = self.target = path
+        self.block_start = line
+        self.block_pairs = []
+        self.block_errors = 0
+
+    def close_block(self, end_line: Optional[int]) -> None:
+        if not self.block_pairs and not self.block_errors:
+            self.error(MISSING_SEARCH, end_line or self.block_start)
+        self.blocks.append(
+            FencedBlock(
+                file_path=self.block_path, start_line=self.block_start, end_line=end_line, pairs=tuple(self.block_pairs)
+            )
+        )
+
+    def open_pair(self, line: int) -> None:
+        self.state = _IN_SEARCH
+        self.pair_start = line
+        self.search = []
+        self.replace = []
+
+    def close_pair(self, line: int) -> None:
+        self.state = _IN_FENCE
+        search, replace = "\n".join(self.search), "\n".join(self.replace)
+        if not search.strip():
+            self.error(EMPTY_SEARCH, self.pair_start)
+        elif not replace.strip():
+            self.error(EMPTY_REPLACE, self.pair_start)
+        self.block_pairs.append(
+            SearchReplacePair(
+                file_path=self.target, search=search, replace=replace, start_line=self.pair_start, end_line=line
+            )
+        )
+
+    def feed(self, number: int, line: str) -> None:
+        stripped = line.strip()
+        state = self.state
+        if state == _IN_SEARCH:
+            if stripped == DIVIDER_MARKER:
+                self.state = _IN_REPLACE
+            elif stripped == REPLACE_MARKER:
+                self.error(MISSING_DIVIDER, self.pair_start)
+                self.state = _IN_FENCE
+            elif stripped == SEARCH_MARKER:
+                self.error(MISSING_DIVIDER, self.pair_start)
+                self.open_pair(number)
+            else:
+                self.search.append(line)
+        elif state == _IN_REPLACE:
+            if stripped == REPLACE_MARKER:
+                self.close_pair(number)
+            elif stripped == SEARCH_MARKER:
+                self.error(MISSING_REPLACE, self.pair_start)
+                self.open_pair(number)
+            else:
+                self.replace.append(line)
+        elif state == _IN_FENCE:
+            if stripped == FENCE_MARKER:
+                self.close_block(number)
+                self.state = _OUTSIDE
+            elif stripped == SEARCH_MARKER:
+                self.open_pair(number)
+            elif stripped == REPLACE_MARKER:
+                self.error(MISSING_SEARCH, number)
+            elif _is_retarget_path(stripped):
+                self.target = stripped
+        elif state == _EXPECT_FENCE:
+            if stripped.startswith(FENCE_MARKER):
+                self.state = _IN_FENCE
+            else:
+                self.error(MISSING_BEGIN_FENCE, number, structural=True)
+                # parse the rest of the block as if the fence was there
+                self.state = _IN_FENCE
+                self.feed(number, line)
+        elif stripped:
+            if is_valid_filepath(stripped):
+                self.open_block(stripped, number)
+                self.state = _EXPECT_FENCE
+                return
+            self.error(MISSING_FILE_PATH, number, structural=True)
+            if stripped.startswith(FENCE_MARKER) or stripped == SEARCH_MARKER:
+                # parse the block anyway, for the default path
+                self.open_block(self.default_path, number)
+                self.state = _IN_FENCE
+                if stripped == SEARCH_MARKER:
+                    self.feed(number, line)
+
+    def finish(self, last_line: int) -> Patch:
+        if self.state == _IN_SEARCH:
+            # an unterminated pair swallowed the closing fence, report the pair rather than the fence
+            self.error(MISSING_DIVIDER, self.pair_start)
+            self.close_block(None)
+        elif self.state == _IN_REPLACE:
+            self.error(MISSING_REPLACE, self.pair_start)
+            self.close_block(None)
+        elif self.state in (_IN_FENCE, _EXPECT_FENCE):
+            self.error(MISSING_CLOSING_FENCE, last_line, structural=True)
+            self.close_block(None)
+        return Patch(blocks=tuple(self.blocks), errors=tuple(self.errors))
+
+
+@lru_cache(maxsize=32)
+def parse_patch(text: str, default_path: Optional[str] = None) -> Patch:
+    """Parse SEARCH/REPLACE patch text.
+
+    Args:
+        text: The patch, e.g. the `patch_diff` returned by the patch agent.
+        default_path: File for pairs in blocks without a file path.
+
+    Returns:
+        The parsed patch. Parsing never raises, problems are listed in `Patch.errors`.
+    """
+    parser = _Parser(default_path)
+    number = 0
+    for number, line in enumerate(text.split("\n"), 1):
+        parser.feed(number, line)
+    return parser.finish(number)
+
+
+def format_pairs(file_path: str, pairs: List[SearchReplacePair]) -> str:
+    """Render the pairs of one file back as a fenced SEARCH/REPLACE block."""
+    lines = [file_path, FENCE_MARKER]
+    for pair in pairs:
+        lines.extend([SEARCH_MARKER, pair.search, DIVIDER_MARKER, pair.replace, REPLACE_MARKER])
+    lines.append(FENCE_MARKER)
+    return "\n".join(lines)
@@ -0,0 +1,68 @@
+"""
+In-process generation of git-style unified diffs.
+
+The diffs are built from the original and modified file contents in memory and
+can be applied with `git apply`, without writing temporary files or running
+`git diff --no-index`.
+"""
+import difflib
+import re
+from typing import Iterator, List
+
+DEFAULT_CONTEXT_LINES = 3
+NO_NEWLINE_MARKER = "\\ No newline at end of file\n"
+
+_LINE_END_RE = re.compile(r"(?<=\n)")
+
+
+def _split_lines(text: str) -> List[str]:
+    """Split on "\\n" only, keeping it, as git does.
+
+    `str.splitlines` also breaks on "\\r", form feeds, "\\u2028" and other separators,
+    which would put a "No newline" marker in the middle of the file.
+    """
+    lines = _LINE_END_RE.split(text)
+    if lines[-1] == "":
+        lines.pop()
+    return lines
+
+
+def _diff_lines(original: str, modified: str, context_lines: int) -> Iterator[str]:
+    lines = difflib.unified_diff(
+        _split_lines(original),
+        _split_lines(modified),
+        n=context_lines,
+    )
+    # skip difflib's own ---/+++ headers, the caller writes git's
+    for line in lines:
+        if line.startswith("@@"):
+            yield line
+            break
+    for line in lines:
+        if line.endswith("\n"):
+            yield line
+        else:
+            # only the last line of a file can lack a newline
+            yield line + "\n"
+            yield NO_NEWLINE_MARKER
+
+
+def generate_unified_diff(
+    path: str, original: str, modified: str, context_lines: int = DEFAULT_CONTEXT_LINES
+) -> str:
+    """Diff two versions of a file in the format of `git diff`.
+
+    Args:
+        path: The file path relative to the repository root, used in the a/ and b/ headers.
+        original: The current content of the file.
+        modified: The new content of the file.
+        context_lines: Number of unchanged lines around every change.
+
+    Returns:
+        The patch for the file, or an empty string when the contents are equal.
+    """
+    if original == modified:
+        return ""
+    lines: List[str] = [f"diff --git a/{path} b/{path}\n", f"--- a/{path}\n", f"+++ b/{path}\n"]
+    lines.extend(_diff_lines(original, modified, context_lines))
+    return "".join(lines)
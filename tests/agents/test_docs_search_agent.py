@@ -0,0 +1,108 @@
+import os
+
+import numpy as np
+import pytest
+
+# the agents are created at import time and need a key, no request is made in these tests
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+from src.agents import docs_search_agent  # noqa: E402
+from src.rag.embedding_pipeline import FakeEmbeddings  # noqa: E402
+from src.rag.vector_index import VectorIndex  # noqa: E402
+
+PR_DIFF = """diff --git a/src/config.ts b/src/config.ts
+index 1111111..2222222 100644
+--- a/src/config.ts
++++ b/src/config.ts
+@@ -1,2 +1,2 @@
+ export const config = {
+-  timeout: 10,
++  requestTimeout: 10,
+diff --git a/logo.png b/logo.png
+index 3333333..4444444 100644
+Binary files a/logo.png and b/logo.png differ
+diff --git a/README.md b/README.md
+index 5555555..6666666 100644
+--- a/README.md
++++ b/README.md
+@@ -1 +1,2 @@
+ # Plugin
++Configure the request timeout.
+"""
+
+
+@pytest.fixture
+def deps(tmp_path):
+    embeddings = FakeEmbeddings(size=16)
+    texts = ["timeout configuration", "installation"]
+    VectorIndex.write(
+        str(tmp_path / "index"),
+        ["config.md#0", "install.md#0"],
+        texts,
+        [{"file_name": "config.md", "heading_path": "Config"}, {"file_name": "install.md"}],
+        np.asarray(embeddings.embed_documents(texts)),
+    )
+    index = VectorIndex.load(str(tmp_path / "index"))
+    yield docs_search_agent.Deps(vectordb=index, embeddings=embeddings)
+    index.close()
+
+
+def test_file_changes_from_diff_skips_binary_files():
+    changes = docs_search_agent.file_changes_from_diff(PR_DIFF)
+
+    assert [change.file_path for change in changes] == ["src/config.ts", "README.md"]
+    assert "+  requestTimeout: 10," in changes[0].patch
+    assert "README.md" not in changes[0].patch
+
+
+def test_file_changes_from_diff_keeps_carriage_returns_inside_lines():
+    diff = (
+        "diff --git a/a.go b/a.go\n--- a/a.go\n+++ b/a.go\n@@ -1,3 +1,3 @@\n x\n"
+        '-s := "a\rb\x0cc"\n+s := "a\rb\x0cd"\n y\n'
+    )
+
+    [change] = docs_search_agent.file_changes_from_diff(diff)
+
+    assert '-s := "a\rb\x0cc"\n+s := "a\rb\x0cd"\n y\n' in change.patch
+    assert 'a\rb\x0cd' in docs_search_agent.retrieval_query(change)
+
+
+def test_file_changes_from_diff_accepts_lines():
+    lines = iter(PR_DIFF.splitlines(keepends=True))
+
+    assert docs_search_agent.file_changes_from_diff(lines) == docs_search_agent.file_changes_from_diff(PR_DIFF)
+
+
+def test_find_documentation_changes_auto_accepts_close_chunks(deps, monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("the relevance agent should not run")
+
+    monkeypatch.setattr(docs_search_agent.relevance_agent, "run_sync", fail)
+
+    changes = docs_search_agent.find_documentation_changes(PR_DIFF, deps, auto_accept_distance=float("inf"))
+
+    # both source files retrieve both chunks, every chunk is only kept once
+    chunks = [change.original_documentation_chunk for change in changes]
+    assert sorted(chunk.file_name for chunk in chunks) == ["config.md", "install.md"]
+    assert all(chunk.diff.startswith("--- a/") for chunk in chunks)
+
+
+def test_find_documentation_changes_asks_relevance_agent_above_threshold(deps, monkeypatch):
+    questions = []
+
+    class Result:
+        data = []
+
+    def run_sync(question, **kwargs):
+        questions.append(question)
+        return Result()
+
+    monkeypatch.setattr(docs_search_agent.relevance_agent, "run_sync", run_sync)
+
+    assert docs_search_agent.find_documentation_changes(PR_DIFF, deps, auto_accept_distance=0.0) == []
+    assert len(questions) == 1
+    assert "config.md" in questions[0]
+
+
+def test_find_documentation_changes_without_file_changes(deps):
+    assert docs_search_agent.find_documentation_changes("", deps) == []
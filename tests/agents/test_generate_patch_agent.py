@@ -0,0 +1,79 @@
+import asyncio
+import os
+from types import SimpleNamespace
+
+import pytest
+from pydantic_ai import ModelRetry
+
+# the agent's model client is created at import time and needs a key, no request is made in these tests
+os.environ.setdefault("ANTHROPIC_API_KEY", "test")
+
+from src.agents import generate_patch_agent  # noqa: E402
+from src.agents.generate_patch_agent import Deps, PullRequestContent  # noqa: E402
+
+
+def result(patch):
+    return PullRequestContent(reasoning="docs", title="Update docs", patch_diff=patch)
+
+
+def validate(repo, patch):
+    ctx = SimpleNamespace(deps=Deps(docs_repo_path=str(repo)))
+    return asyncio.run(generate_patch_agent.validate_patch(ctx, result(patch)))
+
+
+@pytest.fixture
+def repo(tmp_path):
+    (tmp_path / "docs").mkdir()
+    (tmp_path / "docs" / "a.md").write_text("# A\n\nThe timeout is 10 seconds.\n")
+    return tmp_path
+
+
+PATCH = """docs/a.md
+```markdown
+<<<<<<< SEARCH
+The timeout is 10 seconds.
+=======
+The timeout is 30 seconds.
+>>>>>>> REPLACE
+```"""
+
+
+def test_validate_patch_accepts_applicable_patch(repo):
+    assert validate(repo, PATCH).patch_diff == PATCH
+
+
+def test_validate_patch_retries_with_non_matching_block(repo):
+    patch = PATCH.replace("The timeout is 10 seconds.\n=", "The default timeout is five minutes.\n=")
+    with pytest.raises(ModelRetry) as excinfo:
+        validate(repo, patch)
+    message = str(excinfo.value)
+    assert "docs/a.md, block starting at patch line 3" in message
+    assert "The default timeout is five minutes." in message
+
+
+def test_validate_patch_retries_for_missing_file(repo):
+    with pytest.raises(ModelRetry) as excinfo:
+        validate(repo, PATCH.replace("docs/a.md", "docs/missing.md"))
+    assert "docs/missing.md: the file does not exist" in str(excinfo.value)
+
+
+def test_validate_patch_retries_for_invalid_format(repo):
+    with pytest.raises(ModelRetry, match="Missing closing code fence"):
+        validate(repo, PATCH.rstrip("`"))
+
+
+def test_get_document_serves_ranges_and_sections(repo):
+    (repo / "docs" / "long.md").write_text("# Long\n\n## First\n\none\n\n## Second\n\ntwo\n")
+    ctx = SimpleNamespace(deps=Deps(docs_repo_path=str(repo)))
+
+    full = asyncio.run(generate_patch_agent.get_document(ctx, "docs/a.md"))
+    section = asyncio.run(generate_patch_agent.get_document(ctx, "docs/long.md", section="Second"))
+    lines = asyncio.run(generate_patch_agent.get_document(ctx, "docs/long.md", start_line=3, end_line=5))
+    outline = asyncio.run(generate_patch_agent.get_document_outline(ctx, "docs/long.md"))
+
+    assert full == {"file_path": "docs/a.md", "content": "# A\n\nThe timeout is 10 seconds.\n", "exists": True}
+    assert section["content"] == "## Second\n\ntwo\n"
+    assert (section["start_line"], section["end_line"], section["total_lines"]) == (7, 9, 9)
+    assert lines["content"] == "## First\n\none\n"
+    assert [s["title"] for s in outline["sections"]] == ["Long", "First", "Second"]
+    assert asyncio.run(generate_patch_agent.get_document(ctx, "docs/missing.md"))["exists"] is False
@@ -0,0 +1,46 @@
+import threading
+from types import SimpleNamespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+
+class StubGitHub(BaseHTTPRequestHandler):
+    """Serves scripted responses per path and records the requests it got."""
+
+    routes = {}
+    seen = []
+
+    def do_GET(self):
+        self.respond()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.respond()
+
+    def respond(self):
+        self.seen.append((self.command, self.path, dict(self.headers)))
+        route = self.routes[self.path]
+        status, headers, body = route(self) if callable(route) else route.pop(0)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    StubGitHub.routes = {}
+    StubGitHub.seen = []
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), StubGitHub)
+    thread = threading.Thread(target=httpd.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    thread.start()
+    yield SimpleNamespace(
+        url=f"http://127.0.0.1:{httpd.server_address[1]}", routes=StubGitHub.routes, seen=StubGitHub.seen
+    )
+    httpd.shutdown()
@@ -0,0 +1,117 @@
+from src.functions.diff_parser import build_retrieval_query, group_by_file, parse_unified_diff
+
+MBOX_PATCH = """From 1234567890abcdef Mon Sep 17 00:00:00 2001
+From: Jane Doe <jane@example.com>
+Date: Mon, 3 Mar 2025 10:00:00 +0100
+Subject: [PATCH 1/2] Rename baseUrl to proxyUrl
+
+---
+ src/datasource.ts | 4 ++--
+ 1 file changed, 2 insertions(+), 2 deletions(-)
+
+diff --git a/src/datasource.ts b/src/datasource.ts
+index 1111111..2222222 100644
+--- a/src/datasource.ts
++++ b/src/datasource.ts
+@@ -10,6 +10,6 @@ export class DataSource extends DataSourceApi {
+   constructor(instanceSettings: DataSourceInstanceSettings) {
+     super(instanceSettings);
+-    this.baseUrl = instanceSettings.url!;
++    this.proxyUrl = instanceSettings.url!;
+   }
+-  baseUrl: string;
++  proxyUrl: string;
+ }
+--
+2.39.0
+
+From abcdef1234567890 Mon Sep 17 00:00:00 2001
+From: Jane Doe <jane@example.com>
+Subject: [PATCH 2/2] Add logo and docs
+
+---
+diff --git a/img/logo.png b/img/logo.png
+new file mode 100644
+index 0000000..3333333
+Binary files /dev/null and b/img/logo.png differ
+diff --git a/src/datasource.ts b/src/datasource.ts
+index 2222222..4444444 100644
+--- a/src/datasource.ts
++++ b/src/datasource.ts
+@@ -1,2 +1,3 @@
+ import { DataSourceApi } from '@grafana/data';
++import { getBackendSrv } from '@grafana/runtime';
+ 
+diff --git a/src/old.ts b/src/old.ts
+deleted file mode 100644
+index 5555555..0000000
+--- a/src/old.ts
++++ /dev/null
+@@ -1 +0,0 @@
+-export const old = 1;
+-- 
+2.39.0
+"""
+
+
+def test_parse_mbox_patch_series():
+    files = list(parse_unified_diff(MBOX_PATCH.splitlines(keepends=True)))
+
+    assert [f.path for f in files] == ["src/datasource.ts", "img/logo.png", "src/datasource.ts", "src/old.ts"]
+
+    first = files[0]
+    assert len(first.hunks) == 1
+    hunk = first.hunks[0]
+    assert (hunk.old_start, hunk.old_lines, hunk.new_start, hunk.new_lines) == (10, 6, 10, 6)
+    assert hunk.section == "export class DataSource extends DataSourceApi {"
+    assert hunk.removed == ["    this.baseUrl = instanceSettings.url!;", "  baseUrl: string;"]
+    assert hunk.added == ["    this.proxyUrl = instanceSettings.url!;", "  proxyUrl: string;"]
+    assert len(hunk.context) == 4
+
+    assert files[1].is_binary and files[1].is_new and not files[1].hunks
+    assert files[3].is_deleted
+    assert files[3].hunks[0].removed == ["export const old = 1;"]
+
+
+def test_signature_after_last_hunk_is_not_a_removed_line():
+    files = list(parse_unified_diff(MBOX_PATCH.splitlines()))
+    assert files[-1].removed_lines == 1
+
+
+def test_group_by_file_merges_patch_series():
+    files = group_by_file(parse_unified_diff(MBOX_PATCH.splitlines()))
+    assert [f.path for f in files] == ["src/datasource.ts", "img/logo.png", "src/old.ts"]
+    assert len(files[0].hunks) == 2
+    assert files[0].added_lines == 3
+
+
+def test_symbols_prioritise_renamed_identifiers():
+    files = group_by_file(parse_unified_diff(MBOX_PATCH.splitlines()))
+    symbols = files[0].symbols()
+    assert set(symbols[:3]) == {"proxyUrl", "baseUrl", "getBackendSrv"}
+    assert "this" not in symbols
+
+
+def test_hunks_without_file_headers_use_default_path():
+    diff = "@@ -1,2 +1,2 @@\n-old line\n+new line\n context\n"
+    files = list(parse_unified_diff(diff.splitlines(), default_path="src/a.ts"))
+    assert files[0].path == "src/a.ts"
+    assert files[0].hunks[0].added == ["new line"]
+
+
+def test_retrieval_query_is_bounded_and_skips_context():
+    files = group_by_file(parse_unified_diff(MBOX_PATCH.splitlines()))
+    query = build_retrieval_query(files[0])
+
+    assert query.startswith("File: src/datasource.ts\nSymbols: ")
+    assert "+    this.proxyUrl = instanceSettings.url!;" in query
+    assert "super(instanceSettings)" not in query
+
+    assert len(build_retrieval_query(files[0], max_chars=80)) <= 80
+
+
+def test_to_patch_roundtrip():
+    files = list(parse_unified_diff(MBOX_PATCH.splitlines()))
+    reparsed = list(parse_unified_diff(files[0].to_patch().splitlines()))
+    assert reparsed[0].hunks[0].added == files[0].hunks[0].added
+    assert reparsed[0].hunks[0].removed == files[0].hunks[0].removed
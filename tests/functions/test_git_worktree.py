@@ -0,0 +1,111 @@
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from src.functions import git_worktree
+
+
+def git(*args, cwd):
+    return subprocess.run(
+        ["git", "-c", "user.name=t", "-c", "user.email=t@t", *args],
+        cwd=cwd,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout.strip()
+
+
+def commit(repo, name, content):
+    (repo / name).write_text(content)
+    git("add", ".", cwd=repo)
+    git("commit", "-m", name, cwd=repo)
+    return git("rev-parse", "HEAD", cwd=repo)
+
+
+@pytest.fixture
+def origin(tmp_path, monkeypatch):
+    repo = tmp_path / "origin"
+    repo.mkdir()
+    git("init", "-b", "main", cwd=repo)
+    # serve partial clones over file://
+    git("config", "uploadpack.allowFilter", "true", cwd=repo)
+    (repo / "docs").mkdir()
+    (repo / "src").mkdir()
+    (repo / "docs" / "install.md").write_text("# Install\n")
+    (repo / "src" / "main.py").write_text("print('hello')\n")
+    commit(repo, "index.md", "# Docs\n")
+    monkeypatch.setattr(git_worktree, "MIRRORS_PATH", str(tmp_path / "mirrors"))
+    monkeypatch.setattr(git_worktree, "WORKTREES_PATH", str(tmp_path / "worktrees"))
+    # the mirror fetches from the local repo instead of GitHub
+    monkeypatch.setattr(git_worktree, "get_authenticated_github_url", lambda url: f"file://{repo}")
+    return repo
+
+
+def test_sync_mirror_creates_a_bare_mirror_and_fetches_new_commits(origin):
+    mirror = git_worktree.sync_mirror("https://github.com/owner/docs")
+    assert git("rev-parse", "--is-bare-repository", cwd=mirror) == "true"
+
+    head = commit(origin, "changelog.md", "# Changelog\n")
+    assert git_worktree.sync_mirror("https://github.com/owner/docs") == mirror
+    assert git("rev-parse", "main", cwd=mirror) == head
+
+
+def test_concurrent_worktrees_are_isolated(origin):
+    mirror = git_worktree.sync_mirror("https://github.com/owner/docs")
+
+    def run(n):
+        with git_worktree.worktree(mirror, "main") as path:
+            git("checkout", "-b", f"lapo-docs-{n}", cwd=path)
+            with open(os.path.join(path, "index.md"), "a") as f:
+                f.write(f"run {n}\n")
+            git("commit", "-a", "-m", f"run {n}", cwd=path)
+            return path, open(os.path.join(path, "index.md")).read()
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(run, range(4)))
+
+    assert [content for _, content in results] == [f"# Docs\nrun {n}\n" for n in range(4)]
+    assert all(not os.path.exists(path) for path, _ in results)
+    assert len(git("worktree", "list", cwd=mirror).splitlines()) == 1
+    # the branches of the runs are deleted with their worktrees, main is untouched
+    assert git("branch", "--list", "lapo-docs-*", cwd=mirror) == ""
+    assert git("show", "main:index.md", cwd=mirror) == "# Docs"
+
+
+def test_sync_mirror_skips_the_fetch_when_up_to_date(origin, monkeypatch):
+    git_worktree.sync_mirror("https://github.com/owner/docs")
+    commands = []
+    run = subprocess.run
+
+    def recording_run(args, *rest, **kwargs):
+        commands.append(args)
+        return run(args, *rest, **kwargs)
+
+    monkeypatch.setattr(subprocess, "run", recording_run)
+    git_worktree.sync_mirror("https://github.com/owner/docs")
+    assert not [command for command in commands if "fetch" in command]
+
+    commit(origin, "changelog.md", "# Changelog\n")
+    git_worktree.sync_mirror("https://github.com/owner/docs")
+    assert len([command for command in commands if "fetch" in command]) == 1
+
+
+def test_sparse_worktree_of_a_blobless_mirror_only_fetches_the_docs(origin):
+    mirror = git_worktree.sync_mirror("https://github.com/owner/docs")
+    assert git("config", "remote.origin.promisor", cwd=mirror) == "true"
+
+    with git_worktree.worktree(mirror, "main", sparse_paths=["docs/"]) as path:
+        files = sorted(
+            os.path.relpath(os.path.join(root, name), path)
+            for root, dirs, names in os.walk(path)
+            for name in names
+            if ".git" not in os.path.relpath(root, path).split(os.sep) and name != ".git"
+        )
+        assert files == ["docs/install.md", "index.md"]
+        assert git("status", "--porcelain", cwd=path) == ""
+
+    missing = git("rev-list", "--objects", "--missing=print", "main", cwd=mirror).splitlines()
+    main_py = git("rev-parse", "main:src/main.py", cwd=origin)
+    assert f"?{main_py}" in missing
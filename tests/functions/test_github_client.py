@@ -0,0 +1,85 @@
+import pytest
+import requests
+
+from src.functions.github_client import GitHubClient, GitHubError
+
+
+@pytest.fixture
+def client(server, tmp_path):
+    sleeps = []
+    github = GitHubClient(token="secret", api_url=server.url, cache_path=str(tmp_path / "cache"), sleep=sleeps.append)
+    github.sleeps = sleeps
+    return github
+
+
+def test_get_revalidates_with_etag(client, server):
+    def patch(handler):
+        if handler.headers.get("If-None-Match") == '"v1"':
+            return 304, {"ETag": '"v1"'}, b""
+        return 200, {"ETag": '"v1"', "Content-Type": "text/plain; charset=utf-8"}, "diff ✓".encode()
+
+    server.routes["/owner/repo/pull/1.patch"] = patch
+
+    first = client.get("/owner/repo/pull/1.patch")
+    second = client.get("/owner/repo/pull/1.patch")
+
+    assert first.text == second.text == "diff ✓"
+    assert second.status_code == 200
+    assert client.not_modified == 1
+    assert "If-None-Match" not in server.seen[0][2]
+    assert server.seen[1][2]["If-None-Match"] == '"v1"'
+    assert server.seen[1][2]["Authorization"] == "token secret"
+
+
+def test_cache_is_keyed_by_token(client, server, tmp_path):
+    server.routes["/private"] = lambda handler: (200, {"ETag": '"v1"'}, b"private")
+    client.get("/private")
+
+    other = GitHubClient(token="other", api_url=server.url, cache_path=str(tmp_path / "cache"))
+    other.get("/private")
+
+    assert "If-None-Match" not in server.seen[1][2]
+
+
+def test_get_retries_server_errors_with_backoff(client, server):
+    server.routes["/flaky"] = [(502, {}, b"bad gateway"), (503, {}, b"unavailable"), (200, {}, b"ok")]
+
+    response = client.get("/flaky")
+
+    assert response.status_code == 200
+    assert len(client.sleeps) == 2
+    assert client.sleeps[1] > client.sleeps[0]
+
+
+def test_post_is_not_retried_on_server_errors(client, server):
+    server.routes["/repos/o/r/pulls"] = [(502, {}, b"bad gateway"), (201, {}, b"{}")]
+
+    assert client.post("repos/o/r/pulls", json={"title": "t"}).status_code == 502
+    assert len(server.seen) == 1
+
+
+def test_rate_limited_requests_wait_for_retry_after(client, server):
+    server.routes["/repos/o/r/pulls"] = [
+        (403, {"Retry-After": "3"}, b"You have exceeded a secondary rate limit"),
+        (201, {}, b'{"number": 1}'),
+    ]
+
+    response = client.post("repos/o/r/pulls", json={"title": "t"})
+
+    assert response.json() == {"number": 1}
+    assert client.sleeps == [3.0]
+
+
+def test_long_rate_limit_resets_raise(client, server):
+    server.routes["/limited"] = [(429, {"Retry-After": "3600"}, b"")]
+
+    with pytest.raises(GitHubError):
+        client.get("/limited")
+
+
+def test_plain_forbidden_is_returned(client, server):
+    server.routes["/forbidden"] = [(403, {}, b"Resource not accessible by integration")]
+
+    with pytest.raises(requests.HTTPError):
+        client.get("/forbidden").raise_for_status()
+    assert client.sleeps == []
@@ -0,0 +1,114 @@
+import os
+
+import pytest
+import requests
+
+from src.functions import pr_diff
+from src.functions.github_client import GitHubClient
+
+PR_URL = "https://github.com/owner/repo/pull/7"
+HEAD_1 = "1" * 40
+HEAD_2 = "2" * 40
+
+
+@pytest.fixture
+def github(server, tmp_path):
+    state = {"head": HEAD_1}
+
+    def pull(handler):
+        if handler.headers.get("Accept") == pr_diff.DIFF_MEDIA_TYPE:
+            return 200, {"Content-Type": "text/plain"}, f"diff --git a/x b/x\n+{state['head']}\n".encode()
+        etag = f'"{state["head"]}"'
+        if handler.headers.get("If-None-Match") == etag:
+            return 304, {"ETag": etag}, b""
+        body = f'{{"head": {{"sha": "{state["head"]}"}}}}'.encode()
+        return 200, {"ETag": etag, "Content-Type": "application/json"}, body
+
+    server.routes["/repos/owner/repo/pulls/7"] = pull
+    client = GitHubClient(token="secret", api_url=server.url, cache_path=str(tmp_path / "http"))
+    cache = pr_diff.PRDiffCache(str(tmp_path / "diffs"))
+    return client, cache, state
+
+
+def diff_requests(server):
+    return [seen for seen in server.seen if seen[2].get("Accept") == pr_diff.DIFF_MEDIA_TYPE]
+
+
+def test_diff_is_downloaded_once_per_head(github, server):
+    client, cache, state = github
+
+    first = pr_diff.fetch_pr_diff(PR_URL, client, cache)
+    second = pr_diff.fetch_pr_diff(PR_URL, client, cache)
+
+    assert not first.cached and second.cached
+    assert second.read() == f"diff --git a/x b/x\n+{HEAD_1}\n"
+    assert len(diff_requests(server)) == 1
+    # the head check after the download and the head lookup of the second run are revalidated
+    assert client.not_modified == 2
+
+
+def test_new_head_replaces_the_cached_diff(github, server):
+    client, cache, state = github
+    old = pr_diff.fetch_pr_diff(PR_URL, client, cache)
+
+    state["head"] = HEAD_2
+    new = pr_diff.fetch_pr_diff(PR_URL, client, cache)
+
+    assert new.head_sha == HEAD_2 and not new.cached
+    assert HEAD_2 in new.read()
+    assert not os.path.exists(old.path)
+    assert len(diff_requests(server)) == 2
+
+
+def test_failed_download_leaves_no_entry(github, server):
+    client, cache, state = github
+    server.routes["/repos/owner/repo/pulls/7"] = lambda handler: (
+        (404, {}, b"Not Found")
+        if handler.headers.get("Accept") == pr_diff.DIFF_MEDIA_TYPE
+        else (200, {}, f'{{"head": {{"sha": "{HEAD_1}"}}}}'.encode())
+    )
+
+    with pytest.raises(requests.HTTPError):
+        pr_diff.fetch_pr_diff(PR_URL, client, cache)
+
+    assert cache.get(pr_diff.PullRequestRef.from_url(PR_URL), HEAD_1) is None
+    assert [files for _, _, files in os.walk(cache.path) if files] == []
+
+
+def test_diff_is_streamed_from_the_cache(github, tmp_path):
+    client, cache, state = github
+
+    diff = pr_diff.fetch_pr_diff(PR_URL, client, cache)
+
+    assert list(diff.lines()) == ["diff --git a/x b/x\n", f"+{HEAD_1}\n"]
+    assert not diff.is_blank()
+    blank = tmp_path / "blank.diff"
+    blank.write_text(" \n\n")
+    assert pr_diff.PullRequestDiff(diff.pr, HEAD_1, str(blank), 3, cached=True).is_blank()
+
+
+def test_diff_of_a_head_pushed_during_the_download_is_not_cached(github, server):
+    client, cache, state = github
+    pull = server.routes["/repos/owner/repo/pulls/7"]
+
+    def push_during_download(handler):
+        response = pull(handler)
+        if handler.headers.get("Accept") == pr_diff.DIFF_MEDIA_TYPE:
+            state["head"] = HEAD_2
+        return response
+
+    server.routes["/repos/owner/repo/pulls/7"] = push_during_download
+
+    diff = pr_diff.fetch_pr_diff(PR_URL, client, cache)
+
+    assert diff.head_sha == HEAD_2 and HEAD_2 in diff.read()
+    assert cache.get(diff.pr, HEAD_1) is None
+    assert len(diff_requests(server)) == 2
+
+
+def test_lines_only_split_on_newlines(tmp_path):
+    path = tmp_path / "a.diff"
+    path.write_bytes(b'@@ -1 +1 @@\n-s = "a\rb"\n+s = "a\rc"\n')
+    diff = pr_diff.PullRequestDiff(pr_diff.PullRequestRef.from_url(PR_URL), HEAD_1, str(path), 0, cached=True)
+
+    assert list(diff.lines()) == ["@@ -1 +1 @@\n", '-s = "a\rb"\n', '+s = "a\rc"\n']
@@ -0,0 +1,81 @@
+from src.rag.chunking import chunk_markdown, estimate_tokens
+
+
+DOC = """---
+title: Example
+---
+
+# Getting started
+
+Intro paragraph.
+
+## Install
+
+Run the installer.
+
+```bash
+# not a heading
+npm install
+```
+
+## Configure
+
+Edit the config file.
+
+### Advanced
+
+Tune it.
+"""
+
+
+def test_chunks_follow_headings_and_ignore_code_comments():
+    chunks = chunk_markdown("docs/example.md", DOC)
+
+    assert [c.heading_path for c in chunks] == [
+        [],
+        ["Getting started"],
+        ["Getting started", "Install"],
+        ["Getting started", "Configure"],
+        ["Getting started", "Configure", "Advanced"],
+    ]
+    install = chunks[2]
+    assert "# not a heading" in install.content
+    assert install.metadata()["heading_path"] == "Getting started > Install"
+    assert install.id == "docs/example.md#2"
+
+
+def test_chunks_cover_document_with_exact_offsets():
+    chunks = chunk_markdown("docs/example.md", DOC)
+    lines = DOC.splitlines(keepends=True)
+    encoded = DOC.encode("utf-8")
+
+    for chunk in chunks:
+        assert chunk.content == "".join(lines[chunk.start_line - 1 : chunk.end_line])
+        assert encoded[chunk.start_byte : chunk.end_byte].decode("utf-8") == chunk.content
+    assert "".join(c.content for c in chunks) == DOC
+
+
+def test_large_sections_respect_budget_and_overlap():
+    paragraphs = [f"Paragraph {i} " + "word " * 40 for i in range(20)]
+    doc = "# Big\n\n" + "\n\n".join(paragraphs) + "\n"
+
+    chunks = chunk_markdown("docs/big.md", doc, max_tokens=120, overlap_tokens=60)
+
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert estimate_tokens(chunk.content) <= 120
+        assert chunk.heading_path == ["Big"]
+    # consecutive chunks share the overlapping paragraph
+    assert chunks[1].start_line < chunks[0].end_line
+
+
+def test_fenced_code_block_is_not_split_when_it_fits():
+    code = "```python\n" + "".join(f"print({i})\n" for i in range(10)) + "```\n"
+    doc = "# Code\n\n" + "text " * 30 + "\n\n" + code
+    chunks = chunk_markdown("docs/code.md", doc, max_tokens=50, overlap_tokens=0)
+
+    assert any(c.content.startswith("```python") and c.content.rstrip().endswith("```") for c in chunks)
+
+
+def test_empty_document():
+    assert chunk_markdown("docs/empty.md", "") == []
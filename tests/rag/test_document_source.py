@@ -0,0 +1,82 @@
+import subprocess
+
+import pytest
+
+from src.rag import document_source
+
+
+def git(*args, cwd):
+    return subprocess.run(
+        ["git", "-c", "user.name=t", "-c", "user.email=t@t", *args],
+        cwd=cwd,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout.strip()
+
+
+@pytest.fixture
+def repo(tmp_path):
+    repo = tmp_path / "repo"
+    (repo / "docs" / "guides").mkdir(parents=True)
+    (repo / "docs" / "node_modules" / "pkg").mkdir(parents=True)
+    git("init", "-b", "main", cwd=repo)
+    (repo / ".gitignore").write_text("node_modules/\n")
+    (repo / "README.md").write_text("# Outside the docs\n")
+    (repo / "docs" / "index.md").write_text("# Docs\n")
+    (repo / "docs" / "guides" / "setup.mdx").write_text("# Setup ✓\n")
+    (repo / "docs" / "logo.png").write_bytes(b"\x89PNG")
+    (repo / "docs" / "latin1.md").write_bytes("# Caf\xe9\n".encode("latin-1"))
+    (repo / "docs" / "node_modules" / "pkg" / "README.md").write_text("# Ignored\n")
+    git("add", ".", cwd=repo)
+    git("commit", "-m", "docs", cwd=repo)
+    (repo / "docs" / "untracked.md").write_text("# Untracked\n")
+    return repo
+
+
+def test_lists_tracked_documents_with_blob_shas(repo):
+    files = document_source.list_files(str(repo), "docs")
+
+    assert [f.path for f in files] == ["docs/guides/setup.mdx", "docs/index.md", "docs/latin1.md"]
+    assert files[1].blob_sha == git("rev-parse", "HEAD:docs/index.md", cwd=repo)
+
+
+def test_reads_documents_from_the_object_store(repo):
+    documents = list(document_source.iter_documents(str(repo), "docs"))
+
+    assert [d.content for d in documents] == ["# Setup ✓\n", "# Docs\n", "# Caf�\n"]
+
+
+def test_blob_sha_changes_with_content(repo):
+    before = {f.path: f.blob_sha for f in document_source.list_files(str(repo), "docs")}
+    (repo / "docs" / "index.md").write_text("# Docs, updated\n")
+    git("add", "docs/index.md", cwd=repo)
+
+    after = {f.path: f.blob_sha for f in document_source.list_files(str(repo), "docs")}
+
+    assert after["docs/index.md"] != before["docs/index.md"]
+    assert after["docs/guides/setup.mdx"] == before["docs/guides/setup.mdx"]
+
+
+def test_lists_files_of_a_commit(repo):
+    git("rm", "-q", "docs/index.md", cwd=repo)
+
+    at_head = document_source.list_files(str(repo), "docs", ref="HEAD")
+    staged = document_source.list_files(str(repo), "docs")
+
+    assert "docs/index.md" in [f.path for f in at_head]
+    assert "docs/index.md" not in [f.path for f in staged]
+
+
+def test_reader_stops_git_when_closed_early(repo):
+    documents = document_source.iter_documents(str(repo), "docs")
+    next(documents)
+
+    documents.close()
+
+
+def test_missing_blob_raises(repo):
+    missing = document_source.SourceFile(path="docs/gone.md", blob_sha="0" * 40)
+
+    with pytest.raises(ValueError):
+        list(document_source.read_documents(str(repo), [missing]))
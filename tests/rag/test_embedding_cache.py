@@ -0,0 +1,50 @@
+from src.rag.embedding_cache import CachedEmbeddings, EmbeddingCache
+from src.rag.embedding_pipeline import FakeEmbeddings
+
+
+def test_second_run_makes_no_embedding_calls(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    fake = FakeEmbeddings(size=8)
+
+    first = CachedEmbeddings(fake, EmbeddingCache(path))
+    vectors = first.embed_documents(["a", "b", "a"])
+    query = first.embed_query("diff")
+    calls = fake.calls
+
+    second = CachedEmbeddings(fake, EmbeddingCache(path))
+    assert second.embed_documents(["a", "b", "a"]) == vectors
+    assert second.embed_query("diff") == query
+    assert fake.calls == calls
+    assert second.cache.stats() == {"hits": 4, "misses": 0, "evictions": 0}
+
+
+def test_documents_and_queries_are_cached_separately():
+    fake = FakeEmbeddings(size=8)
+    embeddings = CachedEmbeddings(fake, EmbeddingCache(":memory:"))
+
+    embeddings.embed_documents(["same text"])
+    embeddings.embed_query("same text")
+
+    assert embeddings.cache.misses == 2
+    assert len(embeddings.cache) == 2
+
+
+def test_evicts_least_recently_used_entries():
+    cache = EmbeddingCache(":memory:", max_entries=2)
+    cache.put_many("model", ["a"], [[1.0]])
+    cache.put_many("model", ["b"], [[2.0]])
+    # touch "a" so that "b" becomes the least recently used entry
+    assert cache.get_many("model", ["a"]) == [[1.0]]
+    cache.put_many("model", ["c"], [[3.0]])
+
+    assert len(cache) == 2
+    assert cache.get_many("model", ["a", "b", "c"]) == [[1.0], None, [3.0]]
+    assert cache.evictions == 1
+
+
+def test_entries_are_keyed_by_model():
+    cache = EmbeddingCache(":memory:")
+    cache.put_many("model-a", ["text"], [[1.0, 2.0]])
+
+    assert cache.get_many("model-b", ["text"]) == [None]
+    assert cache.get_many("model-a", ["text"]) == [[1.0, 2.0]]
@@ -0,0 +1,72 @@
+import pytest
+from src.rag.embedding_pipeline import (
+    BatchEmbeddings,
+    FakeEmbeddings,
+    FakeRateLimitError,
+    TokenBucket,
+    is_retryable_error,
+)
+
+
+def test_batches_preserve_order_across_workers():
+    fake = FakeEmbeddings(size=8)
+    embedder = BatchEmbeddings(fake, batch_size=3, max_workers=4)
+    texts = [f"text {i}" for i in range(10)]
+
+    vectors = embedder.embed_documents(texts)
+
+    assert vectors == fake.embed_documents(texts)
+    assert embedder.stats.requests == 4
+    assert embedder.stats.texts == 10
+    assert embedder.stats.tokens > 0
+
+
+def test_retries_rate_limited_requests_with_backoff():
+    sleeps = []
+    embedder = BatchEmbeddings(
+        FakeEmbeddings(size=4, rate_limit_every=3), batch_size=1, max_workers=1, sleep=sleeps.append
+    )
+
+    vectors = embedder.embed_documents(["a", "b", "c"])
+
+    assert len(vectors) == 3
+    assert embedder.stats.retries == 1
+    assert len(sleeps) == 1
+
+
+def test_gives_up_after_max_retries():
+    embedder = BatchEmbeddings(
+        FakeEmbeddings(size=4, rate_limit_every=1), max_retries=2, sleep=lambda _: None
+    )
+    with pytest.raises(FakeRateLimitError):
+        embedder.embed_query("a")
+    assert embedder.stats.retries == 2
+
+
+def test_non_retryable_errors_are_raised_immediately():
+    class Broken(FakeEmbeddings):
+        def embed_documents(self, texts):
+            raise ValueError("invalid argument")
+
+    embedder = BatchEmbeddings(Broken(size=4), sleep=lambda _: pytest.fail("should not retry"))
+    with pytest.raises(ValueError):
+        embedder.embed_documents(["a"])
+
+
+def test_is_retryable_error():
+    assert is_retryable_error(FakeRateLimitError())
+    assert is_retryable_error(Exception("Error embedding content: 503 Service Unavailable"))
+    assert not is_retryable_error(ValueError("bad request"))
+
+
+def test_token_bucket_waits_when_empty():
+    now = [0.0]
+
+    def sleep(seconds):
+        now[0] += seconds
+
+    bucket = TokenBucket(rate=2.0, capacity=1.0, clock=lambda: now[0], sleep=sleep)
+
+    assert bucket.acquire() == 0.0
+    assert bucket.acquire() == pytest.approx(0.5)
+    assert now[0] == pytest.approx(0.5)
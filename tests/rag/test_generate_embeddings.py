@@ -0,0 +1,52 @@
+from src.rag import generate_embeddings, rag
+from src.rag.document_source import SourceDocument
+from src.rag.index_manifest import IndexManifest
+
+
+class FakeEmbeddings:
+    def __init__(self, read=()):
+        self.read = read
+        # (chunks embedded, documents read so far) per call
+        self.calls = []
+
+    def embed_documents(self, texts):
+        self.calls.append((len(texts), len(self.read)))
+        return [[float(len(text)), 1.0] for text in texts]
+
+
+def documents(read):
+    for i in range(5):
+        read.append(i)
+        yield SourceDocument(path=f"docs/{i}.md", blob_sha=f"{i}" * 40, content=f"# Page {i}\n\nText of page {i}.\n")
+
+
+def test_documents_are_embedded_in_batches_as_they_stream(monkeypatch):
+    read = []
+    embeddings = FakeEmbeddings(read)
+    monkeypatch.setattr(rag, "get_embeddings", lambda: embeddings)
+    manifest = IndexManifest()
+
+    texts, metadatas, ids, vectors = generate_embeddings.embed_documents(documents(read), manifest, batch_size=2)
+
+    assert embeddings.calls == [(2, 2), (2, 4), (1, 5)]
+    assert vectors.shape == (5, 2) and len(texts) == len(metadatas) == len(ids) == 5
+    assert manifest.entries["docs/3.md"].content_hash == "3" * 40
+
+
+def test_no_documents_give_no_vectors(monkeypatch):
+    monkeypatch.setattr(rag, "get_embeddings", lambda: FakeEmbeddings())
+
+    texts, _, _, vectors = generate_embeddings.embed_documents([], IndexManifest())
+
+    assert texts == [] and vectors.shape == (0, 0)
+
+
+def test_index_of_another_model_or_dtype_is_rebuilt(monkeypatch, tmp_path):
+    monkeypatch.setattr(rag, "VECTORDB_DATA_PATH", str(tmp_path))
+    IndexManifest(embeddings_model=rag.EMBEDDINGS_MODEL, dtype="float32").save(str(tmp_path))
+
+    assert generate_embeddings.load_manifest("float32") is not None
+    assert generate_embeddings.load_manifest("float16") is None
+
+    monkeypatch.setattr(rag, "EMBEDDINGS_MODEL", "models/text-embedding-004")
+    assert generate_embeddings.load_manifest("float32") is None
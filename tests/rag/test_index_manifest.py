@@ -0,0 +1,51 @@
+from src.rag.index_manifest import IndexManifest, ManifestEntry, content_hash
+
+
+def test_diff_detects_added_modified_removed_and_unchanged():
+    manifest = IndexManifest(
+        {
+            "docs/unchanged.md": ManifestEntry(content_hash=content_hash("same"), ids=["docs/unchanged.md"]),
+            "docs/modified.md": ManifestEntry(content_hash=content_hash("old"), ids=["docs/modified.md"]),
+            "docs/removed.md": ManifestEntry(content_hash=content_hash("gone"), ids=["docs/removed.md"]),
+        }
+    )
+    hashes = {
+        "docs/unchanged.md": content_hash("same"),
+        "docs/modified.md": content_hash("new"),
+        "docs/added.md": content_hash("added"),
+    }
+
+    diff = manifest.diff(hashes)
+
+    assert diff.added == ["docs/added.md"]
+    assert diff.modified == ["docs/modified.md"]
+    assert diff.removed == ["docs/removed.md"]
+    assert diff.unchanged == ["docs/unchanged.md"]
+    assert diff.has_changes()
+    assert sorted(manifest.stale_ids(diff)) == ["docs/modified.md", "docs/removed.md"]
+
+
+def test_diff_without_changes():
+    manifest = IndexManifest({"docs/a.md": ManifestEntry(content_hash=content_hash("a"), ids=["docs/a.md"])})
+    diff = manifest.diff({"docs/a.md": content_hash("a")})
+    assert not diff.has_changes()
+    assert manifest.stale_ids(diff) == []
+
+
+def test_save_and_load_roundtrip(tmp_path):
+    manifest = IndexManifest(
+        {"docs/a.md": ManifestEntry(content_hash=content_hash("a"), ids=["docs/a.md#0"])},
+        embeddings_model="models/embedding-001",
+        dtype="float16",
+    )
+    manifest.save(str(tmp_path))
+
+    loaded = IndexManifest.load(str(tmp_path))
+
+    assert loaded is not None
+    assert loaded.entries == manifest.entries
+    assert (loaded.embeddings_model, loaded.dtype) == ("models/embedding-001", "float16")
+
+
+def test_load_missing_manifest(tmp_path):
+    assert IndexManifest.load(str(tmp_path)) is None
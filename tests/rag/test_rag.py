@@ -0,0 +1,13 @@
+import pytest
+from src.rag import rag
+
+
+def test_import_does_not_load_anything():
+    assert rag.load_stats()["vectordb_loaded"] is False
+
+
+def test_embeddings_require_api_key_on_first_use(monkeypatch):
+    monkeypatch.delenv("GEMINI_API_KEY", raising=False)
+    monkeypatch.setattr(rag, "_embeddings_client", None)
+    with pytest.raises(ValueError, match="GEMINI_API_KEY"):
+        rag.get_embeddings_client()
@@ -0,0 +1,17 @@
+import numpy as np
+from src.rag.rerank import mmr
+
+
+def test_mmr_with_lambda_one_ranks_by_relevance():
+    candidates = np.array([[0.0, 1.0], [1.0, 0.0], [0.7, 0.7]])
+    assert mmr(np.array([1.0, 0.0]), candidates, k=3, lambda_mult=1.0) == [1, 2, 0]
+
+
+def test_mmr_prefers_diverse_candidates():
+    candidates = np.array([[1.0, 0.0], [0.99, 0.01], [0.6, 0.8]])
+    assert mmr(np.array([1.0, 0.0]), candidates, k=2, lambda_mult=0.3) == [0, 2]
+
+
+def test_mmr_with_fewer_candidates_than_k():
+    assert mmr(np.array([1.0, 0.0]), np.array([[1.0, 0.0]]), k=5) == [0]
+    assert mmr(np.array([1.0, 0.0]), np.zeros((0, 2)), k=5) == []
@@ -0,0 +1,118 @@
+import asyncio
+
+import numpy as np
+from src.rag import retrieval
+from src.rag.embedding_pipeline import FakeEmbeddings
+from src.rag.vector_index import IndexedChunk, VectorIndex
+
+
+class CountingEmbeddings(FakeEmbeddings):
+    def __init__(self):
+        super().__init__(size=16)
+        self.query_batches = []
+
+    def embed_queries(self, texts):
+        self.query_batches.append(list(texts))
+        return self.embed_documents(texts)
+
+
+def build_index(path, embeddings, texts):
+    ids = [f"doc{i}.md#0" for i in range(len(texts))]
+    metadatas = [{"file_name": f"doc{i}.md"} for i in range(len(texts))]
+    VectorIndex.write(str(path), ids, texts, metadatas, np.asarray(embeddings.embed_documents(texts)))
+    return VectorIndex.load(str(path))
+
+
+def test_search_embeds_all_queries_in_one_batch(tmp_path):
+    embeddings = CountingEmbeddings()
+    texts = ["alpha", "beta", "gamma"]
+    index = build_index(tmp_path / "index", embeddings, texts)
+
+    results = retrieval.search(index, embeddings, [("a.ts", "alpha"), ("g.ts", "gamma")], k=2)
+
+    assert embeddings.query_batches == [["alpha", "gamma"]]
+    assert results["a.ts"][0].chunk.page_content == "alpha"
+    assert results["a.ts"][0].distance < results["a.ts"][1].distance
+    assert results["g.ts"][0].chunk.metadata["file_name"] == "doc2.md"
+
+
+def test_search_async_matches_sync(tmp_path):
+    embeddings = FakeEmbeddings(size=16)
+    index = build_index(tmp_path / "index", embeddings, ["alpha", "beta"])
+    queries = [("a.ts", "alpha")]
+
+    assert asyncio.run(retrieval.search_async(index, embeddings, queries, k=1)) == retrieval.search(
+        index, embeddings, queries, k=1
+    )
+
+
+def test_search_without_queries(tmp_path):
+    embeddings = FakeEmbeddings(size=16)
+    index = build_index(tmp_path / "index", embeddings, ["alpha"])
+    assert retrieval.search(index, embeddings, [], k=3) == {}
+
+
+def test_search_drops_hits_above_max_distance(tmp_path):
+    embeddings = FakeEmbeddings(size=16)
+    index = build_index(tmp_path / "index", embeddings, ["alpha", "beta", "gamma"])
+
+    results = retrieval.search(index, embeddings, [("a.ts", "alpha"), ("x.ts", "unrelated")], k=3, max_distance=1e-6)
+
+    assert [hit.chunk.page_content for hit in results["a.ts"]] == ["alpha"]
+    assert "x.ts" not in results
+
+
+class VectorEmbeddings:
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+    def embed_query(self, text):
+        return self.vectors[text]
+
+
+def test_search_mmr_skips_near_duplicates(tmp_path):
+    vectors = {"query": [1.0, 0.0, 0.0], "a": [0.9, 0.1, 0.0], "a2": [0.9, 0.11, 0.0], "b": [0.7, 0.0, 0.7]}
+    texts = ["a", "a2", "b"]
+    ids = [f"{text}.md#0" for text in texts]
+    metadatas = [{"file_name": f"{text}.md"} for text in texts]
+    VectorIndex.write(str(tmp_path / "index"), ids, texts, metadatas, np.asarray([vectors[t] for t in texts]))
+    index = VectorIndex.load(str(tmp_path / "index"))
+    embeddings = VectorEmbeddings(vectors)
+
+    nearest = retrieval.search(index, embeddings, [("q", "query")], k=2)
+    reranked = retrieval.search(index, embeddings, [("q", "query")], k=2, mmr_lambda=0.5)
+
+    assert [hit.chunk.page_content for hit in nearest["q"]] == ["a", "a2"]
+    assert [hit.chunk.page_content for hit in reranked["q"]] == ["a", "b"]
+
+
+def hit(chunk_id, distance):
+    file_name = chunk_id.split("#")[0]
+    chunk = IndexedChunk(row=0, id=chunk_id, page_content=chunk_id, metadata={"file_name": file_name})
+    return retrieval.RetrievalHit(chunk=chunk, distance=distance)
+
+
+def test_deduplicate_keeps_chunk_under_closest_query():
+    results = {
+        "a.ts": [hit("config.md#0", 0.3), hit("install.md#0", 0.5)],
+        "b.ts": [hit("config.md#0", 0.1)],
+        "c.ts": [hit("install.md#0", 0.6)],
+    }
+
+    deduplicated = retrieval.deduplicate(results)
+
+    assert deduplicated == {"a.ts": [hit("install.md#0", 0.5)], "b.ts": [hit("config.md#0", 0.1)]}
+
+
+def test_deduplicate_limits_chunks_per_file():
+    results = {
+        "a.ts": [hit("config.md#0", 0.3), hit("config.md#1", 0.2), hit("install.md#0", 0.5)],
+        "b.ts": [hit("config.md#2", 0.1)],
+    }
+
+    deduplicated = retrieval.deduplicate(results, max_chunks_per_file=2)
+
+    assert deduplicated == {
+        "a.ts": [hit("config.md#1", 0.2), hit("install.md#0", 0.5)],
+        "b.ts": [hit("config.md#2", 0.1)],
+    }
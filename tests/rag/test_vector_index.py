@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+from src.rag.vector_index import VectorIndex, replace_directory
+
+
+def write_index(path, vectors, dtype="float32"):
+    ids = [f"doc.md#{i}" for i in range(len(vectors))]
+    contents = [f"chunk {i}" for i in range(len(vectors))]
+    metadatas = [{"file_name": "doc.md", "chunk_index": i} for i in range(len(vectors))]
+    VectorIndex.write(str(path), ids, contents, metadatas, np.asarray(vectors), dtype=dtype)
+    return VectorIndex.load(str(path))
+
+
+def test_search_matches_brute_force_l2(tmp_path):
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((50, 8)).astype(np.float32)
+    queries = rng.standard_normal((3, 8)).astype(np.float32)
+    index = write_index(tmp_path / "index", vectors)
+
+    results = index.search(queries, k=5)
+
+    for query, hits in zip(queries, results):
+        expected = np.argsort(((vectors - query) ** 2).sum(axis=1))[:5]
+        assert [chunk.row for chunk, _ in hits] == expected.tolist()
+        assert hits[0][1] == pytest.approx(float(((vectors[expected[0]] - query) ** 2).sum()), rel=1e-4)
+        assert hits[0][0].page_content == f"chunk {expected[0]}"
+        assert hits[0][0].metadata["file_name"] == "doc.md"
+
+
+def test_vectors_are_memory_mapped(tmp_path):
+    index = write_index(tmp_path / "index", np.eye(4))
+    assert isinstance(index.vectors, np.memmap)
+    assert len(index) == 4
+    assert index.dim == 4
+
+
+def test_float16_index(tmp_path):
+    index = write_index(tmp_path / "index", np.eye(4), dtype="float16")
+    hits = index.search(np.asarray([[0.0, 0.0, 1.0, 0.0]]), k=1)[0]
+    assert hits[0][0].id == "doc.md#2"
+    assert hits[0][1] == pytest.approx(0.0)
+
+
+def test_k_larger_than_index(tmp_path):
+    index = write_index(tmp_path / "index", np.eye(2))
+    assert len(index.search(np.asarray([[1.0, 0.0]]), k=10)[0]) == 2
+
+
+def test_export_excludes_ids(tmp_path):
+    index = write_index(tmp_path / "index", np.eye(3))
+    ids, contents, metadatas, vectors = index.export(exclude_ids={"doc.md#1"})
+    assert ids == ["doc.md#0", "doc.md#2"]
+    assert contents == ["chunk 0", "chunk 2"]
+    assert vectors.tolist() == [[1.0, 0.0, 0.0], [0.0, 0.0, 1.0]]
+
+
+def test_empty_index(tmp_path):
+    VectorIndex.write(str(tmp_path / "index"), [], [], [], np.zeros((0, 4)))
+    index = VectorIndex.load(str(tmp_path / "index"))
+    assert len(index) == 0
+    assert index.search(np.zeros((1, 4)), k=3) == [[]]
+
+
+def test_load_missing_index(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        VectorIndex.load(str(tmp_path / "missing"))
+
+
+def test_replace_directory(tmp_path):
+    old = write_index(tmp_path / "index", np.eye(2))
+    write_index(tmp_path / "index.tmp", np.eye(3))
+
+    replace_directory(str(tmp_path / "index.tmp"), str(tmp_path / "index"))
+
+    assert len(VectorIndex.load(str(tmp_path / "index"))) == 3
+    # the old mapping stays readable
+    assert old.vectors.shape == (2, 2)
+    assert not (tmp_path / "index.tmp").exists()
+
+
+def test_fingerprint_follows_the_manifest(tmp_path):
+    write_index(tmp_path / "index", np.eye(2, dtype=np.float32))
+    (tmp_path / "index" / "manifest.json").write_text('{"files": {"a.md": "1"}}')
+    first = VectorIndex.load(str(tmp_path / "index")).fingerprint()
+    assert VectorIndex.load(str(tmp_path / "index")).fingerprint() == first
+
+    (tmp_path / "index" / "manifest.json").write_text('{"files": {"a.md": "2"}}')
+    assert VectorIndex.load(str(tmp_path / "index")).fingerprint() != first
@@ -0,0 +1,103 @@
+import asyncio
+import os
+import subprocess
+
+import pytest
+
+# the agents are created at import time and need a key, no request is made in these tests
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("ANTHROPIC_API_KEY", "test")
+
+from src import batch  # noqa: E402
+from src.functions import git_worktree  # noqa: E402
+from src.metrics import RunMetrics  # noqa: E402
+
+
+def git(*args, cwd):
+    subprocess.run(["git", "-c", "user.name=t", "-c", "user.email=t@t", *args], cwd=cwd, check=True, capture_output=True)
+
+
+@pytest.fixture
+def docs_clone(tmp_path, monkeypatch):
+    repo = tmp_path / "docs"
+    repo.mkdir()
+    git("init", "-b", "main", cwd=repo)
+    (repo / "index.md").write_text("# Docs\n")
+    git("add", ".", cwd=repo)
+    git("commit", "-m", "docs", cwd=repo)
+    monkeypatch.setattr(git_worktree, "WORKTREES_PATH", str(tmp_path / "worktrees"))
+    monkeypatch.setattr(git_worktree, "sync_mirror", lambda url: str(repo))
+    monkeypatch.setattr(batch.docs_search_agent, "deps", lambda: "deps")
+    return repo
+
+
+def test_worktree_is_isolated_and_removed(docs_clone):
+    with git_worktree.worktree(str(docs_clone)) as path:
+        (docs_clone / "index.md").write_text("changed in the clone\n")
+        assert open(os.path.join(path, "index.md")).read() == "# Docs\n"
+    assert not os.path.exists(path)
+    worktrees = subprocess.run(["git", "worktree", "list"], cwd=docs_clone, capture_output=True, text=True).stdout
+    assert len(worktrees.splitlines()) == 1
+
+
+def test_batch_runs_each_pr_in_its_own_worktree_with_bounded_concurrency(docs_clone, monkeypatch):
+    running = 0
+    max_running = 0
+    calls = []
+
+    async def fake_lapo_async(docs_repo, docs_path, pr_url, repository_path, search_deps, **kwargs):
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        calls.append((pr_url, repository_path, search_deps, os.path.exists(os.path.join(repository_path, "index.md"))))
+        await asyncio.sleep(0.05)
+        running -= 1
+        if pr_url.endswith("/3"):
+            raise ValueError("boom")
+        return RunMetrics()
+
+    monkeypatch.setattr(batch, "lapo_async", fake_lapo_async)
+    urls = [f"https://github.com/owner/repo/pull/{n}" for n in range(1, 6)]
+
+    results = asyncio.run(batch.lapo_batch("owner/docs", "docs", urls, concurrency=2))
+
+    assert max_running == 2
+    assert sorted(call[0] for call in calls) == urls
+    assert len({call[1] for call in calls}) == len(urls)
+    assert all(call[2] == "deps" and call[3] for call in calls)
+    assert all(not os.path.exists(call[1]) for call in calls)
+    by_url = {result.pr_url: result for result in results}
+    assert by_url[urls[2]].status == "error" and "boom" in by_url[urls[2]].error
+    assert [by_url[url].status for url in urls if url != urls[2]] == ["ok"] * 4
+
+
+def test_batch_syncs_the_mirror_again_between_prs(docs_clone, monkeypatch):
+    synced = []
+
+    def sync_mirror(url):
+        synced.append(url)
+        return str(docs_clone)
+
+    async def fake_lapo_async(*args, **kwargs):
+        return RunMetrics()
+
+    monkeypatch.setattr(git_worktree, "sync_mirror", sync_mirror)
+    monkeypatch.setattr(batch, "lapo_async", fake_lapo_async)
+    urls = [f"https://github.com/owner/repo/pull/{n}" for n in range(1, 4)]
+
+    asyncio.run(batch.lapo_batch("owner/docs", "docs", urls, concurrency=1))
+    assert len(synced) == 1
+
+    asyncio.run(batch.lapo_batch("owner/docs", "docs", urls, concurrency=1, mirror_sync_interval=0))
+    assert len(synced) == 1 + 1 + len(urls)
+
+
+def test_read_lines_skips_blank_lines(tmp_path):
+    path = tmp_path / "prs.txt"
+    path.write_text("https://github.com/o/r/pull/1\n\n  https://github.com/o/r/pull/2  \n")
+
+    async def collect():
+        with open(path) as f:
+            return [line async for line in batch.read_lines(f)]
+
+    assert asyncio.run(collect()) == ["https://github.com/o/r/pull/1", "https://github.com/o/r/pull/2"]
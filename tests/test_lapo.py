@@ -0,0 +1,211 @@
+import asyncio
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+
+# the agents are created at import time and need a key, no request is made in these tests
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("ANTHROPIC_API_KEY", "test")
+
+from src import lapo as lapo_module  # noqa: E402
+from src.agents.docs_search_agent import Changes, RelatedDocumentationChunk  # noqa: E402
+from src.agents.generate_patch_agent import PullRequestContent  # noqa: E402
+from src.metrics import Budget, BudgetExceededError, StageMetrics  # noqa: E402
+
+DELAY = 0.3
+HEAD_SHA = "a" * 40
+DEPS = SimpleNamespace(vectordb=SimpleNamespace(fingerprint=lambda: "index-v1"))
+
+
+def fake_diff(text):
+    return SimpleNamespace(
+        head_sha=HEAD_SHA, read=lambda: text, lines=lambda: iter(text.splitlines(True)), is_blank=lambda: not text.strip()
+    )
+
+
+def slow(value):
+    def stage(*args, **kwargs):
+        time.sleep(DELAY)
+        return value
+
+    return stage
+
+
+class FakeAgent:
+    model = "test"
+
+    def __init__(self, data):
+        self.data = data
+        self.calls = []
+
+    async def run(self, prompt, **kwargs):
+        self.calls.append((prompt, kwargs))
+        return SimpleNamespace(data=self.data, all_messages=lambda: [])
+
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    removed = []
+    monkeypatch.setattr(lapo_module.git_worktree, "sync_mirror", slow("/tmp/mirror.git"))
+    monkeypatch.setattr(lapo_module.git_worktree, "add_worktree", lambda mirror, ref, sparse_paths: "/tmp/docs")
+    monkeypatch.setattr(lapo_module.git_worktree, "remove_worktree", lambda mirror, path: removed.append(path))
+    monkeypatch.setattr(lapo_module.git_pr, "get_pr_diff", slow(fake_diff("diff --git a/x b/x\n+x\n")))
+    monkeypatch.setattr(lapo_module.git_pr, "rev_parse", lambda path, ref: "d" * 40)
+    monkeypatch.setattr(lapo_module.docs_search_agent, "deps", slow(DEPS))
+    monkeypatch.setattr(lapo_module.docs_search_agent, "file_changes_from_diff", lambda diff_hunk: [])
+    monkeypatch.setattr(lapo_module, "rprint", lambda *args: None)
+    return removed
+
+
+def test_independent_stages_overlap_and_are_streamed(pipeline):
+    events = []
+
+    def on_stage(stage: StageMetrics):
+        events.append((stage.name, stage.status))
+
+    st = time.monotonic()
+    lapo_module.lapo(
+        "owner/docs", "docs", "https://github.com/owner/repo/pull/1", on_stage=on_stage, ledger_path=None
+    )
+    elapsed = time.monotonic() - st
+
+    # clone, diff fetch and index load would take 3 * DELAY in sequence
+    assert elapsed < 2 * DELAY
+    assert sorted(events[:3]) == [("clone", "ok"), ("diff_fetch", "ok"), ("index_load", "ok")]
+    assert events[3:] == [("retrieval", "ok"), ("search_agent", "ok")]
+    # the worktree is removed even though the run stopped before the patch agent
+    assert pipeline == ["/tmp/docs"]
+
+
+def test_clone_over_budget_removes_its_worktree_and_fails_the_run(pipeline, monkeypatch):
+    # the run returns early on an empty diff without awaiting the clone
+    monkeypatch.setattr(lapo_module.git_pr, "get_pr_diff", lambda url: fake_diff("\n"))
+
+    with pytest.raises(BudgetExceededError):
+        lapo_module.lapo(
+            "owner/docs",
+            "docs",
+            "https://github.com/owner/repo/pull/1",
+            budget=Budget(max_seconds=DELAY / 3),
+            ledger_path=None,
+        )
+
+    assert pipeline == ["/tmp/docs"]
+
+
+def test_wall_time_budget_cancels_the_running_stage(pipeline, monkeypatch):
+    class HangingAgent(FakeAgent):
+        async def run(self, prompt, **kwargs):
+            await asyncio.sleep(10 * DELAY)
+
+    monkeypatch.setattr(lapo_module.docs_search_agent, "agent", HangingAgent(None))
+    events = []
+
+    st = time.monotonic()
+    with pytest.raises(BudgetExceededError):
+        lapo_module.lapo(
+            "owner/docs",
+            "docs",
+            "https://github.com/owner/repo/pull/1",
+            retrieval_mode="agent",
+            budget=Budget(max_seconds=2 * DELAY),
+            on_stage=lambda stage: events.append((stage.name, stage.status)),
+            ledger_path=None,
+        )
+
+    assert time.monotonic() - st < 4 * DELAY
+    assert events[-1] == ("search_agent", "cancelled")
+    assert pipeline == ["/tmp/docs"]
+
+
+def test_patch_agent_waits_for_the_clone(pipeline, monkeypatch):
+    chunk = RelatedDocumentationChunk(file_name="docs/a.md", chunk_content="Timeout", distance=0.1, diff="+x")
+    search_agent = FakeAgent([Changes(original_documentation_chunk=chunk, changes_description="rename")])
+    patch_agent = FakeAgent(PullRequestContent(reasoning="r", title="t", patch_diff="docs/a.md"))
+    monkeypatch.setattr(lapo_module.docs_search_agent, "agent", search_agent)
+    monkeypatch.setattr(lapo_module.generate_patch_agent, "generate_patch_agent", patch_agent)
+    monkeypatch.setattr(lapo_module, "generate_git_patch_from_search_replace", lambda path, patch: "git patch")
+    created = []
+    monkeypatch.setattr(
+        lapo_module.create_pr_from_patch, "create_pr_from_patch", lambda **kwargs: created.append(kwargs)
+    )
+
+    lapo_module.lapo(
+        "owner/docs", "docs", "https://github.com/owner/repo/pull/1", retrieval_mode="agent", ledger_path=None
+    )
+
+    assert search_agent.calls[0][1]["deps"] is DEPS
+    assert patch_agent.calls[0][1]["deps"].docs_repo_path == "/tmp/docs"
+    assert created[0]["patch"] == "git patch"
+    assert created[0]["repo_path"] == "/tmp/docs"
+    assert created[0]["update_base"] is False
+    assert pipeline == ["/tmp/docs"]
+
+
+def test_ledger_replays_a_finished_run(pipeline, monkeypatch, tmp_path):
+    chunk = RelatedDocumentationChunk(file_name="docs/a.md", chunk_content="Timeout", distance=0.1, diff="+x")
+    search_agent = FakeAgent([Changes(original_documentation_chunk=chunk, changes_description="rename")])
+    patch_agent = FakeAgent(PullRequestContent(reasoning="r", title="t", patch_diff="docs/a.md"))
+    monkeypatch.setattr(lapo_module.docs_search_agent, "agent", search_agent)
+    monkeypatch.setattr(lapo_module.generate_patch_agent, "generate_patch_agent", patch_agent)
+    monkeypatch.setattr(lapo_module, "generate_git_patch_from_search_replace", lambda path, patch: "git patch")
+    created = []
+
+    def create_pr(**kwargs):
+        created.append(kwargs)
+        return {"status": "success", "pr_url": f"https://github.com/owner/docs/pull/{len(created)}"}
+
+    monkeypatch.setattr(lapo_module.create_pr_from_patch, "create_pr_from_patch", create_pr)
+    ledger_path = str(tmp_path / "ledger.sqlite")
+
+    def run(**kwargs):
+        lapo_module.lapo(
+            "owner/docs",
+            "docs",
+            "https://github.com/owner/repo/pull/1",
+            retrieval_mode="agent",
+            ledger_path=ledger_path,
+            **kwargs,
+        )
+
+    run()
+    run()
+    assert len(search_agent.calls) == len(patch_agent.calls) == len(created) == 1
+
+    # a new commit in the docs repo is a new run
+    monkeypatch.setattr(lapo_module.git_pr, "rev_parse", lambda path, ref: "e" * 40)
+    run()
+    assert len(created) == 2
+
+    run(force=True)
+    assert len(created) == 3
+
+
+def test_ledger_lookup_does_not_wait_for_the_worktree(pipeline, monkeypatch, tmp_path):
+    events = []
+
+    def add_worktree(mirror, ref, sparse_paths):
+        time.sleep(DELAY)
+        events.append(("worktree", ref))
+        return "/tmp/docs"
+
+    class SearchAgent(FakeAgent):
+        async def run(self, prompt, **kwargs):
+            events.append(("search", None))
+            return await super().run(prompt, **kwargs)
+
+    monkeypatch.setattr(lapo_module.git_worktree, "add_worktree", add_worktree)
+    monkeypatch.setattr(lapo_module.docs_search_agent, "agent", SearchAgent([]))
+
+    lapo_module.lapo(
+        "owner/docs",
+        "docs",
+        "https://github.com/owner/repo/pull/1",
+        retrieval_mode="agent",
+        ledger_path=str(tmp_path / "ledger.sqlite"),
+    )
+
+    # the worktree checks out the commit the run was keyed on
+    assert events == [("search", None), ("worktree", "d" * 40)]
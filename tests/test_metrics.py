@@ -0,0 +1,95 @@
+import asyncio
+import json
+
+import pytest
+from pydantic_ai import Agent
+from pydantic_ai.models.test import TestModel
+
+from src.metrics import Budget, BudgetExceededError, RunMetrics
+from src.rag.embedding_pipeline import BatchEmbeddings, FakeEmbeddings
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def tool_agent():
+    agent = Agent(TestModel())
+
+    @agent.tool_plain
+    def lookup(name: str) -> str:
+        return f"found {name}"
+
+    return agent
+
+
+def test_stage_records_time_usage_and_tool_calls():
+    clock = FakeClock()
+    metrics = RunMetrics(clock=clock)
+
+    with metrics.stage("clone"):
+        clock.now += 2.5
+    with metrics.stage("search_agent") as stage:
+        result = tool_agent().run_sync("hello", usage=stage.usage, usage_limits=metrics.usage_limits())
+        stage.record_messages(result.all_messages())
+
+    report = json.loads(metrics.to_json())
+    clone, search = report["stages"]
+    assert (clone["name"], clone["status"], clone["seconds"]) == ("clone", "ok", 2.5)
+    assert search["requests"] == 2
+    assert search["tool_calls"] == 1
+    assert search["total_tokens"] > 0
+    assert report["totals"]["total_tokens"] == search["total_tokens"]
+
+
+def test_overlapping_stages_count_their_own_embedding_calls():
+    embeddings = BatchEmbeddings(FakeEmbeddings(size=4), batch_size=2)
+    metrics = RunMetrics()
+
+    async def embed(name, texts):
+        with metrics.stage(name):
+            await asyncio.to_thread(embeddings.embed_documents, texts)
+
+    async def run():
+        await asyncio.gather(embed("index_load", ["a", "b", "c"]), embed("retrieval", ["d"]))
+
+    asyncio.run(run())
+
+    counts = {stage.name: (stage.embedding_requests, stage.embedded_texts) for stage in metrics.stages}
+    assert counts == {"index_load": (2, 3), "retrieval": (1, 1)}
+
+
+def test_token_budget_aborts_agent_run():
+    metrics = RunMetrics(Budget(max_total_tokens=10))
+
+    with pytest.raises(BudgetExceededError):
+        with metrics.stage("patch_agent") as stage:
+            tool_agent().run_sync("hello", usage=stage.usage, usage_limits=metrics.usage_limits())
+
+    assert metrics.stages[0].status == "budget_exceeded"
+
+
+def test_wall_time_budget_aborts_before_next_stage():
+    clock = FakeClock()
+    metrics = RunMetrics(Budget(max_seconds=10), clock=clock)
+
+    with pytest.raises(BudgetExceededError):
+        with metrics.stage("clone"):
+            clock.now = 11
+
+    with pytest.raises(BudgetExceededError):
+        with metrics.stage("diff_fetch"):
+            pass
+    assert [stage.name for stage in metrics.stages] == ["clone"]
+
+
+def test_failed_stage_is_reported():
+    metrics = RunMetrics()
+    with pytest.raises(RuntimeError):
+        with metrics.stage("pr_creation"):
+            raise RuntimeError("push rejected")
+    assert metrics.as_dict()["stages"][0]["status"] == "error"
@@ -0,0 +1,87 @@
+from src.tools.search_replace.fuzzy_match import (
+    WHITESPACE_CONFIDENCE,
+    FuzzyMatcher,
+    MatchTier,
+    reindent,
+    strip_blank_lines,
+)
+from src.tools.search_replace.search_replace_apply import (
+    apply_search_replace_to_content,
+    split_block_into_search_replace_pairs,
+)
+from src.tools.search_replace.search_replace_engine import MatchStatus, apply_search_replace_pairs
+
+DOC = """# Config
+
+- item one
+    - nested item  
+    - another nested
+
+Some paragraph about the timeout option.
+It defaults to ten seconds.
+"""
+
+
+def test_exact_tier():
+    match = FuzzyMatcher(DOC).find("- item one")
+    assert match.tier == MatchTier.EXACT
+    assert match.confidence == 1.0
+    assert DOC[match.start : match.end] == "- item one"
+
+
+def test_whitespace_tier_ignores_indentation_and_trailing_spaces():
+    match = FuzzyMatcher(DOC).find("- nested item\n- another nested")
+
+    assert match.tier == MatchTier.WHITESPACE
+    assert DOC[match.start : match.end] == "    - nested item  \n    - another nested"
+    assert reindent("- renamed item", match) == "    - renamed item"
+
+
+def test_fuzzy_tier_tolerates_small_edits():
+    match = FuzzyMatcher(DOC).find("Some paragraph about the timeout option.\nIt defaults to 10 seconds.")
+
+    assert match.tier == MatchTier.FUZZY
+    assert 0.85 <= match.confidence < 1.0
+    assert DOC[match.start : match.end] == "Some paragraph about the timeout option.\nIt defaults to ten seconds."
+
+
+def test_fuzzy_tier_rejects_unrelated_text():
+    assert FuzzyMatcher(DOC).find("Completely different\ntext here.") is None
+
+
+def test_strip_blank_lines_keeps_indentation():
+    assert strip_blank_lines("\n\n    indented\n  \n") == "    indented"
+
+
+def test_engine_reports_fuzzy_matches():
+    result = apply_search_replace_pairs(DOC, [("- nested item\n- another nested", "- only nested")])
+
+    assert "\n    - only nested\n\nSome paragraph" in result.content
+    assert result.results[0].status == MatchStatus.FUZZY
+    assert (result.results[0].start_line, result.results[0].end_line) == (4, 5)
+
+
+def test_split_pairs_keeps_search_indentation():
+    block = "docs/file.md\n```markdown\n<<<<<<< SEARCH\n\n    indented\n=======\n    changed\n>>>>>>> REPLACE\n```"
+    assert split_block_into_search_replace_pairs(block) == [("    indented", "    changed")]
+
+
+def test_apply_search_replace_to_content_with_indentation_mismatch():
+    source = "Intro\n\n    code line\n    second line\n"
+    patch = "docs/file.md\n```markdown\n<<<<<<< SEARCH\ncode line\nsecond line\n=======\ncode line\nnew line\n>>>>>>> REPLACE\n```"
+
+    result, success = apply_search_replace_to_content(source, patch)
+
+    assert success is True
+    assert result == "Intro\n\n    code line\n    new line\n"
+
+
+def test_engine_matches_chained_edit_ignoring_indentation():
+    pairs = [("old", "    code line\n    second line"), ("code line\nsecond line", "code line\nnew line")]
+
+    result = apply_search_replace_pairs("Intro\n\nold\n", pairs)
+
+    assert result.content == "Intro\n\n    code line\n    new line\n"
+    assert result.all_applied
+    assert (result.results[1].status, result.results[1].confidence) == (MatchStatus.FUZZY, WHITESPACE_CONFIDENCE)
+    assert (result.results[1].start_line, result.results[1].end_line) == (3, 4)
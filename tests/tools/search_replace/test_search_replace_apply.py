@@ -3,6 +3,7 @@ from src.tools.search_replace.search_replace_apply import (
     split_block_into_search_replace_pairs,
     apply_search_replace_pairs_to_content,
     apply_search_replace_to_content,
+    dry_run_search_replace,
 )
 
 
@@ -272,3 +273,18 @@ def test_apply_search_replace_to_content_with_empty_patch_and_filename():
     result, success = apply_search_replace_to_content(source, patch, target_filename="docusaurus/docs/file.md")
     assert result == "Original content"
     assert success is True  # Empty patches return True regardless of target_filename
+
+
+def test_dry_run_rejects_paths_outside_the_repository(tmp_path):
+    repo = tmp_path / "repo"
+    (repo / "docs").mkdir(parents=True)
+    (repo / "docs" / "page.md").write_text("old text\n")
+    (tmp_path / "secret.md").write_text("old text\n")
+    (repo / "docs" / "link.md").symlink_to(tmp_path / "secret.md")
+    block = "{}\n```markdown\n<<<<<<< SEARCH\nold text\n=======\nnew text\n>>>>>>> REPLACE\n```"
+    paths = ["docs/page.md", "../secret.md", str(tmp_path / "secret.md"), "docs/link.md"]
+
+    failures = dry_run_search_replace(str(repo), "\n\n".join(block.format(path) for path in paths))
+
+    assert [failure.file_path for failure in failures] == paths[1:]
+    assert all(failure.reason == "the path is outside the docs repository" for failure in failures)
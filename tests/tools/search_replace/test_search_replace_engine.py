@@ -0,0 +1,73 @@
+from src.tools.search_replace.search_replace_engine import (
+    MatchStatus,
+    MultiPatternMatcher,
+    apply_search_replace_pairs,
+)
+
+
+def test_matcher_finds_first_occurrence_and_count():
+    matcher = MultiPatternMatcher(["he", "she", "hers", "his", "", "aa", "x"])
+    assert matcher.find_first("ushers his he aaa") == [(2, 2), (1, 1), (2, 1), (7, 1), (-1, 0), (14, 2), (-1, 0)]
+
+
+def test_apply_reports_offsets_and_line_ranges():
+    content = "# Title\n\nold intro\n\n## Usage\nold usage\nmore\n"
+    result = apply_search_replace_pairs(content, [("old usage\nmore", "new usage"), ("old intro", "new intro")])
+
+    assert result.content == "# Title\n\nnew intro\n\n## Usage\nnew usage\n"
+    assert result.all_applied
+    usage, intro = result.results
+    assert (usage.status, usage.offset, usage.start_line, usage.end_line) == (MatchStatus.APPLIED, 29, 6, 7)
+    assert (intro.status, intro.offset, intro.start_line, intro.end_line) == (MatchStatus.APPLIED, 9, 3, 3)
+
+
+def test_apply_replaces_only_first_occurrence_of_ambiguous_search():
+    result = apply_search_replace_pairs("a = 1\na = 1\n", [("a = 1", "a = 2")])
+
+    assert result.content == "a = 2\na = 1\n"
+    assert result.results[0].status == MatchStatus.AMBIGUOUS
+    assert result.results[0].occurrences == 2
+    assert result.results[0].start_line == 1
+
+
+def test_apply_reports_missing_search():
+    result = apply_search_replace_pairs("content", [("missing", "x"), ("content", "changed")])
+
+    assert result.content == "changed"
+    assert [r.status for r in result.results] == [MatchStatus.NOT_FOUND, MatchStatus.APPLIED]
+    assert [r.index for r in result.failed()] == [0]
+
+
+def test_apply_overlapping_pair_against_edited_content():
+    result = apply_search_replace_pairs("abcdef", [("abcd", "ABCD"), ("cdef", "CDEF"), ("bc", "x")])
+
+    # "cdef" and "bc" overlap the replaced "abcd" and no longer exist in the edited text
+    assert result.content == "ABCDef"
+    assert [(r.status, r.applied) for r in result.results] == [
+        (MatchStatus.APPLIED, True),
+        (MatchStatus.OVERLAP, False),
+        (MatchStatus.OVERLAP, False),
+    ]
+
+
+def test_apply_chained_edits_in_order():
+    result = apply_search_replace_pairs("old line\n", [("old line", "new line"), ("new line", "newer line")])
+
+    assert result.content == "newer line\n"
+    assert [(r.status, r.applied) for r in result.results] == [
+        (MatchStatus.APPLIED, True),
+        (MatchStatus.APPLIED, True),
+    ]
+
+
+def test_apply_chained_edit_spanning_an_earlier_replacement():
+    result = apply_search_replace_pairs("one\ntwo\nthree\n", [("one", "uno"), ("uno\ntwo", "uno\ndos")])
+
+    assert result.content == "uno\ndos\nthree\n"
+    assert result.all_applied
+    assert (result.results[1].offset, result.results[1].start_line, result.results[1].end_line) == (0, 1, 2)
+
+
+def test_apply_empty_search_only_matches_empty_content():
+    assert apply_search_replace_pairs("", [("", "new file\n")]).content == "new file\n"
+    assert apply_search_replace_pairs("content", [("", "x")]).results[0].status == MatchStatus.NOT_FOUND
@@ -0,0 +1,86 @@
+from src.tools.search_replace.search_replace_parser import (
+    MISSING_CLOSING_FENCE,
+    MISSING_REPLACE,
+    format_pairs,
+    parse_patch,
+)
+
+PATCH = """docs/one.md
+```markdown
+<<<<<<< SEARCH
+Run the server:
+```bash
+npm run server
+```
+=======
+Run the server:
+```bash
+npm run dev
+```
+>>>>>>> REPLACE
+
+docs/two.md
+<<<<<<< SEARCH
+    indented
+=======
+    changed
+>>>>>>> REPLACE
+```
+"""
+
+
+def test_parse_patch_builds_blocks_and_pairs_with_line_numbers():
+    patch = parse_patch(PATCH)
+
+    assert patch.errors == ()
+    assert len(patch.blocks) == 1
+    block = patch.blocks[0]
+    assert (block.file_path, block.start_line, block.end_line) == ("docs/one.md", 1, 21)
+    first, second = block.pairs
+    assert (first.file_path, first.start_line, first.end_line) == ("docs/one.md", 3, 13)
+    # code fences inside a section are content, not the end of the block
+    assert first.search == "Run the server:\n```bash\nnpm run server\n```"
+    assert (second.file_path, second.search, second.replace) == ("docs/two.md", "    indented", "    changed")
+
+
+def test_files_groups_pairs_by_retargeted_path():
+    files = parse_patch(PATCH).files()
+    assert list(files) == ["docs/one.md", "docs/two.md"]
+    assert [len(pairs) for pairs in files.values()] == [1, 1]
+
+
+def test_parse_patch_is_cached():
+    assert parse_patch(PATCH) is parse_patch(PATCH)
+
+
+def test_unterminated_pair_is_reported_before_missing_fence():
+    patch = parse_patch("docs/a.md\n```\n<<<<<<< SEARCH\nold\n=======\nnew\n```\n")
+    assert patch.first_error().message == MISSING_REPLACE
+    assert patch.first_error().line == 3
+
+
+def test_missing_closing_fence_is_structural():
+    patch = parse_patch("docs/a.md\n```\n<<<<<<< SEARCH\nold\n=======\n\n>>>>>>> REPLACE\n")
+    # the empty replace section is only reported once the layout is valid
+    assert [(e.message, e.structural) for e in patch.errors] == [
+        ("Replace section is empty", False),
+        (MISSING_CLOSING_FENCE, True),
+    ]
+    assert patch.first_error().message == MISSING_CLOSING_FENCE
+
+
+def test_bare_opening_fence_does_not_close_the_block():
+    patch = parse_patch("README.md\n```\n<<<<<<< SEARCH\nold\n=======\nnew\n>>>>>>> REPLACE\n```")
+    assert patch.errors == ()
+    assert patch.files()["README.md"][0].replace == "new"
+
+
+def test_pathless_block_uses_default_path():
+    patch = parse_patch("```\n<<<<<<< SEARCH\nold\n=======\nnew\n>>>>>>> REPLACE\n```", "docs/a.md")
+    assert patch.first_error().structural
+    assert patch.pairs[0].file_path == "docs/a.md"
+
+
+def test_format_pairs_round_trips():
+    pairs = parse_patch(PATCH).files()["docs/one.md"]
+    assert parse_patch(format_pairs("docs/one.md", pairs)).files()["docs/one.md"] == pairs
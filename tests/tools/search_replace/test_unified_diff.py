@@ -0,0 +1,104 @@
+import subprocess
+
+import pytest
+
+from src.tools.search_replace.search_replace_apply import generate_git_patch_from_search_replace
+from src.tools.search_replace.unified_diff import generate_unified_diff
+
+
+def git(repo, *args, **kwargs):
+    return subprocess.run(["git", *args], cwd=repo, check=True, capture_output=True, **kwargs)
+
+
+@pytest.fixture
+def repo(tmp_path):
+    git(tmp_path, "init", "-q")
+    return tmp_path
+
+
+def apply_and_read(repo, path, original, patch):
+    (repo / path).parent.mkdir(parents=True, exist_ok=True)
+    (repo / path).write_bytes(original.encode())
+    (repo / "change.patch").write_bytes(patch.encode())
+    git(repo, "apply", "--check", "change.patch")
+    git(repo, "apply", "change.patch")
+    return (repo / path).read_bytes().decode()
+
+
+ORIGINAL = "".join(f"line {i}\n" for i in range(1, 21))
+
+
+@pytest.mark.parametrize(
+    "modified",
+    [
+        ORIGINAL.replace("line 2\n", "line two\n").replace("line 18\n", "line eighteen\n"),
+        ORIGINAL + "appended\n",
+        "prepended\n" + ORIGINAL,
+        ORIGINAL.replace("line 10\n", ""),
+        ORIGINAL.rstrip("\n"),
+        ORIGINAL.rstrip("\n") + " changed",
+        "",
+    ],
+)
+def test_generated_diff_applies_with_git(repo, modified):
+    patch = generate_unified_diff("docs/page.md", ORIGINAL, modified)
+    assert patch.startswith("diff --git a/docs/page.md b/docs/page.md\n--- a/docs/page.md\n+++ b/docs/page.md\n@@")
+    assert apply_and_read(repo, "docs/page.md", ORIGINAL, patch) == modified
+
+
+def test_generated_diff_marks_missing_newline(repo):
+    original = "first\nlast"
+    patch = generate_unified_diff("a.md", original, "first\nlast changed")
+
+    assert patch.endswith("-last\n\\ No newline at end of file\n+last changed\n\\ No newline at end of file\n")
+    assert apply_and_read(repo, "a.md", original, patch) == "first\nlast changed"
+
+
+def test_generated_diff_keeps_crlf_line_endings(repo):
+    original = "one\r\ntwo\r\n"
+    modified = "one\r\n2\r\n"
+    assert apply_and_read(repo, "a.md", original, generate_unified_diff("a.md", original, modified)) == modified
+
+
+def test_generated_diff_only_splits_lines_on_newlines(repo):
+    original = "# Page\fbreak\nsee\u2028below\x85here\n\nold\rtext\nend\n"
+    modified = original.replace("old", "new")
+
+    patch = generate_unified_diff("a.md", original, modified)
+
+    assert "No newline" not in patch
+    assert apply_and_read(repo, "a.md", original, patch) == modified
+
+
+def test_no_diff_for_equal_contents():
+    assert generate_unified_diff("a.md", "same\n", "same\n") == ""
+
+
+def test_generate_git_patch_from_search_replace_for_several_files(repo):
+    (repo / "docs").mkdir()
+    (repo / "docs" / "one.md").write_text("# One\n\nold text\n")
+    (repo / "docs" / "two.md").write_text("# Two\n\nold text\n")
+    blocks = """docs/one.md
+```markdown
+<<<<<<< SEARCH
+old text
+=======
+new text
+>>>>>>> REPLACE
+```
+
+docs/two.md
+```markdown
+<<<<<<< SEARCH
+# Two
+=======
+# Second
+>>>>>>> REPLACE
+```"""
+
+    patch = generate_git_patch_from_search_replace(str(repo), blocks)
+    (repo / "change.patch").write_text(patch)
+    git(repo, "apply", "change.patch")
+
+    assert (repo / "docs" / "one.md").read_text() == "# One\n\nnew text\n"
+    assert (repo / "docs" / "two.md").read_text() == "# Second\n\nold text\n"
@@ -0,0 +1,105 @@
+import os
+
+from src.tools.document_store import DocumentStore
+
+DOC = """---
+title: Guide
+---
+# Guide
+
+Intro.
+
+## Install
+
+### Linux
+
+apt install plugin
+
+## Configure
+
+```
+# not a heading
+```
+"""
+
+
+def write(root, name, content):
+    path = root / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content)
+    return path
+
+
+def test_get_caches_documents(tmp_path):
+    write(tmp_path, "docs/guide.md", DOC)
+    store = DocumentStore(str(tmp_path))
+
+    first = store.get("docs/guide.md")
+    assert store.get("./docs/guide.md") is first
+    assert first.content == DOC
+    assert store.stats()["hits"] == 1
+    assert store.stats()["misses"] == 1
+
+
+def test_get_rereads_modified_files(tmp_path):
+    path = write(tmp_path, "a.md", "old\n")
+    store = DocumentStore(str(tmp_path))
+    store.get("a.md")
+
+    path.write_text("new\n")
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1_000_000))
+
+    assert store.get("a.md").content == "new\n"
+
+
+def test_get_rejects_missing_files_and_paths_outside_the_root(tmp_path):
+    write(tmp_path, "inside/a.md", "a")
+    store = DocumentStore(str(tmp_path / "inside"))
+    assert store.get("missing.md") is None
+    assert store.get("../inside/a.md") is None
+
+
+def test_get_rejects_symlinks_out_of_the_root(tmp_path):
+    write(tmp_path, "secret.md", "secret")
+    write(tmp_path, "docs/a.md", "a")
+    os.symlink(tmp_path / "secret.md", tmp_path / "docs" / "link.md")
+    os.symlink(tmp_path, tmp_path / "docs" / "parent")
+    os.symlink(tmp_path / "docs" / "a.md", tmp_path / "docs" / "alias.md")
+    store = DocumentStore(str(tmp_path / "docs"))
+
+    assert store.get("link.md") is None
+    assert store.get("parent/secret.md") is None
+    assert store.get("alias.md").content == "a"
+
+
+def test_store_evicts_least_recently_used_by_bytes(tmp_path):
+    for name in ("a.md", "b.md", "c.md"):
+        write(tmp_path, name, "x" * 10)
+    store = DocumentStore(str(tmp_path), max_bytes=25)
+
+    store.get("a.md")
+    store.get("b.md")
+    store.get("a.md")
+    store.get("c.md")
+
+    assert store.stats()["evictions"] == 1
+    assert store.stats()["bytes"] == 20
+    store.get("a.md")
+    assert store.stats()["hits"] == 2
+
+
+def test_table_of_contents_and_sections(tmp_path):
+    write(tmp_path, "guide.md", DOC)
+    document = DocumentStore(str(tmp_path)).get("guide.md")
+
+    toc = [(e.level, e.path, e.start_line, e.end_line) for e in document.table_of_contents()]
+    assert toc == [
+        (1, "Guide", 4, 18),
+        (2, "Guide > Install", 8, 13),
+        (3, "Guide > Install > Linux", 10, 13),
+        (2, "Guide > Configure", 14, 18),
+    ]
+    assert document.find_section("## linux").start_line == 10
+    assert document.find_section("Guide > Configure").end_line == 18
+    assert document.line_range(10, 12) == (10, 12, "### Linux\n\napt install plugin\n")
+    assert document.line_range(17, 100) == (17, 18, "# not a heading\n```\n")